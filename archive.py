@@ -0,0 +1,347 @@
+"""
+Архив закрытых месяцев: горячая report.db держит только последние месяцы,
+остальное переезжает в отдельные файлы data/archive/ГГГГ-ММ.db — строки entries
+и готовые итоги по группам и дням (day_totals) того же вида, что в основной базе.
+
+Отчёты за период и выгрузка подключают (ATTACH) только архивы нужных месяцев,
+по одному за раз, так что лимит SQLite на число подключённых баз не мешает.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import Callable
+
+import aiosqlite
+
+from dbconn import Database
+from schema import day_date, day_number
+from totals import DayTotals
+
+log = logging.getLogger(__name__)
+
+ALIAS = "arc"
+ARCHIVE_VERSION = 2  # PRAGMA user_version файла архива; 1 — итоги без разбивки по группам
+_COLUMNS = "id, ts, day, amount_fen, is_discount, chat_id, msg_id, sender_id"
+_NAME_RE = re.compile(r"^(\d{4})-(\d{2})\.db$")
+
+# Та же структура, что в schema.py, но без триггеров: архив пишется только здесь,
+# и итоги по дням пересчитываются явно после каждого перенесённого дня.
+_ARCHIVE_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS {s}.entries(
+        id INTEGER PRIMARY KEY,
+        ts INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        amount_fen INTEGER NOT NULL,
+        is_discount INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        msg_id INTEGER NOT NULL,
+        sender_id INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS {s}.idx_entries_chat_day ON entries(chat_id, day, is_discount, amount_fen)",
+    """
+    CREATE TABLE IF NOT EXISTS {s}.day_totals(
+        chat_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        sum_no INTEGER NOT NULL DEFAULT 0,
+        sum_disc INTEGER NOT NULL DEFAULT 0,
+        cnt INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, day)
+    ) WITHOUT ROWID
+    """,
+    f"PRAGMA {{s}}.user_version={ARCHIVE_VERSION}",
+)
+_FILL_TOTALS = """
+    INSERT INTO {s}.day_totals(chat_id, day, sum_no, sum_disc, cnt)
+    SELECT chat_id, day,
+           COALESCE(SUM(CASE WHEN is_discount=0 THEN amount_fen END), 0),
+           COALESCE(SUM(CASE WHEN is_discount=1 THEN amount_fen END), 0),
+           COUNT(*)
+    FROM {s}.entries WHERE {where} GROUP BY chat_id, day
+"""
+
+
+def month_start(d: date, back: int = 0) -> date:
+    """Первое число месяца, отстоящего от месяца d на back назад."""
+    m = d.year * 12 + d.month - 1 - back
+    return date(m // 12, m % 12 + 1, 1)
+
+
+def month_days(year: int, month: int) -> tuple[int, int]:
+    """Номера первого и последнего дня месяца (schema.day_number)."""
+    first = date(year, month, 1)
+    return day_number(first), day_number(month_start(first, -1)) - 1
+
+
+def archive_name(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}.db"
+
+
+def list_archives(directory: Path) -> list[tuple[int, int, Path]]:
+    """Имеющиеся архивы: [(год, месяц, путь)] по возрастанию."""
+    if not directory.is_dir():
+        return []
+    out = []
+    for p in directory.iterdir():
+        m = _NAME_RE.match(p.name)
+        if m:
+            out.append((int(m[1]), int(m[2]), p))
+    return sorted(out)
+
+
+def archives_for(directory: Path, start_day: int, end_day: int) -> list[Path]:
+    """Архивы месяцев, пересекающихся с [start_day, end_day]."""
+    out = []
+    for y, m, p in list_archives(directory):
+        d0, d1 = month_days(y, m)
+        if d0 <= end_day and d1 >= start_day:
+            out.append(p)
+    return out
+
+
+@asynccontextmanager
+async def attached(conn: aiosqlite.Connection, path: Path, read_only: bool = False):
+    """
+    Подключает архив к соединению под именем arc и отключает при выходе.
+    read_only — для соединений из пула читателей (они открыты с uri=True).
+    """
+    target = f"file:{path.resolve().as_posix()}?mode=ro" if read_only else str(path)
+    await conn.execute(f"ATTACH DATABASE ? AS {ALIAS}", (target,))
+    try:
+        yield ALIAS
+    finally:
+        # DETACH невозможен посреди транзакции
+        if conn.in_transaction:
+            await conn.rollback()
+        await conn.execute(f"DETACH DATABASE {ALIAS}")
+
+
+async def range_totals(conn: aiosqlite.Connection, directory: Path, chat_id: int,
+                       start_day: int, end_day: int) -> dict[int, DayTotals]:
+    """Итоги группы по дням за [start_day, end_day]: горячая day_totals плюс нужные архивы."""
+    out: dict[int, DayTotals] = {}
+
+    async def collect(table: str):
+        async with conn.execute(
+            f"SELECT day, sum_no, sum_disc, cnt FROM {table} WHERE chat_id=? AND day BETWEEN ? AND ?",
+            (chat_id, start_day, end_day)
+        ) as cur:
+            for d, sn, sd, c in await cur.fetchall():
+                t = out.setdefault(d, DayTotals())
+                t.sum_no += sn
+                t.sum_disc += sd
+                t.count += c
+
+    for path in archives_for(directory, start_day, end_day):
+        async with attached(conn, path, read_only=True) as s:
+            await collect(f"{s}.day_totals")
+    await collect("main.day_totals")
+    return out
+
+
+@dataclass
+class ArchiveResult:
+    months: list[tuple[str, int]] = field(default_factory=list)  # (ГГГГ-ММ, строк перенесено)
+    expired: list[str] = field(default_factory=list)             # удалённые по сроку хранения
+    seconds: float = 0.0
+
+    @property
+    def rows(self) -> int:
+        return sum(n for _, n in self.months)
+
+
+class Archiver:
+    """
+    Переносит закрытые месяцы из горячей базы в помесячные архивы.
+
+    hot_months — сколько закрытых месяцев остаётся в горячей базе кроме текущего (не меньше 1:
+    вчерашние сообщения ещё правят и удаляют); keep_months — сколько месяцев хранить архивы
+    (0 — бессрочно); vacuum — сжимать архив через VACUUM INTO после переноса.
+
+    Перенос идёт по дням, каждый день — под общим замком записи: копия в архив (commit),
+    проверка, что скопировано всё, затем удаление из горячей базы (триггеры убирают
+    и её day_totals). Прерванный перенос безопасно повторить: копирование идёт с OR IGNORE.
+    """
+
+    def __init__(self, db: Database, directory: Path, hot_months: int = 2, keep_months: int = 0,
+                 vacuum: bool = True):
+        self.db = db
+        self.directory = Path(directory)
+        self.hot_months = max(1, hot_months)
+        self.keep_months = max(0, keep_months)
+        self.vacuum = vacuum
+        self.last: ArchiveResult | None = None
+        self._lock = asyncio.Lock()
+        self._after_archive: list[Callable[[int], None]] = []
+        self._task: asyncio.Task | None = None
+        self._closing = asyncio.Event()
+
+    def add_after_archive(self, callback: Callable[[int], None]):
+        """callback(day) вызывается после того, как день убран из горячей базы."""
+        self._after_archive.append(callback)
+
+    def hot_start(self, today: date) -> date:
+        """С этого дня записи живут в горячей базе."""
+        return month_start(today, self.hot_months)
+
+    def path_for(self, year: int, month: int) -> Path:
+        return self.directory / archive_name(year, month)
+
+    def is_archived(self, d: date, today: date) -> bool:
+        """Записи за день d уже перенесены (или переносятся) в архив."""
+        return d < self.hot_start(today) and self.path_for(d.year, d.month).exists()
+
+    # ---------- перенос ----------
+    async def run(self, today: date) -> ArchiveResult:
+        async with self._lock:
+            t0 = time.monotonic()
+            res = ArchiveResult()
+            border = day_number(self.hot_start(today))
+            prev = None
+            while not self._closing.is_set():
+                async with self.db.read() as conn:
+                    # дни с записями — по day_totals (строка на группу и день), а не по всей entries
+                    async with conn.execute("SELECT MIN(day) FROM day_totals WHERE day < ?", (border,)) as cur:
+                        (first,) = await cur.fetchone()
+                if first is None:
+                    break
+                if first == prev:
+                    # перенос не убрал день из day_totals — не повторяем его без конца под замком записи
+                    log.error("Архив: %s остаётся в day_totals после переноса, перенос остановлен", day_date(first))
+                    break
+                prev = first
+                d = day_date(first)
+                rows = await self.archive_month(d.year, d.month)
+                res.months.append((f"{d.year:04d}-{d.month:02d}", rows))
+            res.expired = self.expire(today)
+            res.seconds = time.monotonic() - t0
+            self.last = res
+            return res
+
+    async def archive_month(self, year: int, month: int) -> int:
+        d0, d1 = month_days(year, month)
+        path = self.path_for(year, month)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        async with self.db.read() as conn:
+            async with conn.execute("SELECT DISTINCT day FROM day_totals WHERE day BETWEEN ? AND ? ORDER BY day",
+                                    (d0, d1)) as cur:
+                days = [d for (d,) in await cur.fetchall()]
+        moved = 0
+        for d in days:
+            if self._closing.is_set():
+                return moved
+            moved += await self._move_day(path, d)
+            for cb in self._after_archive:
+                cb(d)
+        if self.vacuum and days:
+            await compact(path)
+        log.info("Архив %s: перенесено %s строк за %s дн.", path.name, moved, len(days))
+        return moved
+
+    async def _move_day(self, path: Path, d: int) -> int:
+        async with self.db.write() as conn:
+            async with attached(conn, path) as s:
+                for sql in _ARCHIVE_TABLES:
+                    await conn.execute(sql.format(s=s))
+                await conn.execute(
+                    f"INSERT OR IGNORE INTO {s}.entries({_COLUMNS}) SELECT {_COLUMNS} FROM main.entries WHERE day=?",
+                    (d,)
+                )
+                await conn.execute(f"DELETE FROM {s}.day_totals WHERE day=?", (d,))
+                await conn.execute(_FILL_TOTALS.format(s=s, where="day=?"), (d,))
+                async with conn.execute(f"""
+                    SELECT COUNT(*) FROM main.entries m
+                    WHERE m.day=? AND NOT EXISTS (SELECT 1 FROM {s}.entries a WHERE a.id = m.id)
+                """, (d,)) as cur:
+                    (missing,) = await cur.fetchone()
+                if missing:
+                    raise RuntimeError(f"Архив {path.name}: за {day_date(d)} не скопировано {missing} строк")
+                # Архив фиксируется раньше, чем строки уходят из горячей базы: транзакция
+                # над несколькими файлами при WAL не атомарна, а так сбой оставит лишь дубль.
+                await conn.commit()
+                cur = await conn.execute("DELETE FROM main.entries WHERE day=?", (d,))
+                removed = cur.rowcount
+                # строк дня не осталось, триггеры убрали их итоги; что осталось в day_totals — расхождение,
+                # и без удаления run выбирал бы этот день снова и снова
+                cur = await conn.execute("DELETE FROM main.day_totals WHERE day=?", (d,))
+                if cur.rowcount:
+                    log.warning("day_totals за %s расходились с entries: убрано %s строк итогов",
+                                day_date(d), cur.rowcount)
+                await conn.commit()
+        return removed
+
+    async def upgrade(self) -> list[str]:
+        """Доводит архивы прежнего формата до ARCHIVE_VERSION. Возвращает имена обновлённых."""
+        done = []
+        for _, _, path in list_archives(self.directory):
+            async with aiosqlite.connect(path) as conn:
+                async with conn.execute("PRAGMA user_version") as cur:
+                    (version,) = await cur.fetchone()
+                if version >= ARCHIVE_VERSION:
+                    continue
+                # v1: итоги только по дню, индекс по дню — перестраиваются из строк архива
+                await conn.execute("DROP TABLE IF EXISTS day_totals")
+                await conn.execute("DROP INDEX IF EXISTS idx_entries_day")
+                for sql in _ARCHIVE_TABLES:
+                    await conn.execute(sql.format(s="main"))
+                await conn.execute(_FILL_TOTALS.format(s="main", where="1"))
+                await conn.commit()
+            done.append(path.name)
+            log.info("Архив %s обновлён до версии %s", path.name, ARCHIVE_VERSION)
+        return done
+
+    def expire(self, today: date) -> list[str]:
+        """Удаляет архивы старше keep_months месяцев."""
+        if not self.keep_months:
+            return []
+        border = month_start(today, self.keep_months)
+        removed = []
+        for y, m, p in list_archives(self.directory):
+            if date(y, m, 1) < border:
+                p.unlink(missing_ok=True)
+                removed.append(p.name)
+                log.info("Архив %s удалён по сроку хранения", p.name)
+        return removed
+
+    # ---------- фоновый запуск ----------
+    def start(self, interval: float, today: Callable[[], date]):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(interval, today), name="archiver")
+
+    async def stop(self):
+        # не cancel(): перенос дня прервался бы между копией и удалением
+        self._closing.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self, interval: float, today: Callable[[], date]):
+        while not self._closing.is_set():
+            try:
+                res = await self.run(today())
+                if res.months or res.expired:
+                    log.info("Архивация: %s строк из %s, удалено по сроку: %s, %.1f с",
+                             res.rows, [m for m, _ in res.months], res.expired, res.seconds)
+            except Exception:
+                log.exception("Архивация не удалась")
+            try:
+                await asyncio.wait_for(self._closing.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def compact(path: Path):
+    """VACUUM INTO во временный файл и подмена: архив без пустых страниц, индексы подряд."""
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.unlink(missing_ok=True)
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute("VACUUM INTO ?", (str(tmp),))
+    # уже подключённые читатели дочитают прежний файл: на POSIX он живёт, пока открыт
+    os.replace(tmp, path)
@@ -0,0 +1,112 @@
+"""
+Догрузка после простоя: пачками через catchup.Catchup против подачи тех же апдейтов
+по одному в dp.feed_update (как их обработал бы polling). Поддельный Telegram отдаёт
+накопленное через getUpdates. Печатает время, число вызовов Bot API и сверяет,
+что итоги в базе совпали.
+
+    python bench/catchup.py [--updates 2000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from fake_telegram import FAKE_TOKEN, FakeSession, make_update, start_app, stop_app
+
+
+def backlog(app, n: int, seed: int = 1) -> list[dict]:
+    """Сообщения менеджеров с суммами, правки, болтовня, /undo и немного личных диалогов."""
+    rnd = random.Random(seed)
+    out, sent = [], []
+    chat = app.MANAGER_CHAT_ID
+    for i in range(1, n + 1):
+        r = rnd.random()
+        user = 100 + rnd.randrange(5)
+        if r < 0.7 or not sent:
+            text = "\n".join(f"{rnd.choice(('bs', 's'))}{rnd.randint(100, 40000)}" for _ in range(rnd.randint(1, 8)))
+            out.append(make_update(i, chat, user, i, text))
+            sent.append((i, user))
+        elif r < 0.85:
+            msg_id, user = rnd.choice(sent[-100:])
+            out.append(make_update(i, chat, user, msg_id, f"bs{rnd.randint(100, 40000)}", edited=True))
+        elif r < 0.95:
+            out.append(make_update(i, chat, user, i, rnd.choice(("ок", "спасибо", "+"))))
+        elif r < 0.98:
+            out.append(make_update(i, chat, user, i, "/undo"))
+        else:
+            out.append(make_update(i, 10_000 + i, 10_000 + i, i, "/start"))
+    return out
+
+
+def unlimited_outbox(app):
+    # без лимитов Telegram: иначе оба прогона упрутся в 20 сообщений в минуту на группу
+    from outbox import Outbox
+    app.outbox = Outbox(app.bot, global_rate=1e9, group_rate=1e9, private_rate=1e9, burst=1e9, max_queue=10**9)
+    app.outbox.set_summarizer("accepted", app._summarize_accepted)
+
+
+async def totals(app) -> tuple[int, int]:
+    await app.ingest.flush()
+    async with app.db.read() as conn:
+        async with conn.execute("SELECT COUNT(*), COALESCE(SUM(amount_fen), 0) FROM entries") as cur:
+            return tuple(await cur.fetchone())
+
+
+async def reset(app):
+    async with app.db.write() as conn:
+        await conn.execute("DELETE FROM entries")
+        await conn.execute("DELETE FROM undo_journal")
+    async with app.db.read() as conn:
+        await app.totals_cache.warm(conn)
+    await app.undo_journal.load()
+    app.fingerprints.clear()
+
+
+async def run(n: int):
+    import main as app
+    from aiogram.types import Update
+
+    session = FakeSession()
+    await start_app(app, session)
+    try:
+        updates = backlog(app, n)
+
+        unlimited_outbox(app)
+        session.backlog, session.calls = list(updates), []
+        t0 = time.perf_counter()
+        await app.catch_up()
+        await app.outbox.stop()
+        bulk_time, bulk_calls = time.perf_counter() - t0, len(session.calls)
+        bulk = await totals(app)
+
+        await reset(app)
+        unlimited_outbox(app)
+        session.calls = []
+        t0 = time.perf_counter()
+        for u in updates:
+            await app.dp.feed_update(app.bot, Update.model_validate(u, context={"bot": app.bot}))
+        await app.outbox.stop()
+        one_time, one_calls = time.perf_counter() - t0, len(session.calls)
+        one = await totals(app)
+    finally:
+        await stop_app(app)
+
+    print(f"апдейтов: {n}")
+    print(f"пачками:  {bulk_time:6.2f} с, вызовов Bot API {bulk_calls:5d}, строк {bulk[0]}, фэней {bulk[1]}")
+    print(f"по одному:{one_time:6.2f} с, вызовов Bot API {one_calls:5d}, строк {one[0]}, фэней {one[1]}")
+    print(f"ускорение x{one_time / bulk_time:.1f}; итоги {'совпадают' if bulk == one else 'НЕ совпадают'}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--updates", type=int, default=2000)
+    args = ap.parse_args()
+    os.environ.setdefault("TGTOKEN", FAKE_TOKEN)
+    os.chdir(tempfile.mkdtemp(prefix="catchup_"))  # data/ создаётся во временном каталоге
+    asyncio.run(run(args.updates))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Бенчмарк потоковой выгрузки /export: время и пиковая память Python на 10k…300k строк.
+Пиковая память (tracemalloc) должна оставаться примерно постоянной при росте объёма.
+
+    python bench/export_memory.py [--rows 10000 100000 300000] [--fmt csv]
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiosqlite  # noqa: E402
+
+from export import export_entries  # noqa: E402
+from schema import day_number, epoch  # noqa: E402
+
+MSK = timezone(timedelta(hours=3))
+
+SCHEMA = """
+CREATE TABLE entries(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    amount_fen INTEGER NOT NULL,
+    is_discount INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    msg_id INTEGER NOT NULL,
+    sender_id INTEGER
+);
+CREATE INDEX idx_entries_chat_day ON entries(chat_id, day, is_discount, amount_fen);
+"""
+
+
+def make_db(path: Path, rows: int, days: int = 365):
+    rnd = random.Random(1)
+    start = date(2025, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    batch = []
+    for i in range(rows):
+        d = start + timedelta(days=i * days // rows)
+        batch.append((epoch(datetime(d.year, d.month, d.day, 12, tzinfo=MSK)), day_number(d), rnd.randint(100, 50000) * 100,
+                      rnd.randint(0, 1), -100, i // 3, rnd.randint(1, 20)))
+        if len(batch) >= 50000:
+            conn.executemany("INSERT INTO entries(ts,day,amount_fen,is_discount,chat_id,msg_id,sender_id) "
+                             "VALUES(?,?,?,?,?,?,?)", batch)
+            batch.clear()
+    if batch:
+        conn.executemany("INSERT INTO entries(ts,day,amount_fen,is_discount,chat_id,msg_id,sender_id) "
+                         "VALUES(?,?,?,?,?,?,?)", batch)
+    conn.commit()
+    conn.close()
+
+
+async def run_one(db_path: Path, out_path: Path, fmt: str) -> tuple[int, float, int]:
+    async with aiosqlite.connect(db_path) as conn:
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        n = await export_entries(conn, -100, date(2025, 1, 1), date(2025, 12, 31), out_path, 0.15, 0.10,
+                                 tz=MSK, fmt=fmt)
+        elapsed = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return n, elapsed, peak
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 300_000])
+    ap.add_argument("--fmt", default="csv", choices=["csv", "xlsx"])
+    args = ap.parse_args()
+
+    print(f"{'rows':>10} {'time, s':>9} {'rows/s':>10} {'peak py mem, MiB':>17} {'file, MiB':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            db_path = Path(tmp) / f"bench_{rows}.db"
+            out_path = Path(tmp) / f"out_{rows}.{args.fmt}"
+            make_db(db_path, rows)
+            n, elapsed, peak = asyncio.run(run_one(db_path, out_path, args.fmt))
+            print(f"{n:>10} {elapsed:>9.2f} {n / elapsed:>10.0f} {peak / 2**20:>17.2f} "
+                  f"{out_path.stat().st_size / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""
+Локальная проверка webhook-режима без Telegram: бот (main.py) поднимается в этом процессе
+с поддельной сессией Bot API, а «фейковый Telegram» шлёт апдейты HTTP-запросами на сервер —
+с верным секретом, с неверным и во время остановки. Всё пишется во временный каталог.
+
+    python bench/fake_telegram.py [--updates 500] [--concurrency 20] [--port 8099]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from aiohttp import ClientSession  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import GetUpdates, SendDocument, SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+SECRET = "local-test-secret"
+FAKE_TOKEN = "123456:" + "A" * 35
+
+
+class FakeSession(BaseSession):
+    """
+    Сессия Bot API, которая ничего не отправляет, а запоминает вызовы.
+    backlog — апдейты (dict), которые отдаст getUpdates, как накопленные за время простоя.
+    """
+
+    def __init__(self, latency: float = 0.0, backlog: list[dict] | None = None):
+        super().__init__()
+        self.latency = latency
+        self.calls: list = []
+        self.backlog = list(backlog or [])
+        self._ids = itertools.count(1_000_000)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.calls.append(method)
+        if isinstance(method, GetUpdates):
+            # как в Telegram: смещение подтверждает всё, что до него
+            if method.offset is not None:
+                self.backlog = [u for u in self.backlog if u["update_id"] >= method.offset]
+            return [Update.model_validate(u, context={"bot": bot}) for u in self.backlog[:method.limit or 100]]
+        if isinstance(method, (SendMessage, SendDocument)):
+            chat_type = "supergroup" if method.chat_id < 0 else "private"
+            return Message(message_id=next(self._ids), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type=chat_type), text=getattr(method, "text", None))
+        return True
+
+
+def make_update(update_id: int, chat_id: int, user_id: int, msg_id: int, text: str,
+                edited: bool = False) -> dict:
+    """Апдейт в том виде, в каком его присылает Telegram."""
+    message = {
+        "message_id": msg_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "supergroup" if chat_id < 0 else "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Менеджер"},
+        "text": text,
+    }
+    if edited:
+        message["edit_date"] = int(time.time())
+    return {"update_id": update_id, "edited_message" if edited else "message": message}
+
+
+async def post(http: ClientSession, url: str, update: dict, secret: str | None = SECRET) -> int:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    async with http.post(url, json=update, headers=headers) as resp:
+        return resp.status
+
+
+async def start_app(app, session: FakeSession):
+    """То же, что main.main() до приёма апдейтов, но с поддельной сессией Bot API."""
+    app.bot.session = session
+    await app.init_db()
+    await app.db.open()
+    await app.init_chats()
+    await app.undo_journal.load()
+    async with app.db.read() as conn:
+        await app.totals_cache.warm(conn)
+    app.ingest.start()
+    app.calc_log.start()
+
+
+async def stop_app(app):
+    await app.outbox.stop()
+    await app.fsm_storage.close()
+    await app.calc_log.stop()
+    await app.ingest.stop()
+    await app.db.close()
+
+
+async def run(updates: int, concurrency: int, port: int):
+    import main as app
+    from webhook import WebhookServer
+
+    session = FakeSession()
+    await start_app(app, session)
+    server = WebhookServer(app.dp, app.bot, secret=SECRET)
+    await server.start("127.0.0.1", port)
+    base = f"http://127.0.0.1:{port}"
+    url = base + server.path
+    ids = itertools.count(1)
+    try:
+        async with ClientSession() as http:
+            assert await post(http, url, make_update(0, app.MANAGER_CHAT_ID, 42, 1, "bs100"), secret="wrong") == 401
+            assert await post(http, url, make_update(0, app.MANAGER_CHAT_ID, 42, 1, "bs100"), secret=None) == 401
+
+            sem = asyncio.Semaphore(concurrency)
+
+            async def one(i: int) -> int:
+                async with sem:
+                    text = f"bs{100 + i}\ns{50 + i}"
+                    return await post(http, url, make_update(next(ids), app.MANAGER_CHAT_ID, 40 + i % 5, 10 + i, text))
+
+            t0 = time.perf_counter()
+            statuses = await asyncio.gather(*(one(i) for i in range(updates)))
+            accepted = time.perf_counter() - t0
+            assert all(s == 200 for s in statuses), statuses
+            async with http.get(base + "/health") as resp:
+                health = await resp.json()
+            print(f"принято {updates} апдейтов за {accepted:.3f} с ({updates / accepted:.0f}/с), health: {health}")
+
+            await server.drain()
+            assert await post(http, url, make_update(next(ids), app.MANAGER_CHAT_ID, 42, 1, "bs1")) == 503
+            async with http.get(base + "/health") as resp:
+                assert resp.status == 503
+        await app.ingest.flush()
+        async with app.db.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM entries") as cur:
+                (rows,) = await cur.fetchone()
+        print(f"обработано {server.stats.handled}, ошибок {server.stats.errors}, "
+              f"строк в базе {rows}, вызовов Bot API {len(session.calls)}")
+        assert server.stats.handled == updates and rows == updates * 2
+    finally:
+        await server.stop()
+        await stop_app(app)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--updates", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--port", type=int, default=8099)
+    args = ap.parse_args()
+    os.environ.setdefault("TGTOKEN", FAKE_TOKEN)
+    os.chdir(tempfile.mkdtemp(prefix="fake_telegram_"))  # data/ создаётся во временном каталоге
+    asyncio.run(run(args.updates, args.concurrency, args.port))
+
+
+if __name__ == "__main__":
+    main()
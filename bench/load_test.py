@@ -0,0 +1,255 @@
+"""
+Нагрузочный прогон бота без Telegram: синтетический поток апдейтов (сообщения менеджеров,
+правки, /undo, /delete, расчёты через FSM, /report_today) подаётся в dp.feed_update
+с заданной скоростью и параллельностью; --groups N раскладывает поток по N группам менеджеров. Bot API подменён сессией, которая только
+запоминает вызовы; лимиты исходящей очереди сняты, чтобы мерить сам бот.
+
+Печатает апдейты/с, p50/p99 обработки апдейта (по видам и по хэндлерам из main.metrics)
+и рост базы. Результат можно сохранить и сравнивать с ним следующие прогоны:
+
+    python bench/load_test.py [--updates 5000] [--concurrency 50] [--rate 0]
+                              [--mix new=70,edit=12,undo=4,delete=2,fsm=8,report=4]
+                              [--groups 1] [--save base.json] [--baseline base.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from fake_telegram import FAKE_TOKEN, FakeSession, make_update, start_app, stop_app
+
+DEFAULT_MIX = "new=70,edit=12,undo=4,delete=2,fsm=8,report=4"
+MANAGERS_BASE = 100        # user_id менеджеров: 100, 101, …
+CALC_USERS_BASE = 10_000   # user_id тех, кто проходит расчёт в личке
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        mix[kind.strip()] = float(weight)
+    return mix
+
+
+class Traffic:
+    """
+    Генератор сценариев. Сценарий — список апдейтов, которые подаются строго по очереди
+    (например, весь диалог расчёта одного пользователя); разные сценарии идут параллельно.
+    """
+
+    def __init__(self, app, managers: int, list_size: int, seed: int, groups: list[int]):
+        self.app = app
+        self.rnd = random.Random(seed)
+        self.groups = groups
+        self.managers = managers
+        self.list_size = list_size
+        self.admin = app.ADMIN_CHAT_ID[0]
+        self.tiers = len(app.RATE_TIERS.tiers)
+        self._update_id = 0
+        self._msg_id = 0
+        self._calc_user = 0
+        self.sent: list[tuple[int, int, int, str]] = []  # (chat_id, user_id, msg_id, text) сообщений менеджеров
+
+    def _update(self, chat_id: int, user_id: int, text: str, msg_id: int | None = None, edited: bool = False):
+        self._update_id += 1
+        if msg_id is None:
+            self._msg_id += 1
+            msg_id = self._msg_id
+        return make_update(self._update_id, chat_id, user_id, msg_id, text, edited)
+
+    def _amounts(self) -> str:
+        n = self.rnd.randint(1, self.list_size)
+        return "\n".join(f"{self.rnd.choice(('bs', 's'))}{self.rnd.randint(100, 40000)}" for _ in range(n))
+
+    def new(self) -> list[dict]:
+        user = MANAGERS_BASE + self.rnd.randrange(self.managers)
+        if self.rnd.random() < 0.1:
+            text = self.rnd.choice(("ок", "спасибо", "Сумма сейчас будет", "+"))  # болтовня без сумм
+        else:
+            text = self._amounts()
+        chat = self.rnd.choice(self.groups)
+        upd = self._update(chat, user, text)
+        self.sent.append((chat, user, self._msg_id, text))
+        return [upd]
+
+    def edit(self) -> list[dict]:
+        if not self.sent:
+            return self.new()
+        chat, user, msg_id, text = self.rnd.choice(self.sent[-200:])
+        if self.rnd.random() < 0.7:
+            text = self._amounts()
+        else:
+            text = text + " "  # опечатка без изменения сумм
+        return [self._update(chat, user, text, msg_id=msg_id, edited=True)]
+
+    def undo(self) -> list[dict]:
+        user = MANAGERS_BASE + self.rnd.randrange(self.managers)
+        return [self._update(self.rnd.choice(self.groups), user, "/undo")]
+
+    def _admin(self, chat: int, text: str) -> list[dict]:
+        # команда из лички относится к выбранной группе; при одной группе выбирать нечего
+        steps = [self._update(self.admin, self.admin, f"/group {chat}")] if len(self.groups) > 1 else []
+        return steps + [self._update(self.admin, self.admin, text)]
+
+    def delete(self) -> list[dict]:
+        chat, _, msg_id, _ = self.rnd.choice(self.sent) if self.sent else (self.groups[0], 0, 1, "")
+        return self._admin(chat, f"/delete {msg_id}")
+
+    def fsm(self) -> list[dict]:
+        self._calc_user += 1
+        user = CALC_USERS_BASE + self._calc_user
+        steps = [self._update(user, user, "📊 Расчёт прибыли")]
+        steps += [self._update(user, user, f"{self.rnd.uniform(11, 14):.2f}") for _ in range(self.tiers)]
+        steps.append(self._update(user, user, self._amounts()))
+        return steps
+
+    def report(self) -> list[dict]:
+        return self._admin(self.rnd.choice(self.groups), "/report_today")
+
+    def scenarios(self, updates: int, mix: dict[str, float]) -> list[tuple[str, list[dict]]]:
+        kinds, weights = zip(*mix.items())
+        out, total = [], 0
+        while total < updates:
+            kind = self.rnd.choices(kinds, weights)[0]
+            steps = getattr(self, kind)()
+            out.append((kind, steps))
+            total += len(steps)
+        return out
+
+
+def db_size(path: Path) -> int:
+    return sum(p.stat().st_size for p in (path, path.with_name(path.name + "-wal")) if p.exists())
+
+
+async def run(args) -> dict:
+    import main as app
+    from aiogram.types import Update
+    from outbox import Outbox
+
+    session = FakeSession(latency=args.api_latency)
+    await start_app(app, session)
+    # исходящие без лимитов Telegram: иначе прогон упрётся в 20 сообщений в минуту на группу
+    app.outbox = Outbox(app.bot, global_rate=1e9, group_rate=1e9, private_rate=1e9, burst=1e9, max_queue=10**9)
+    app.outbox.set_summarizer("accepted", app._summarize_accepted)
+    app.metrics.reset()
+    groups = [app.MANAGER_CHAT_ID]
+    for i in range(1, args.groups):
+        groups.append((await app.chats.add(app.MANAGER_CHAT_ID - i, f"Группа {i}")).chat_id)
+
+    traffic = Traffic(app, args.managers, args.list_size, args.seed, groups)
+    scenarios = [(kind, [Update.model_validate(u, context={"bot": app.bot}) for u in steps])
+                 for kind, steps in traffic.scenarios(args.updates, parse_mix(args.mix))]
+    n_updates = sum(len(steps) for _, steps in scenarios)
+    size_before = db_size(app.DB_PATH)
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+    t0 = time.perf_counter()
+
+    async def play(i: int, kind: str, steps: list):
+        nonlocal errors
+        if args.rate > 0:
+            delay = t0 + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        async with sem:
+            for upd in steps:
+                t = time.perf_counter()
+                try:
+                    await app.dp.feed_update(app.bot, upd)
+                except Exception:
+                    errors += 1
+                latencies[kind].append(time.perf_counter() - t)
+
+    try:
+        await asyncio.gather(*(play(i, kind, steps) for i, (kind, steps) in enumerate(scenarios)))
+        await app.ingest.flush()
+        elapsed = time.perf_counter() - t0
+        async with app.db.read() as conn:
+            async with conn.execute("SELECT COUNT(*) FROM entries") as cur:
+                (rows,) = await cur.fetchone()
+        size_after = db_size(app.DB_PATH)
+        handlers = {name: (h.count, *h.quantiles(0.5, 0.99)) for name, h in app.metrics.timings.items()
+                    if name.startswith("handler.")}
+    finally:
+        await stop_app(app)
+
+    every = [x for v in latencies.values() for x in v]
+    return {
+        "updates": n_updates, "scenarios": len(scenarios), "errors": errors, "groups": len(groups),
+        "seconds": elapsed, "updates_per_sec": n_updates / elapsed,
+        "p50_ms": percentile(every, 0.5) * 1000, "p99_ms": percentile(every, 0.99) * 1000,
+        "by_kind": {k: {"count": len(v), "p50_ms": percentile(v, 0.5) * 1000, "p99_ms": percentile(v, 0.99) * 1000}
+                    for k, v in sorted(latencies.items())},
+        "handlers": {k: {"count": c, "p50_ms": p50 * 1000, "p99_ms": p99 * 1000}
+                     for k, (c, p50, p99) in sorted(handlers.items())},
+        "entries": rows, "db_bytes_before": size_before, "db_bytes_after": size_after,
+        "api_calls": len(session.calls),
+    }
+
+
+def print_report(res: dict, baseline: dict | None):
+    def vs(key: str, higher_is_better: bool) -> str:
+        if not baseline or not baseline.get(key):
+            return ""
+        change = (res[key] - baseline[key]) / baseline[key] * 100
+        better = change > 0 if higher_is_better else change < 0
+        return f"  ({change:+.1f}% к базе, {'лучше' if better else 'хуже'})"
+
+    print(f"апдейтов: {res['updates']} ({res['scenarios']} сценариев), групп: {res.get('groups', 1)}, "
+          f"ошибок: {res['errors']}")
+    print(f"время: {res['seconds']:.2f} с, {res['updates_per_sec']:.0f} апдейтов/с{vs('updates_per_sec', True)}")
+    print(f"обработка апдейта: p50 {res['p50_ms']:.2f} мс{vs('p50_ms', False)}, "
+          f"p99 {res['p99_ms']:.2f} мс{vs('p99_ms', False)}")
+    print("\nпо видам:")
+    for kind, st in res["by_kind"].items():
+        print(f"  {kind:<8} {st['count']:>7}  p50 {st['p50_ms']:7.2f} мс  p99 {st['p99_ms']:7.2f} мс")
+    print("\nпо хэндлерам:")
+    for name, st in res["handlers"].items():
+        print(f"  {name:<40} {st['count']:>7}  p50 {st['p50_ms']:7.2f} мс  p99 {st['p99_ms']:7.2f} мс")
+    growth = res["db_bytes_after"] - res["db_bytes_before"]
+    print(f"\nстрок в entries: {res['entries']}, база: {res['db_bytes_after'] / 2**20:.2f} МиБ "
+          f"(+{growth / 2**20:.2f} МиБ, {growth / max(res['entries'], 1):.0f} байт/строку)")
+    print(f"вызовов Bot API: {res['api_calls']}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--updates", type=int, default=5000)
+    ap.add_argument("--concurrency", type=int, default=50)
+    ap.add_argument("--rate", type=float, default=0, help="сценариев в секунду (0 — без пауз)")
+    ap.add_argument("--mix", default=DEFAULT_MIX)
+    ap.add_argument("--managers", type=int, default=5)
+    ap.add_argument("--groups", type=int, default=1, help="сколько групп менеджеров (первая — MANAGER_CHAT_ID)")
+    ap.add_argument("--list-size", type=int, default=8, help="максимум строк в сообщении с суммами")
+    ap.add_argument("--api-latency", type=float, default=0.0, help="задержка поддельного Bot API, сек")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--save", type=Path, help="сохранить результат в JSON")
+    ap.add_argument("--baseline", type=Path, help="сравнить с сохранённым результатом")
+    args = ap.parse_args()
+    baseline = json.loads(args.baseline.read_text()) if args.baseline else None
+
+    os.environ.setdefault("TGTOKEN", FAKE_TOKEN)
+    save = args.save.resolve() if args.save else None
+    os.chdir(tempfile.mkdtemp(prefix="load_test_"))  # data/ создаётся во временном каталоге
+    res = asyncio.run(run(args))
+    print_report(res, baseline)
+    if save:
+        save.write_text(json.dumps(res, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
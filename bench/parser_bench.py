@@ -0,0 +1,138 @@
+"""
+Сверка и бенчмарк парсера сообщений менеджера (parsing.parse_mixed_lines).
+
+Сначала проверяет, что новый парсер выдаёт ровно то же, что прежняя реализация
+(parse_mixed_lines_legacy ниже), на корпусе пограничных случаев и на случайных строках.
+Потом меряет время на списках из 10 / 1k / 100k строк и на обычной переписке.
+
+    python bench/parser_bench.py [--fuzz 20000] [--repeat 5]
+"""
+import argparse
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from parsing import parse_mixed_lines  # noqa: E402
+
+
+def parse_mixed_lines_legacy(text: str) -> tuple[list[float], list[float]]:
+    """Прежняя построчная реализация из parsing.py — эталон для сверки и бенчмарка."""
+    no_disc, disc = [], []
+    for raw in text.replace("\t", "\n").splitlines():
+        line = raw.strip().lower().replace(",", ".")
+        if not line:
+            continue
+
+        # допускаем разделение пробелом: 'bs 1000' / 's 1000'
+        parts = line.split()
+        token = "".join(parts)  # склеиваем, чтобы 'bs 1000' -> 'bs1000'
+
+        def parse_amount(s: str) -> float | None:
+            # вытащим число из хвоста токена
+            num = "".join(ch for ch in s if (ch.isdigit() or ch in "."))
+            if not num:
+                return None
+            try:
+                v = float(num)
+                return v if v > 0 else None
+            except ValueError:
+                return None
+
+        if token.startswith("bs"):
+            val = parse_amount(token[2:])
+            if val is not None:
+                no_disc.append(val)
+            continue
+
+        if token.startswith("s"):
+            val = parse_amount(token[1:])
+            if val is not None:
+                disc.append(val)
+            continue
+
+        # всё остальное теперь игнорируем
+    return no_disc, disc
+
+
+CORPUS = [
+    "", " ", "\n\n", "привет", "Сумма 1500", "ok",
+    "bs1000", "bs 1000", "BS1000", "Bs 1 000", "b s 1000", "B S 1000", "  bs  1500  ",
+    "s1000", "s 1000", "S1000", " s 2 600 ", "s1000,50", "s 1.000,5", "bs1,5", "s.5", "s5.",
+    "s0", "bs0", "s-100", "s +100", "s", "bs", "b", "b1000", "sb100", "bsbs100", "ss100",
+    "so what", "sorry 2 items at 3.5", "Спасибо", "сумма s100",  # кириллица
+    "s1.2.3", "s..", "s1e5", "s²", "s٣٤", "s①", "s１２３", "bs¹²",
+    "bs1500\ns900\nbs12000\ns2600", "bs1500\r\ns900", "bs1\rs2", "s1\x0bs2", "s1\x0cbs2",
+    "s1\x1cs2\x1ds3\x1es4", "s1\x1fs2", "s1\x85s2", "s1 s2 s3", "s1\ts2", "bs\t100",
+    "x s100", "\ts100", "　s100", "ſ100", "K100", "ß100", "İs100",
+    "+1500\n-900", "bs 100 (Иван)", "s 100 руб 200", "bs100 / s200",
+]
+
+
+def _random_line(rnd: random.Random) -> str:
+    pieces = ["bs", "BS", "b s", "s", "S", " ", "  ", "\t", " ", "1", "0", "15", "000", ".", ",",
+              "x", "b", "а", "с", "²", "٣", "-", "+", "e", "\r", "\n", " ", "\x1f", "\x85"]
+    return "".join(rnd.choice(pieces) for _ in range(rnd.randint(0, 8)))
+
+
+def check_equivalence(fuzz: int) -> int:
+    cases = list(CORPUS)
+    cases.append("\n".join(CORPUS))
+    rnd = random.Random(42)
+    cases.extend("\n".join(_random_line(rnd) for _ in range(rnd.randint(1, 6))) for _ in range(fuzz))
+    for text in cases:
+        new, old = parse_mixed_lines(text), parse_mixed_lines_legacy(text)
+        if new != old:
+            raise AssertionError(f"расхождение на {text!r}: новый {new}, прежний {old}")
+    return len(cases)
+
+
+def make_list(n: int, rnd: random.Random) -> str:
+    lines = []
+    for _ in range(n):
+        kind = rnd.random()
+        amount = rnd.randint(100, 60000)
+        if kind < 0.45:
+            lines.append(f"bs{amount}")
+        elif kind < 0.9:
+            lines.append(f"s {amount}")
+        else:
+            lines.append(f"Клиент {rnd.randint(1, 999)}, заметка")
+    return "\n".join(lines)
+
+
+CHATTER = (
+    "Коллеги, напоминаю: сегодня сверка до 18:00. По клиенту 4512 ждём подтверждение, "
+    "курс обновим после обеда.\nКто берёт заявку 77? Отпишитесь пожалуйста 🙏"
+)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--fuzz", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    n = check_equivalence(args.fuzz)
+    print(f"эквивалентность: OK ({n} текстов)\n")
+
+    rnd = random.Random(7)
+    inputs = [
+        ("10 строк", make_list(10, rnd)),
+        ("1k строк", make_list(1_000, rnd)),
+        ("100k строк", make_list(100_000, rnd)),
+        ("переписка", CHATTER),
+        ("переписка с 's'", CHATTER + " Sorry, this is a test message"),
+    ]
+    print(f"{'вход':<18} {'прежний, мс':>12} {'новый, мс':>10} {'ускорение':>10}")
+    for name, text in inputs:
+        number = max(1, 200_000 // max(len(text), 1))
+        old = min(timeit.repeat(lambda: parse_mixed_lines_legacy(text), number=number, repeat=args.repeat)) / number
+        new = min(timeit.repeat(lambda: parse_mixed_lines(text), number=number, repeat=args.repeat)) / number
+        print(f"{name:<18} {old * 1000:>12.4f} {new * 1000:>10.4f} {old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""
+Схема v1 против v2: размер базы и скорость типичных запросов, плюс онлайн-миграция.
+
+Строит базу v1 (как создавал прежний init_db) на N строк, меряет размер (после VACUUM)
+и запросы, затем мигрирует schema.migrate() и всё повторяет. Пока идёт миграция,
+параллельно пишет в старую таблицу (как работающий бот) и показывает самое долгое
+ожидание записи — миграция не должна держать базу подолгу. В конце сверяет,
+что в v2 попали все строки и суммы сошлись до фэня. migrate() доводит базу до последней
+версии (с v3 — итоги и индексы по группам), поэтому запросы после миграции — в её виде.
+
+    python bench/schema_v2.py [--rows 100000 1000000] [--batch 5000] [--pause 0.1]
+"""
+import argparse
+import asyncio
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiosqlite  # noqa: E402
+
+from schema import day_number, migrate  # noqa: E402
+
+MSK = timezone(timedelta(hours=3))
+
+V1_SCHEMA = """
+CREATE TABLE entries(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    date TEXT NOT NULL,
+    amount REAL NOT NULL,
+    is_discount INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    msg_id INTEGER NOT NULL,
+    sender_id INTEGER
+);
+CREATE INDEX idx_entries_date ON entries(date);
+CREATE INDEX idx_entries_msg ON entries(chat_id, msg_id);
+CREATE INDEX idx_entries_sender_date ON entries(sender_id, date);
+CREATE TABLE daily_totals(
+    date TEXT PRIMARY KEY,
+    sum_no REAL NOT NULL DEFAULT 0,
+    sum_disc REAL NOT NULL DEFAULT 0,
+    cnt INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TRIGGER trg_entries_ins AFTER INSERT ON entries BEGIN
+    INSERT INTO daily_totals(date, sum_no, sum_disc, cnt)
+    VALUES (NEW.date,
+            CASE WHEN NEW.is_discount=0 THEN NEW.amount ELSE 0 END,
+            CASE WHEN NEW.is_discount=1 THEN NEW.amount ELSE 0 END,
+            1)
+    ON CONFLICT(date) DO UPDATE SET
+        sum_no = sum_no + excluded.sum_no,
+        sum_disc = sum_disc + excluded.sum_disc,
+        cnt = cnt + 1;
+END;
+"""
+WRITER_FEN = 10050  # сумма строк, которые пишутся параллельно миграции
+V1_INSERT = "INSERT INTO entries(ts,date,amount,is_discount,chat_id,msg_id,sender_id) VALUES(?,?,?,?,?,?,?)"
+
+# (название, запрос v1, запрос текущей схемы, параметры v1, параметры текущей схемы)
+QUERIES = [
+    ("итоги по всем дням (сверка кэша)",
+     "SELECT date, is_discount, SUM(amount), COUNT(*) FROM entries GROUP BY date, is_discount",
+     "SELECT chat_id, day, is_discount, SUM(amount_fen), COUNT(*) FROM entries GROUP BY chat_id, day, is_discount",
+     (), ()),
+    ("итог за один день (очистка дня)",
+     "SELECT COUNT(*), SUM(CASE WHEN is_discount=0 THEN amount END) FROM entries WHERE date=?",
+     "SELECT COUNT(*), SUM(CASE WHEN is_discount=0 THEN amount_fen END) FROM entries WHERE chat_id=? AND day=?",
+     ("2025-06-15",), (-100, day_number(date(2025, 6, 15)))),
+    ("последнее сообщение отправителя за день (/undo)",
+     "SELECT msg_id FROM entries WHERE sender_id=? AND date=? ORDER BY ts DESC LIMIT 1",
+     "SELECT msg_id FROM entries WHERE chat_id=? AND sender_id=? AND day=? ORDER BY ts DESC, msg_id DESC LIMIT 1",
+     (7, "2025-06-15"), (-100, 7, day_number(date(2025, 6, 15)))),
+    ("строки сообщения (отпечаток правки)",
+     "SELECT amount, is_discount FROM entries WHERE chat_id=? AND msg_id=? ORDER BY id",
+     "SELECT amount_fen, is_discount FROM entries WHERE chat_id=? AND msg_id=? ORDER BY id",
+     (-100, 12345), (-100, 12345)),
+]
+
+
+def make_v1(path: Path, rows: int, days: int = 365):
+    rnd = random.Random(1)
+    start = date(2025, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executescript(V1_SCHEMA)
+    batch = []
+    for i in range(rows):
+        d = start + timedelta(days=i * days // rows)
+        ts = datetime(d.year, d.month, d.day, 9, tzinfo=MSK) + timedelta(seconds=i % 40000, microseconds=i % 999983)
+        amount = rnd.randint(10000, 5000000) / 100
+        batch.append((ts.isoformat(), d.isoformat(), amount, rnd.randint(0, 1), -100, i // 3, rnd.randint(1, 20)))
+        if len(batch) >= 50000:
+            conn.executemany(V1_INSERT, batch)
+            batch.clear()
+    if batch:
+        conn.executemany(V1_INSERT, batch)
+    conn.commit()
+    conn.close()
+
+
+def size_after_vacuum(path: Path) -> int:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+    conn.close()
+    return path.stat().st_size
+
+
+def time_queries(path: Path, v2: bool, repeat: int) -> list[float]:
+    conn = sqlite3.connect(path)
+    out = []
+    for _, q1, q2, p1, p2 in QUERIES:
+        q, p = (q2, p2) if v2 else (q1, p1)
+        out.append(min(_timed(conn, q, p) for _ in range(repeat)))
+    conn.close()
+    return out
+
+
+def _timed(conn, q, p) -> float:
+    t0 = time.perf_counter()
+    conn.execute(q, p).fetchall()
+    return time.perf_counter() - t0
+
+
+def totals_v1(path: Path) -> tuple[int, int]:
+    conn = sqlite3.connect(path)
+    # те же правила округления, что и при миграции: каждая строка отдельно
+    row = conn.execute("SELECT COUNT(*), SUM(CAST(ROUND(amount * 100) AS INTEGER)) FROM entries").fetchone()
+    conn.close()
+    return row
+
+
+async def migrate_online(path: Path, batch: int, pause: float) -> tuple[float, float, int]:
+    """Миграция с параллельной записью в v1. Возвращает (время, худшее ожидание записи, строк записано)."""
+    done = asyncio.Event()
+    worst, written = 0.0, 0
+
+    async def writer():
+        nonlocal worst, written
+        async with aiosqlite.connect(path) as w:
+            await w.execute("PRAGMA busy_timeout=10000")
+            i = 0
+            while not done.is_set():
+                i += 1
+                now = datetime.now(MSK)
+                t0 = time.perf_counter()
+                try:
+                    await w.execute(V1_INSERT, (now.isoformat(), now.date().isoformat(), WRITER_FEN / 100, i % 2, -100, 10**9 + i, 3))
+                    await w.commit()
+                except sqlite3.OperationalError:
+                    break  # таблицы подменены: прежний бот дальше писать не может
+                worst = max(worst, time.perf_counter() - t0)
+                written += 1
+                await asyncio.sleep(0.005)
+
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA busy_timeout=10000")
+        task = asyncio.create_task(writer())
+        await asyncio.sleep(0.05)
+        t0 = time.perf_counter()
+        await migrate(conn, batch=batch, pause=pause)
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await task
+    return elapsed, worst, written
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, nargs="+", default=[100_000, 1_000_000])
+    ap.add_argument("--batch", type=int, default=5000)
+    ap.add_argument("--pause", type=float, default=0.1, help="пауза между пачками миграции, сек")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for rows in args.rows:
+            path = Path(tmp) / f"v1_{rows}.db"
+            make_v1(path, rows)
+            size1 = size_after_vacuum(path)
+            t1 = time_queries(path, v2=False, repeat=args.repeat)
+            count1, fen1 = totals_v1(path)
+
+            elapsed, worst, written = asyncio.run(migrate_online(path, args.batch, args.pause))
+            conn = sqlite3.connect(path)
+            count2, fen2 = conn.execute("SELECT COUNT(*), SUM(amount_fen) FROM entries").fetchone()
+            tot_cnt, tot_fen = conn.execute("SELECT SUM(cnt), SUM(sum_no) + SUM(sum_disc) FROM day_totals").fetchone()
+            conn.close()
+            size2 = size_after_vacuum(path)
+            t2 = time_queries(path, v2=True, repeat=args.repeat)
+
+            print(f"\n=== {rows} строк ===")
+            print(f"размер: v1 {size1 / 2**20:.1f} МиБ -> v2 {size2 / 2**20:.1f} МиБ ({size2 / size1 - 1:+.0%})")
+            for (name, *_), a, b in zip(QUERIES, t1, t2):
+                print(f"  {name:<48} v1 {a * 1000:8.2f} мс   v2 {b * 1000:8.2f} мс   x{a / b:5.1f}")
+            print(f"миграция: {elapsed:.1f} с, параллельно записано {written} строк, "
+                  f"худшее ожидание записи {worst * 1000:.0f} мс")
+            ok = (count2 == count1 + written and fen2 == fen1 + written * WRITER_FEN
+                  and tot_cnt == count2 and tot_fen == fen2)
+            print(f"сверка: строк {count2} (ожидалось {count1 + written}), "
+                  f"суммы и day_totals {'сходятся' if ok else 'НЕ сходятся'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Пересчёт «что, если» за год: база на N строк одной группы, сохранённые курсы на большую часть
+дней, закрытые месяцы (--archive) уходят в помесячные архивы, как у работающего бота.
+
+Меряет whatif.recompute() с numpy и без него (тот же проход построчно) при разном размере
+порции, сверяет, что оба пути дают одно и то же до копейки, а итоги фэней — с day_totals.
+
+    python bench/whatif.py [--rows 1000000] [--days 365] [--chunk 10000 50000 200000] [--archive]
+"""
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aiosqlite  # noqa: E402
+
+import whatif  # noqa: E402
+from archive import Archiver, archives_for, range_totals  # noqa: E402
+from chats import ChatConfig  # noqa: E402
+from dbconn import Database  # noqa: E402
+from rates import DEFAULT_TIERS  # noqa: E402
+from schema import day_date, day_number, migrate  # noqa: E402
+from whatif import RateSet, load_rate_sets, parse_overrides, recompute, save_rate_set  # noqa: E402
+
+CHAT = -1002759641463
+CFG = ChatConfig(CHAT)
+
+
+async def build(path: Path, rows: int, days: int, today: date, seed: int) -> int:
+    rnd = random.Random(seed)
+    start = day_number(today) - days + 1
+    async with aiosqlite.connect(path) as conn:
+        await migrate(conn)
+        await conn.execute("PRAGMA journal_mode=WAL")
+        batch = []
+        for i in range(rows):
+            d = start + rnd.randrange(days)
+            # как в группе: много мелких сумм и немного крупных, чтобы задеть все диапазоны
+            fen = int(rnd.lognormvariate(7.5, 1.3) * 100) + 100
+            batch.append((d * 86400, d, fen, rnd.random() < 0.35, CHAT, i // 3 + 1, 100 + i % 7))
+            if len(batch) == 50_000:
+                await conn.executemany("INSERT INTO entries(ts, day, amount_fen, is_discount, chat_id, msg_id, "
+                                       "sender_id) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+                batch.clear()
+        if batch:
+            await conn.executemany("INSERT INTO entries(ts, day, amount_fen, is_discount, chat_id, msg_id, "
+                                   "sender_id) VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+        # курсы вводили не каждый день
+        for d in range(start, start + days):
+            if rnd.random() < 0.85:
+                rates = {k: round(rnd.uniform(11.5, 12.2), 2) for k in DEFAULT_TIERS.keys}
+                await save_rate_set(conn, CHAT, d, RateSet.from_dialog(DEFAULT_TIERS, rates, CFG), 1, 0)
+        await conn.commit()
+    return start
+
+
+async def run(args):
+    tmp = Path(tempfile.mkdtemp(prefix="whatif_"))
+    path = tmp / "report.db"
+    today = date.today()
+    t = time.perf_counter()
+    start = await build(path, args.rows, args.days, today, args.seed)
+    end = day_number(today)
+    print(f"база: {args.rows} строк за {args.days} дн. построена за {time.perf_counter() - t:.1f} с")
+
+    db = Database(path)
+    await db.open()
+    archive_dir = tmp / "archive"
+    if args.archive:
+        t = time.perf_counter()
+        res = await Archiver(db, archive_dir, hot_months=1, vacuum=False).run(today)
+        print(f"в архив: {res.rows} строк, {len(res.months)} мес. за {time.perf_counter() - t:.1f} с")
+    archives = archives_for(archive_dir, start, end)
+
+    overrides = parse_overrides(["rates=12.1,11.95,11.9,11.85,11.8", "pay_no=0.17"])
+    results = {}
+    try:
+        async with db.read() as conn:
+            stored = await load_rate_sets(conn, CHAT, start, end)
+            base = [stored.get(d) or RateSet.defaults(CFG) for d in range(start, end + 1)]
+            alt = [rs.with_overrides(overrides, DEFAULT_TIERS.bounds) for rs in base]
+            numpy = whatif.np
+            for label, np_mod in (("numpy", numpy), ("python", None)):
+                if label == "numpy" and numpy is None:
+                    print("numpy не установлен — только построчный проход")
+                    continue
+                whatif.np = np_mod
+                for chunk in args.chunk:
+                    t = time.perf_counter()
+                    days = await recompute(conn, CHAT, start, end, [base, alt], archives=archives, chunk=chunk)
+                    took = time.perf_counter() - t
+                    print(f"{label:<7} порция {chunk:>7}: {took:.2f} с ({args.rows / took / 1e6:.2f} млн строк/с), "
+                          f"дней {len(days)}")
+                    results[(label, chunk)] = days
+            whatif.np = numpy
+            totals = await range_totals(conn, archive_dir, CHAT, start, end)
+    finally:
+        await db.close()
+
+    ref = next(iter(results.values()))
+    for key, days in results.items():
+        for a, b in zip(ref, days):
+            assert (a.day, a.count, a.sum_no, a.sum_disc) == (b.day, b.count, b.sum_no, b.sum_disc), key
+            for fa, fb in zip(a.figures, b.figures):
+                for x, y in ((fa.check_total, fb.check_total), (fa.payout_total, fb.payout_total)):
+                    assert (x is None) == (y is None) and (x is None or abs(x - y) < 0.01), (key, a.day, x, y)
+    assert {d.day: (d.sum_no, d.sum_disc, d.count) for d in ref} == \
+        {d: (t.sum_no, t.sum_disc, t.count) for d, t in totals.items()}
+    known = [d for d in ref if d.figures[0].check_total is not None]
+    before = sum(d.figures[0].check_total for d in known)
+    after = sum(d.figures[1].check_total for d in known)
+    print(f"совпадают все прогоны и day_totals; дней с курсами {len(known)} из {len(ref)} "
+          f"({day_date(ref[0].day)} – {day_date(ref[-1].day)}), проверка ₽ {before:,.2f} → {after:,.2f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--days", type=int, default=365)
+    ap.add_argument("--chunk", type=int, nargs="+", default=[10_000, 50_000, 200_000])
+    ap.add_argument("--archive", action="store_true", help="закрытые месяцы перенести в архивы")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
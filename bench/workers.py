@@ -0,0 +1,186 @@
+"""
+Прогон режима нескольких процессов (WORKERS > 1) без Telegram. Поток апдейтов из load_test
+подаётся в ShardFront, воркеры поднимаются по-настоящему (spawn) с поддельной сессией Bot API;
+для сравнения тот же поток прогоняется в одном процессе через dp.feed_update.
+
+Печатает апдейты/с и p50/p99 обработки апдейта (у воркеров — от отправки, с ожиданием в очереди:
+поток отправляется целиком сразу), затем сверяет итоги по группам: при любом числе воркеров
+они должны совпасть с однопроцессным прогоном — там, как и в воркере, апдейты одного чата
+идут по очереди, а разные чаты параллельно.
+В смеси по умолчанию нет /undo и /delete: их результат зависит от секунды ts и от порядка
+между разными чатами, поэтому итоги с ними могут законно расходиться.
+
+Ускорение видно только при нескольких ядрах (os.cpu_count() печатается) и тяжёлых
+апдейтах — длинные списки сумм (--list-size) нагружают парсер и форматирование.
+
+    python bench/workers.py [--workers 0,1,2,4] [--updates 3000] [--groups 8]
+                            [--list-size 40] [--mix new=75,edit=13,fsm=8,report=4]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from fake_telegram import FAKE_TOKEN, FakeSession, start_app, stop_app
+from load_test import Traffic, parse_mix, percentile
+
+DEFAULT_MIX = "new=75,edit=13,fsm=8,report=4"
+
+
+def _unlimited_outbox(app):
+    # исходящие без лимитов Telegram, как в load_test: мерим сам бот
+    from outbox import Outbox
+    app.outbox = Outbox(app.bot, global_rate=1e9, group_rate=1e9, private_rate=1e9, burst=1e9, max_queue=10**9)
+    app.outbox.set_summarizer("accepted", app._summarize_accepted)
+
+
+def bench_worker(index: int, port: int, token: str):
+    """Точка входа воркера для ShardFront: main.worker_process с поддельным Bot API."""
+    import main as app
+    app.bot.session = FakeSession()
+    _unlimited_outbox(app)
+    app.worker_process(index, port, token)
+
+
+async def _totals(app) -> dict[int, tuple[int, int]]:
+    async with app.db.read() as conn:
+        async with conn.execute("SELECT chat_id, COUNT(*), SUM(amount_fen) FROM entries GROUP BY chat_id") as cur:
+            return {chat: (cnt, s) for chat, cnt, s in await cur.fetchall()}
+
+
+async def _add_groups(app, groups: int) -> list[int]:
+    out = [app.MANAGER_CHAT_ID]
+    for i in range(1, groups):
+        out.append((await app.chats.add(app.MANAGER_CHAT_ID - i, f"Группа {i}")).chat_id)
+    return out
+
+
+def _scenarios(app, args, groups: list[int]):
+    from aiogram.types import Update
+    traffic = Traffic(app, args.managers, args.list_size, args.seed, groups)
+    return [[Update.model_validate(u, context={"bot": app.bot}) for u in steps]
+            for _, steps in traffic.scenarios(args.updates, parse_mix(args.mix))]
+
+
+async def run_single(app, args) -> dict:
+    """Один процесс: чаты параллельно (до --concurrency), апдейты одного чата по очереди."""
+    from shard import chat_of
+
+    await start_app(app, FakeSession())
+    _unlimited_outbox(app)
+    groups = await _add_groups(app, args.groups)
+    scenarios = _scenarios(app, args, groups)
+    latencies: list[float] = []
+    errors = 0
+    sem = asyncio.Semaphore(args.concurrency)
+
+    by_chat: dict[int, list] = {}
+    for steps in scenarios:
+        by_chat.setdefault(chat_of(steps[0]), []).extend(steps)
+
+    async def play(steps: list):
+        nonlocal errors
+        async with sem:
+            for upd in steps:
+                t = time.perf_counter()
+                try:
+                    await app.dp.feed_update(app.bot, upd)
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - t)
+
+    try:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(play(steps) for steps in by_chat.values()))
+        await app.ingest.flush()
+        elapsed = time.perf_counter() - t0
+        totals = await _totals(app)
+    finally:
+        await stop_app(app)
+    return {"updates": len(latencies), "errors": errors, "seconds": elapsed, "startup": 0.0,
+            "latencies": latencies, "totals": totals}
+
+
+async def run_sharded(app, args, workers: int) -> dict:
+    """ShardFront + workers процессов; основной процесс только раздаёт апдейты и пишет в базу."""
+    from shard import ShardFront
+
+    os.environ["WORKERS"] = str(workers)  # воркеры читают его при импорте main
+    app.bot.session = FakeSession()
+    await app.init_db()
+    await app.db.open()
+    await app.init_chats()
+    groups = await _add_groups(app, args.groups)  # до старта воркеров: они читают chats при запуске
+    scenarios = _scenarios(app, args, groups)
+    latencies: list[float] = []
+    front = ShardFront(app.db, workers, bench_worker)
+    front.add_after_update(lambda seconds, ok: latencies.append(seconds))
+    try:
+        t = time.perf_counter()
+        await front.start()
+        startup = time.perf_counter() - t
+        t0 = time.perf_counter()
+        # порядок внутри чата держит воркер, поэтому всё отправляется сразу
+        for steps in scenarios:
+            for upd in steps:
+                await front.feed_update(app.bot, upd)
+        await front.join()
+        elapsed = time.perf_counter() - t0
+    finally:
+        await front.stop()  # воркеры дописывают очереди ingest через основной процесс
+    try:
+        totals = await _totals(app)
+    finally:
+        await app.db.close()
+    return {"updates": len(latencies), "errors": front.stats.errors, "seconds": elapsed, "startup": startup,
+            "latencies": latencies, "totals": totals, "routed": front.stats.routed,
+            "writes": front.stats.writes}
+
+
+async def run(args):
+    import main as app
+
+    base = tempfile.mkdtemp(prefix="workers_")
+    print(f"ядер: {os.cpu_count()}, апдейтов: ~{args.updates}, групп: {args.groups}, "
+          f"строк в сообщении до {args.list_size}")
+    reference = None
+    for workers in args.workers:
+        os.chdir(tempfile.mkdtemp(dir=base))  # у каждого прогона свой data/
+        res = await (run_single(app, args) if workers == 0 else run_sharded(app, args, workers))
+        lat = res["latencies"]
+        name = "1 процесс" if workers == 0 else f"воркеров: {workers}"
+        line = (f"{name:<12} {res['updates'] / res['seconds']:7.0f} апдейтов/с  "
+                f"p50 {percentile(lat, 0.5) * 1000:8.2f} мс  p99 {percentile(lat, 0.99) * 1000:8.2f} мс  "
+                f"ошибок {res['errors']}")
+        if workers:
+            line += f"  запуск {res['startup']:.1f} с, записей через основной {res['writes']}, по воркерам {res['routed']}"
+        print(line)
+        if reference is None:
+            reference = res["totals"]
+        elif res["totals"] != reference:
+            diff = {c: (reference.get(c), res["totals"].get(c)) for c in set(reference) | set(res["totals"])
+                    if reference.get(c) != res["totals"].get(c)}
+            print(f"  итоги не совпадают с первым прогоном: {diff}")
+        else:
+            print(f"  итоги совпадают с первым прогоном ({sum(c for c, _ in reference.values())} строк)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--workers", default="0,1,2,4", help="через запятую; 0 — один процесс без шардирования")
+    ap.add_argument("--updates", type=int, default=3000)
+    ap.add_argument("--concurrency", type=int, default=50, help="параллельных чатов в однопроцессном прогоне")
+    ap.add_argument("--mix", default=DEFAULT_MIX)
+    ap.add_argument("--managers", type=int, default=5)
+    ap.add_argument("--groups", type=int, default=8)
+    ap.add_argument("--list-size", type=int, default=40, help="максимум строк в сообщении с суммами")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    args.workers = [int(w) for w in args.workers.split(",")]
+    os.environ.setdefault("TGTOKEN", FAKE_TOKEN)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
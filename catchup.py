@@ -0,0 +1,127 @@
+"""
+Догрузка апдейтов, накопившихся, пока бот не работал: вместо drop_pending_updates
+бот при старте сам выбирает их через getUpdates, прежде чем запустить polling или webhook.
+
+Сообщения групп менеджеров (новые и правки) не идут по одному через хэндлеры:
+сначала разбирается вся страница, затем замены пишутся пачкой — одной транзакцией
+с заменой по (chat_id, msg_id), так что повторная догрузка того же сообщения ничего
+не задваивает. Вместо сотни «Принято» — одна сводка на группу в конце (её отправляет вызывающий).
+Всё прочее (команды, личные диалоги) по порядку передаётся в диспетчер; перед каждым
+таким апдейтом накопленная пачка записывается, чтобы, например, /undo видел эти сообщения.
+
+Telegram считает страницу доставленной, когда getUpdates вызывают со смещением за ней,
+поэтому следующая страница запрашивается только после записи текущей: сбой посреди
+догрузки не теряет сообщений, они придут ещё раз.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message, Update
+
+from ingest import IngestQueue, Replacement
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class CatchupStats:
+    updates: int = 0
+    pages: int = 0
+    messages: int = 0    # новые сообщения с суммами
+    edits: int = 0
+    rows: int = 0        # строк в итоговых версиях сообщений
+    total: float = 0.0   # их сумма, ¥
+    ignored: int = 0     # сообщения без сумм и правки, которые нельзя применить
+    replayed: int = 0    # прочие апдейты, переданные в диспетчер
+    errors: int = 0
+    seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class Catchup:
+    """
+    build(message, edited) -> Replacement | None превращает сообщение группы в замену
+    (None — пропустить: болтовня без сумм, правка архивного сообщения и т.п.).
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, ingest: IngestQueue, is_group: Callable[[int], bool],
+                 build: Callable[[Message, bool], Replacement | None], page_size: int = 100):
+        self.bot = bot
+        self.dp = dp
+        self.ingest = ingest
+        self.is_group = is_group  # chat_id -> это группа менеджеров
+        self.build = build
+        self.page_size = min(max(1, page_size), 100)  # больше 100 getUpdates не отдаёт
+        self.stats = CatchupStats()
+        self._final: dict[tuple[int, int], Replacement] = {}  # последняя версия каждого сообщения
+
+    async def run(self, allowed_updates: list[str] | None = None) -> CatchupStats:
+        started = time.perf_counter()
+        offset = None
+        while True:
+            updates = await self.bot.get_updates(offset=offset, limit=self.page_size, timeout=0,
+                                                  allowed_updates=allowed_updates)
+            if not updates:
+                break  # этот же вызов подтвердил последнюю обработанную страницу
+            self.stats.pages += 1
+            self.stats.updates += len(updates)
+            await self._process(updates)
+            offset = updates[-1].update_id + 1
+        self.stats.rows = sum(len(it.no_list) + len(it.disc_list) for it in self._final.values())
+        self.stats.total = sum(sum(it.no_list) + sum(it.disc_list) for it in self._final.values())
+        self.stats.seconds = time.perf_counter() - started
+        return self.stats
+
+    def by_chat(self) -> dict[int, tuple[int, int, float]]:
+        """chat_id -> (сообщений, строк, сумма ¥) по итоговым версиям догруженных сообщений."""
+        out: dict[int, tuple[int, int, float]] = {}
+        for it in self._final.values():
+            messages, rows, total = out.get(it.chat_id, (0, 0, 0.0))
+            out[it.chat_id] = (messages + 1, rows + len(it.no_list) + len(it.disc_list),
+                               total + sum(it.no_list) + sum(it.disc_list))
+        return out
+
+    def _group_message(self, update: Update) -> tuple[Message | None, bool]:
+        msg, edited = update.message, False
+        if msg is None and update.edited_message is not None:
+            msg, edited = update.edited_message, True
+        if msg is None or not self.is_group(msg.chat.id) or not msg.text or msg.text.startswith("/"):
+            return None, False
+        return msg, edited
+
+    async def _process(self, updates: list[Update]):
+        batch: list[tuple[Replacement, bool]] = []
+        for update in updates:
+            msg, edited = self._group_message(update)
+            if msg is not None:
+                item = self.build(msg, edited)
+                if item is None:
+                    self.stats.ignored += 1
+                else:
+                    batch.append((item, edited))
+                continue
+            if batch:
+                await self._write(batch)
+                batch = []
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.stats.replayed += 1
+            except Exception:
+                self.stats.errors += 1
+                log.exception("Догрузка: апдейт %s не обработан", update.update_id)
+        if batch:
+            await self._write(batch)
+
+    async def _write(self, batch: list[tuple[Replacement, bool]]):
+        await self.ingest.write_now([it for it, _ in batch])
+        for it, edited in batch:
+            if edited:
+                self.stats.edits += 1
+            else:
+                self.stats.messages += 1
+            self._final[(it.chat_id, it.msg_id)] = it
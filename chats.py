@@ -0,0 +1,201 @@
+"""
+Настройки групп менеджеров: ставки выплат, надбавки проверочных строк, админы и часовой пояс.
+Хранятся в таблице chats (report.db), в памяти — копия всей таблицы: каждое сообщение
+группы сверяется с ней, поэтому поиск — словарь, а не запрос к базе.
+Изменения через ChatRegistry сразу попадают в копию (и в копии других воркеров — через
+колбэки add_after_change); правки таблицы в обход бота подхватываются reload() (/chat reload).
+"""
+import time
+from dataclasses import dataclass, fields, replace
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from dbconn import Database, write_op
+
+
+@lru_cache(maxsize=None)
+def _zone(name: str) -> ZoneInfo:
+    return ZoneInfo(name)
+
+
+@dataclass(frozen=True, slots=True)
+class ChatConfig:
+    chat_id: int
+    title: str = ""
+    pay_no: float = 0.15          # ₽ за 1 ¥ без скидки
+    pay_disc: float = 0.10        # ₽ за 1 ¥ со скидкой
+    check_add_no: float = 0.10    # надбавка к курсу в проверочных строках
+    check_add_disc: float = 0.05
+    admins: tuple[int, ...] = ()
+    tz: str = "Europe/Moscow"
+
+    @property
+    def zone(self) -> ZoneInfo:
+        return _zone(self.tz)
+
+    def now(self) -> datetime:
+        return datetime.now(self.zone)
+
+    def today(self) -> date:
+        return self.now().date()
+
+    @property
+    def name(self) -> str:
+        return self.title or str(self.chat_id)
+
+
+def _parse_admins(text: str) -> tuple[int, ...]:
+    return tuple(int(x) for x in text.replace(" ", "").split(",") if x)
+
+
+def _parse_rate(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def _parse_tz(text: str) -> str:
+    try:
+        _zone(text)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"неизвестный часовой пояс: {text}") from None
+    return text
+
+
+# поле -> разбор значения из команды /chat set
+EDITABLE = {
+    "title": str,
+    "pay_no": _parse_rate,
+    "pay_disc": _parse_rate,
+    "check_add_no": _parse_rate,
+    "check_add_disc": _parse_rate,
+    "admins": _parse_admins,
+    "tz": _parse_tz,
+}
+_COLUMNS = [f.name for f in fields(ChatConfig)]
+
+
+class ChatRegistry:
+    """
+    Группы, которые обслуживает бот. super_admins видят и настраивают все группы,
+    админы группы — только свои. Выбор группы для команд из лички (/group) живёт в памяти.
+    """
+
+    def __init__(self, db: Database, defaults: ChatConfig, super_admins: Iterable[int] = ()):
+        self.db = db
+        self.defaults = defaults
+        self.super_admins = frozenset(super_admins)
+        self._chats: dict[int, ChatConfig] = {}
+        self._selected: dict[int, int] = {}  # user_id -> chat_id
+        self._after_change = []  # колбэки без аргументов после записи изменений в таблицу
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._chats
+
+    def add_after_change(self, callback):
+        self._after_change.append(callback)
+
+    def get(self, chat_id: int) -> ChatConfig | None:
+        return self._chats.get(chat_id)
+
+    def all(self) -> list[ChatConfig]:
+        return sorted(self._chats.values(), key=lambda c: (c.title, c.chat_id))
+
+    # ---------- права и выбор группы ----------
+    def is_super(self, user_id: int) -> bool:
+        return user_id in self.super_admins
+
+    def is_admin(self, user_id: int, chat_id: int) -> bool:
+        cfg = self._chats.get(chat_id)
+        return cfg is not None and (user_id in self.super_admins or user_id in cfg.admins)
+
+    def admin_chats(self, user_id: int) -> list[ChatConfig]:
+        if user_id in self.super_admins:
+            return self.all()
+        return [c for c in self.all() if user_id in c.admins]
+
+    def select(self, user_id: int, chat_id: int) -> bool:
+        if not self.is_admin(user_id, chat_id):
+            return False
+        self._selected[user_id] = chat_id
+        return True
+
+    def target_for(self, user_id: int) -> ChatConfig | None:
+        """
+        Группа для команд из лички: выбранная через /group, единственная доступная
+        или, для старых админов, группа по умолчанию (defaults.chat_id).
+        """
+        chat_id = self._selected.get(user_id)
+        if chat_id is not None and self.is_admin(user_id, chat_id):
+            return self._chats[chat_id]
+        mine = self.admin_chats(user_id)
+        if len(mine) == 1:
+            return mine[0]
+        if self.is_admin(user_id, self.defaults.chat_id):
+            return self._chats[self.defaults.chat_id]
+        return None
+
+    # ---------- база ----------
+    async def load(self):
+        """(Пере)читывает всю таблицу chats."""
+        async with self.db.read() as conn:
+            async with conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM chats") as cur:
+                rows = await cur.fetchall()
+        chats = {}
+        for row in rows:
+            values = dict(zip(_COLUMNS, row))
+            values["admins"] = _parse_admins(values["admins"])
+            chats[values["chat_id"]] = ChatConfig(**values)
+        self._chats = chats
+
+    reload = load
+
+    async def add(self, chat_id: int, title: str = "") -> ChatConfig:
+        """Регистрирует группу с настройками по умолчанию (уже известная — не меняется)."""
+        if chat_id in self._chats:
+            return self._chats[chat_id]
+        cfg = replace(self.defaults, chat_id=chat_id, title=title)
+        await self._save(cfg)
+        return cfg
+
+    async def update(self, chat_id: int, field: str, value: str) -> ChatConfig:
+        """Меняет одно поле из EDITABLE; ValueError — неизвестное поле или плохое значение."""
+        if field not in EDITABLE:
+            raise ValueError(f"поле {field} не настраивается; можно: {', '.join(EDITABLE)}")
+        cfg = replace(self._chats[chat_id], **{field: EDITABLE[field](value)})
+        await self._save(cfg)
+        return cfg
+
+    async def remove(self, chat_id: int):
+        # записи группы остаются в entries: вернуть группу — снова /chat add
+        await self.db.run(chat_delete, chat_id)
+        self._chats.pop(chat_id, None)
+        self._changed()
+
+    async def _save(self, cfg: ChatConfig):
+        values = [getattr(cfg, c) for c in _COLUMNS]
+        values[_COLUMNS.index("admins")] = ",".join(map(str, cfg.admins))
+        await self.db.run(chat_upsert, values, int(time.time()))
+        self._chats[cfg.chat_id] = cfg
+        self._changed()
+
+    def _changed(self):
+        for cb in self._after_change:
+            cb()
+
+
+@write_op
+async def chat_upsert(conn, values: list, updated: int):
+    await conn.execute(f"""
+        INSERT INTO chats({', '.join(_COLUMNS)}, updated) VALUES({', '.join('?' * len(_COLUMNS))}, ?)
+        ON CONFLICT(chat_id) DO UPDATE SET
+            {', '.join(f'{c}=excluded.{c}' for c in _COLUMNS[1:])}, updated=excluded.updated
+    """, (*values, updated))
+
+
+@write_op
+async def chat_delete(conn, chat_id: int):
+    await conn.execute("DELETE FROM chats WHERE chat_id=?", (chat_id,))
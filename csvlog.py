@@ -0,0 +1,138 @@
+import asyncio
+import csv
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Iterator
+
+log = logging.getLogger(__name__)
+
+DELIMITER = ";"
+
+
+class CsvLog:
+    """
+    Буферизованный CSV-лог: строки копятся в памяти и пишутся на диск фоновой задачей
+    (в отдельном потоке) — по размеру буфера, по таймеру и при остановке.
+    Файл ротируется по размеру: log.csv -> log.1.csv -> … -> log.<backups>.csv.
+    """
+
+    def __init__(self, path: Path, columns: list[str], max_buffer: int = 100,
+                 flush_interval: float = 2.0, max_bytes: int = 5 * 2**20, backups: int = 5,
+                 max_pending: int = 10_000):
+        self.path = Path(path)
+        self.columns = list(columns)
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._buf: deque[list] = deque()
+        self._max_pending = max_pending
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="csv-log")
+
+    async def stop(self):
+        # не cancel(): задача сама выходит из цикла, не обрывая запись посередине
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+
+    def write(self, row: list):
+        """Не блокирует: строка уходит в буфер. При переполнении отбрасываются самые старые."""
+        if len(self._buf) >= self._max_pending:
+            self._buf.popleft()
+            self.dropped += 1
+        self._buf.append(row)
+        if len(self._buf) >= self.max_buffer:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buf:
+                return
+            rows = list(self._buf)
+            self._buf.clear()
+            try:
+                await asyncio.to_thread(self._write_rows, rows)
+            except OSError:
+                log.exception("Не удалось записать %s", self.path)
+                self._buf.extendleft(reversed(rows))
+                raise
+            self.written += len(rows)
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except OSError:
+                await asyncio.sleep(self.flush_interval)
+
+    def _write_rows(self, rows: list[list]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.max_bytes and self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+            self._rotate()
+        new_file = not self.path.exists()
+        with self.path.open("a", newline="", encoding="utf-8") as f:
+            w = csv.writer(f, delimiter=DELIMITER)
+            if new_file:
+                w.writerow(self.columns)
+            w.writerows(rows)
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            src = rotated_path(self.path, i)
+            if src.exists():
+                src.replace(rotated_path(self.path, i + 1))
+        if self.backups > 0:
+            self.path.replace(rotated_path(self.path, 1))
+        else:
+            self.path.unlink()
+        self.rotations += 1
+
+
+def rotated_path(path: Path, i: int) -> Path:
+    return path.with_name(f"{path.stem}.{i}{path.suffix}")
+
+
+def log_files(path: Path) -> list[Path]:
+    """Все файлы лога от самого старого к текущему."""
+    path = Path(path)
+    rotated = sorted((p for p in path.parent.glob(f"{path.stem}.*{path.suffix}")
+                      if p.stem[len(path.stem) + 1:].isdigit()),
+                     key=lambda p: int(p.stem[len(path.stem) + 1:]), reverse=True)
+    return rotated + ([path] if path.exists() else [])
+
+
+def read_chunks(path: Path, chunk_size: int = 5000, rotated: bool = True) -> Iterator[list[dict]]:
+    """
+    Читает лог (вместе с ротированными файлами) порциями по chunk_size строк-словарей.
+    Файл читается построчно, поэтому в памяти одновременно только одна порция.
+    """
+    files = log_files(path) if rotated else [Path(path)]
+    chunk: list[dict] = []
+    for p in files:
+        with p.open(newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f, delimiter=DELIMITER):
+                chunk.append(row)
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+    if chunk:
+        yield chunk
@@ -0,0 +1,245 @@
+"""
+Ежедневный отчёт по расписанию: в at (ЧЧ:ММ по часовому поясу группы) снимаются итоги
+прошедших суток — суммы, ставки выплат на тот момент и готовый текст отчёта — в day_reports
+и рассылаются админам. День к этому времени закрыт, поэтому запросы за него отдают снимок,
+а не считают и форматируют заново.
+
+Если бот в это время не работал, пропущенные дни (не больше catchup_days) досылаются
+при следующем запуске; снимок и отметка о рассылке пишутся раздельно, так что сбой между
+ними приводит лишь к повторной попытке рассылки, а не к новому снимку.
+
+Закрытый день ещё может измениться — догрузкой после простоя, /delete, /undo за прошлые
+сутки. Поэтому снимок из горячей базы перед выдачей сверяется с day_totals (одна строка
+по ключу) и при расхождении пересчитывается с теми же ставками, что были в снимке.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, time as dtime, timedelta
+from typing import Awaitable, Callable, Iterable
+from zoneinfo import ZoneInfo
+
+import aiosqlite
+
+from chats import ChatConfig
+from dbconn import Database, write_op
+from schema import day_date, day_number
+from totals import read_day
+
+log = logging.getLogger(__name__)
+
+REPORT_CATCHUP_DAYS = 3
+LATE_AFTER = timedelta(minutes=10)  # позже этого после at рассылка помечается как запоздавшая
+MAX_SLEEP = 300.0                   # просыпаться не реже: новые группы и смена часового пояса
+
+
+def parse_report_at(text: str | None) -> dtime | None:
+    """'ЧЧ:ММ' -> время; пусто или off — отчёт по расписанию выключен. ValueError — не время."""
+    t = (text or "").strip().lower()
+    if t in ("", "off", "0"):
+        return None
+    hh, sep, mm = t.partition(":")
+    if not sep:
+        raise ValueError(f"REPORT_AT: ожидается ЧЧ:ММ, получено {text!r}")
+    return dtime(int(hh), int(mm))
+
+
+def due_day(now: datetime, at: dtime) -> int:
+    """Последний день, отчёт за который уже пора разослать: сутки рассылаются в at следующих."""
+    return day_number(now.date()) - (1 if now.time() >= at else 2)
+
+
+def scheduled_at(day: int, at: dtime, tz: ZoneInfo) -> datetime:
+    """Когда по расписанию рассылается отчёт за day."""
+    return datetime.combine(day_date(day + 1), at, tz)
+
+
+@dataclass(frozen=True, slots=True)
+class DayReport:
+    chat_id: int
+    day: int
+    sum_no: int       # фэни
+    sum_disc: int
+    count: int
+    pay_no: float     # ставки выплат, с которыми посчитан text
+    pay_disc: float
+    text: str
+    made: int         # unix-время снимка
+    sent: int | None = None
+
+
+@dataclass
+class ReportStats:
+    runs: int = 0
+    made: int = 0       # снимков по расписанию
+    sent: int = 0       # разосланных отчётов
+    late: int = 0       # из них — после простоя
+    served: int = 0     # запросов, отданных из снимка
+    refreshed: int = 0  # снимков, пересчитанных из-за изменений дня
+    errors: int = 0
+    last_run: float = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+_COLUMNS = "chat_id, day, sum_no, sum_disc, cnt, pay_no, pay_disc, text, made, sent"
+
+
+@write_op
+async def save_report(conn, rep: DayReport):
+    await conn.execute(f"INSERT OR REPLACE INTO day_reports({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (rep.chat_id, rep.day, rep.sum_no, rep.sum_disc, rep.count, rep.pay_no, rep.pay_disc,
+                        rep.text, rep.made, rep.sent))
+
+
+@write_op
+async def mark_sent(conn, chat_id: int, days: list[int], sent: int):
+    await conn.executemany("UPDATE day_reports SET sent=? WHERE chat_id=? AND day=?",
+                           [(sent, chat_id, d) for d in days])
+
+
+async def load_report(conn: aiosqlite.Connection, chat_id: int, day: int) -> DayReport | None:
+    async with conn.execute(f"SELECT {_COLUMNS} FROM day_reports WHERE chat_id=? AND day=?",
+                            (chat_id, day)) as cur:
+        row = await cur.fetchone()
+    return DayReport(*row) if row else None
+
+
+class DailyReports:
+    """
+    build(cfg, day, prev) -> DayReport — снимок дня группы; prev — прежний снимок того же дня,
+    чьи ставки надо сохранить (None — текущие ставки группы).
+    deliver(cfg, report, late) — разослать отчёт; late — рассылка после простоя.
+    """
+
+    def __init__(self, db: Database, at: dtime,
+                 build: Callable[[ChatConfig, int, DayReport | None], Awaitable[DayReport]],
+                 deliver: Callable[[ChatConfig, DayReport, bool], None],
+                 catchup_days: int = REPORT_CATCHUP_DAYS):
+        self.db = db
+        self.at = at
+        self.build = build
+        self.deliver = deliver
+        self.catchup_days = max(1, catchup_days)
+        self.stats = ReportStats()
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = asyncio.Event()
+
+    # ---------- снимки по расписанию ----------
+    async def run(self, groups: Iterable[ChatConfig]) -> int:
+        """Снимает и рассылает всё, что пора и ещё не сделано. Возвращает число разосланных отчётов."""
+        async with self._lock:
+            self.stats.runs += 1
+            sent = 0
+            for cfg in groups:
+                try:
+                    sent += await self._run_group(cfg)
+                except Exception:
+                    self.stats.errors += 1
+                    log.exception("Ежедневный отчёт группы %s не сформирован", cfg.chat_id)
+            self.stats.last_run = time.time()
+            return sent
+
+    async def _run_group(self, cfg: ChatConfig) -> int:
+        now = cfg.now()
+        due = due_day(now, self.at)
+        oldest = due - self.catchup_days + 1
+        async with self.db.read() as conn:
+            async with conn.execute("SELECT MAX(day) FROM day_reports WHERE chat_id=?", (cfg.chat_id,)) as cur:
+                last = (await cur.fetchone())[0]
+        # после последнего снимка; у новой группы (или при первом запуске) — только последний день
+        for d in range(due if last is None else max(last + 1, oldest), due + 1):
+            await self.db.run(save_report, await self.build(cfg, d, None))
+            self.stats.made += 1
+        async with self.db.read() as conn:
+            async with conn.execute("SELECT day FROM day_reports "
+                                    "WHERE chat_id=? AND day BETWEEN ? AND ? AND sent IS NULL ORDER BY day",
+                                    (cfg.chat_id, oldest, due)) as cur:
+                days = [d for d, in await cur.fetchall()]
+        pending = []
+        for d in days:
+            # снимок мог быть сделан раньше по запросу — перед рассылкой сверяем
+            rep, _ = await self._current(cfg, d, True)
+            pending.append(rep)
+        for rep in pending:
+            late = now - scheduled_at(rep.day, self.at, cfg.zone) > LATE_AFTER
+            self.deliver(cfg, rep, late)
+            self.stats.sent += 1
+            self.stats.late += late
+        if pending:
+            await self.db.run(mark_sent, cfg.chat_id, [rep.day for rep in pending], int(time.time()))
+        return len(pending)
+
+    # ---------- выдача ----------
+    async def get(self, cfg: ChatConfig, day: int, verify: bool = True) -> DayReport:
+        """
+        Отчёт за закрытый день: снимок, если день с тех пор не менялся, иначе новый снимок с прежними
+        ставками. verify=False — не сверять (день уже в архиве и меняться не может).
+        """
+        rep, fresh = await self._current(cfg, day, verify)
+        if fresh:
+            self.stats.served += 1
+        return rep
+
+    async def _current(self, cfg: ChatConfig, day: int, verify: bool) -> tuple[DayReport, bool]:
+        """(отчёт, True — это неизменный снимок)."""
+        async with self.db.read() as conn:
+            prev = await load_report(conn, cfg.chat_id, day)
+            current = await read_day(conn, cfg.chat_id, day) if prev is not None and verify else None
+        if prev is not None and (current is None or (current.sum_no, current.sum_disc, current.count) ==
+                                 (prev.sum_no, prev.sum_disc, prev.count)):
+            return prev, True
+        rep = await self.build(cfg, day, prev)
+        if prev is not None:
+            rep = replace(rep, sent=prev.sent)
+            self.stats.refreshed += 1
+        await self.db.run(save_report, rep)
+        return rep, False
+
+    # ---------- фоновая задача ----------
+    def start(self, groups: Callable[[], Awaitable[Iterable[ChatConfig]]], delay: float = 0.0):
+        """Первый прогон (досылка пропущенного) — через delay секунд, дальше — к ближайшему at."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(groups, delay), name="daily-reports")
+
+    async def stop(self):
+        self._closing.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+
+    async def _run(self, groups: Callable[[], Awaitable[Iterable[ChatConfig]]], delay: float):
+        if await self._wait(delay):
+            return
+        while not self._closing.is_set():
+            current = []
+            try:
+                current = list(await groups())
+                sent = await self.run(current)
+                if sent:
+                    log.info("Ежедневные отчёты разосланы: %s", sent)
+            except Exception:
+                log.exception("Ежедневные отчёты не разосланы")
+            if await self._wait(self._sleep_for(current)):
+                return
+
+    def _sleep_for(self, groups: list[ChatConfig]) -> float:
+        wait = MAX_SLEEP
+        for cfg in groups:
+            now = cfg.now()
+            nxt = datetime.combine(now.date(), self.at, cfg.zone)
+            if nxt <= now:
+                nxt += timedelta(days=1)
+            wait = min(wait, (nxt - now).total_seconds() + 1)
+        return wait
+
+    async def _wait(self, seconds: float) -> bool:
+        """Ждёт seconds или остановки. True — остановлены."""
+        try:
+            await asyncio.wait_for(self._closing.wait(), timeout=max(0.0, seconds))
+        except asyncio.TimeoutError:
+            pass
+        return self._closing.is_set()
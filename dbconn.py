@@ -0,0 +1,144 @@
+import asyncio
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import aiosqlite
+
+# Прагмы для пишущего соединения: WAL позволяет читателям не ждать писателя,
+# synchronous=NORMAL в режиме WAL безопасен и не делает fsync на каждый commit.
+WRITER_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+READER_PRAGMAS = (
+    "PRAGMA query_only=1",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+)
+
+# Транзакции, которые можно выполнить через Database.run: по имени их вызывает и воркер (shard.py)
+WRITE_OPS: dict[str, Callable[..., Awaitable]] = {}
+
+
+def write_op(fn):
+    """Регистрирует fn(conn, *args) как транзакцию для Database.run. Имя должно быть уникальным."""
+    # повторная регистрация — тот же модуль, импортированный под другим именем (__main__ / main)
+    WRITE_OPS[fn.__name__] = fn
+    return fn
+
+
+class Database:
+    """
+    Долгоживущие соединения с SQLite:
+      • одно пишущее соединение (все изменения идут через него по очереди);
+      • небольшой пул read-only соединений для отчётов.
+    Открывается один раз в main() и закрывается при остановке бота.
+    В воркере (use_remote) пишущего соединения нет: run() отправляет транзакцию основному процессу.
+    """
+
+    def __init__(self, path: Path, readers: int = 2):
+        self.path = Path(path)
+        self.readers = max(1, readers)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._pool: asyncio.Queue[aiosqlite.Connection] | None = None
+        self._all_readers: list[aiosqlite.Connection] = []
+        self._remote: Callable[[str, tuple], Awaitable] | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._pool is not None
+
+    def use_remote(self, call: Callable[[str, tuple], Awaitable]):
+        """call(имя, args) выполняет WRITE_OPS[имя] в пишущем процессе. До open()."""
+        self._remote = call
+
+    async def open(self):
+        if self.is_open:
+            return
+        if self._remote is None:
+            self._writer = await aiosqlite.connect(self.path)
+            for p in WRITER_PRAGMAS:
+                await self._writer.execute(p)
+            await self._writer.commit()
+
+        self._pool = asyncio.Queue()
+        uri = f"file:{self.path.resolve().as_posix()}?mode=ro"
+        for _ in range(self.readers):
+            conn = await aiosqlite.connect(uri, uri=True)
+            for p in READER_PRAGMAS:
+                await conn.execute(p)
+            self._all_readers.append(conn)
+            self._pool.put_nowait(conn)
+
+    async def close(self):
+        # дожидаемся текущей транзакции, чтобы не оборвать её посередине
+        async with self._write_lock:
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            self._pool = None
+            if self._writer is not None:
+                await self._writer.execute("PRAGMA optimize")
+                await self._writer.close()
+                self._writer = None
+
+    async def run(self, op, *args):
+        """Выполняет транзакцию op(conn, *args) (см. write_op) и возвращает её результат."""
+        if self._remote is not None:
+            return await self._remote(op.__name__, args)
+        async with self.write() as conn:
+            return await op(conn, *args)
+
+    @asynccontextmanager
+    async def write(self):
+        """Транзакция на пишущем соединении: commit при выходе, rollback при ошибке."""
+        if self._remote is not None:
+            raise RuntimeError("В воркере запись только через Database.run()")
+        if self._writer is None:
+            raise RuntimeError("База не открыта: вызовите Database.open()")
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            else:
+                await self._writer.commit()
+
+    @asynccontextmanager
+    async def read_snapshot(self, capture: Callable[[], Any]):
+        """
+        (conn, capture()) — read-only соединение в открытой транзакции и результат capture(), снятые
+        под замком записи: снимок базы и capture() видят одни и те же commit'ы (то, что пишущие
+        обновляют в памяти сразу после commit, уже обновлено). Сами чтения идут без замка.
+        """
+        async with self.read() as conn:
+            async with self._write_lock:
+                await conn.execute("BEGIN")
+                # снимок WAL фиксируется первым чтением, а не BEGIN
+                async with conn.execute("SELECT 1 FROM sqlite_master LIMIT 1") as cur:
+                    await cur.fetchall()
+                captured = capture()
+            try:
+                yield conn, captured
+            finally:
+                await conn.rollback()
+
+    @asynccontextmanager
+    async def read(self):
+        """Берёт свободное read-only соединение из пула."""
+        if self._pool is None:
+            raise RuntimeError("База не открыта: вызовите Database.open()")
+        conn = await self._pool.get()
+        try:
+            yield conn
+        finally:
+            if self._pool is not None:
+                self._pool.put_nowait(conn)
@@ -0,0 +1,114 @@
+import asyncio
+import csv
+from datetime import date, datetime, tzinfo
+from pathlib import Path
+from typing import Sequence
+
+import aiosqlite
+
+from archive import attached
+from schema import day_date, day_number, from_fen
+
+try:  # xlsx — только если установлен openpyxl
+    from openpyxl import Workbook
+except ImportError:  # pragma: no cover
+    Workbook = None
+
+EXPORT_COLUMNS = [
+    "id", "ts", "date", "chat_id", "msg_id", "sender_id",
+    "type", "amount_cny", "pay_rub_per_cny", "payout_rub",
+]
+EXPORT_CHUNK = 5000
+
+
+def xlsx_available() -> bool:
+    return Workbook is not None
+
+
+class _CsvSink:
+    def __init__(self, path: Path):
+        self._f = path.open("w", newline="", encoding="utf-8")
+        self._w = csv.writer(self._f, delimiter=";")
+        self._w.writerow(EXPORT_COLUMNS)
+
+    def write(self, rows: list[list]):
+        self._w.writerows(rows)
+
+    def close(self):
+        self._f.close()
+
+
+class _XlsxSink:
+    def __init__(self, path: Path):
+        # write_only: строки сбрасываются во временные файлы openpyxl, а не копятся в памяти
+        self._path = path
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet("entries")
+        self._ws.append(EXPORT_COLUMNS)
+
+    def write(self, rows: list[list]):
+        for r in rows:
+            self._ws.append(r)
+
+    def close(self):
+        self._wb.save(self._path)
+
+
+async def export_entries(conn: aiosqlite.Connection, chat_id: int, start: date, end: date, path: Path,
+                         pay_no: float, pay_disc: float, tz: tzinfo, fmt: str = "csv",
+                         chunk: int = EXPORT_CHUNK, archives: Sequence[Path] = ()) -> int:
+    """
+    Потоково выгружает entries группы chat_id за [start, end] в файл path (csv или xlsx).
+    Строки читаются курсором порциями по chunk и сразу пишутся в файл,
+    так что в памяти держится только одна порция. Время выгружается в часовом поясе tz.
+    archives — помесячные архивы (archive.archives_for): читаются первыми, по одному.
+    Возвращает число строк.
+    """
+    if fmt == "xlsx":
+        if Workbook is None:
+            raise RuntimeError("Для xlsx нужен пакет openpyxl")
+        sink = _XlsxSink(path)
+    else:
+        sink = _CsvSink(path)
+
+    written = 0
+    # строки одного сообщения идут подряд с одним ts и днём — форматируем их один раз
+    last_ts, ts_iso = None, ""
+    last_day, day_iso = None, ""
+
+    async def dump(table: str):
+        nonlocal written, last_ts, ts_iso, last_day, day_iso
+        async with conn.execute(f"""
+            SELECT id, ts, day, chat_id, msg_id, sender_id, is_discount, amount_fen
+            FROM {table} WHERE chat_id=? AND day BETWEEN ? AND ?
+            ORDER BY day, id
+        """, (chat_id, day_number(start), day_number(end))) as cur:
+            while True:
+                batch = await cur.fetchmany(chunk)
+                if not batch:
+                    break
+                rows = []
+                for _id, ts, d, chat_id, msg_id, sender_id, is_disc, fen in batch:
+                    rate = pay_disc if is_disc else pay_no
+                    amount = from_fen(fen)
+                    if ts != last_ts:
+                        last_ts, ts_iso = ts, datetime.fromtimestamp(ts, tz).isoformat()
+                    if d != last_day:
+                        last_day, day_iso = d, day_date(d).isoformat()
+                    rows.append([
+                        _id, ts_iso, day_iso, chat_id, msg_id, sender_id,
+                        "disc" if is_disc else "no_disc",
+                        f"{amount:.2f}", f"{rate:.2f}", f"{amount * rate:.2f}",
+                    ])
+                # запись на диск — в отдельном потоке, чтобы не тормозить цикл событий
+                await asyncio.to_thread(sink.write, rows)
+                written += len(rows)
+
+    try:
+        for archive_path in archives:
+            async with attached(conn, archive_path, read_only=True) as s:
+                await dump(f"{s}.entries")
+        await dump("main.entries")
+    finally:
+        await asyncio.to_thread(sink.close)
+    return written
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from schema import to_fen
+
+# Разобранное содержимое сообщения: суммы (в фэнях, как в базе) без скидки и со скидкой в порядке строк
+Fingerprint = tuple[tuple[int, ...], tuple[int, ...]]
+
+
+def fingerprint(no_list: list[float], disc_list: list[float]) -> Fingerprint:
+    return tuple(map(to_fen, no_list)), tuple(map(to_fen, disc_list))
+
+
+@dataclass
+class FingerprintStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    skipped: int = 0   # правок, после которых суммы не изменились и перезапись не понадобилась
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class FingerprintCache:
+    """
+    LRU-кэш «что сейчас записано по сообщению»: (chat_id, msg_id) -> Fingerprint.
+    Заполняется при каждой записи; при промахе вызывающий код смотрит в базу.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self.stats = FingerprintStats()
+        self._data: OrderedDict[tuple[int, int], Fingerprint] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: tuple[int, int]) -> Fingerprint | None:
+        fp = self._data.get(key)
+        if fp is None:
+            self.stats.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.stats.hits += 1
+        return fp
+
+    def put(self, key: tuple[int, int], fp: Fingerprint):
+        self._data[key] = fp
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.stats.evictions += 1
+
+    def discard(self, key: tuple[int, int]):
+        self._data.pop(key, None)
+
+    def discard_chat(self, chat_id: int):
+        """Сбросить записи всех сообщений группы (как после /clear_today)."""
+        for key in [k for k in self._data if k[0] == chat_id]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,208 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional
+
+import aiosqlite
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+log = logging.getLogger(__name__)
+
+
+@dataclass
+class _Record:
+    state: str | None = None
+    data: dict = field(default_factory=dict)
+    updated: float = 0.0
+
+    def is_empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM-хранилище в SQLite (отдельный файл в data/) с горячим LRU-слоем в памяти.
+      • чтение — из памяти; в базу идём только при промахе (после рестарта или вытеснения);
+      • запись — в память, в базу пачкой раз в flush_interval секунд (write-back);
+      • состояния, которых не трогали дольше ttl, удаляются и из памяти, и из базы.
+    """
+
+    def __init__(self, path: Path, max_hot: int = 1000, ttl: float = 24 * 3600,
+                 flush_interval: float = 2.0, key_builder: KeyBuilder | None = None):
+        self.path = Path(path)
+        self.max_hot = max_hot
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._hot: OrderedDict[str, _Record] = OrderedDict()
+        self._dirty: dict[str, _Record] = {}   # ещё не записано в базу (в т.ч. вытесненное из памяти)
+        self._conn: aiosqlite.Connection | None = None
+        self._open_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._task: asyncio.Task | None = None
+        self._closing = asyncio.Event()
+        self.evicted = 0
+        self.expired = 0
+        self.db_loads = 0
+        self.flushes = 0
+
+    # ---------- API aiogram ----------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        rec = await self._record(key)
+        rec.state = state.state if isinstance(state, State) else state
+        self._touch(key, rec)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        rec = await self._record(key)
+        rec.data = json.loads(json.dumps(data))  # копия + проверка, что данные сериализуемы
+        self._touch(key, rec)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return json.loads(json.dumps((await self._record(key)).data))
+
+    async def close(self) -> None:
+        # не cancel(): фоновая задача могла бы оборваться посреди flush и потерять пачку
+        self._closing.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        if self._conn is not None:
+            await self.flush()
+            await self._conn.close()
+            self._conn = None
+
+    # ---------- обслуживание ----------
+    @property
+    def hot_size(self) -> int:
+        return len(self._hot)
+
+    @property
+    def dirty_size(self) -> int:
+        return len(self._dirty)
+
+    async def flush(self):
+        """Пишет все изменённые записи одной транзакцией."""
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            conn = await self._connection()
+            batch, self._dirty = self._dirty, {}
+            upserts = [(k, r.state, json.dumps(r.data, ensure_ascii=False), r.updated)
+                       for k, r in batch.items() if not r.is_empty()]
+            deletes = [(k,) for k, r in batch.items() if r.is_empty()]
+            try:
+                if upserts:
+                    await conn.executemany("""
+                        INSERT INTO fsm_states(key, state, data, updated) VALUES(?,?,?,?)
+                        ON CONFLICT(key) DO UPDATE SET
+                            state=excluded.state, data=excluded.data, updated=excluded.updated
+                    """, upserts)
+                if deletes:
+                    await conn.executemany("DELETE FROM fsm_states WHERE key=?", deletes)
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                for k, r in batch.items():
+                    self._dirty.setdefault(k, r)
+                raise
+            self.flushes += 1
+
+    async def expire(self) -> int:
+        """Удаляет состояния старше ttl. Возвращает, сколько удалено из памяти."""
+        cutoff = time.time() - self.ttl
+        stale = [k for k, r in self._hot.items() if r.updated < cutoff]
+        for k in stale:
+            del self._hot[k]
+            self._dirty.pop(k, None)
+        self.expired += len(stale)
+        conn = await self._connection()
+        await conn.execute("DELETE FROM fsm_states WHERE updated < ?", (cutoff,))
+        await conn.commit()
+        return len(stale)
+
+    # ---------- внутреннее ----------
+    async def _connection(self) -> aiosqlite.Connection:
+        if self._conn is None:
+            async with self._open_lock:
+                if self._conn is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    conn = await aiosqlite.connect(self.path)
+                    await conn.execute("PRAGMA journal_mode=WAL")
+                    await conn.execute("PRAGMA synchronous=NORMAL")
+                    await conn.execute("""
+                        CREATE TABLE IF NOT EXISTS fsm_states(
+                            key TEXT PRIMARY KEY,
+                            state TEXT,
+                            data TEXT NOT NULL DEFAULT '{}',
+                            updated REAL NOT NULL
+                        )
+                    """)
+                    await conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_states(updated)")
+                    await conn.commit()
+                    self._conn = conn
+        if self._task is None and not self._closing.is_set():
+            self._task = asyncio.create_task(self._run(), name="fsm-storage")
+        return self._conn
+
+    async def _record(self, key: StorageKey) -> _Record:
+        k = self.key_builder.build(key)
+        rec = self._hot.get(k)
+        if rec is None:
+            rec = self._dirty.get(k)
+        if rec is None:
+            rec = await self._load(k)
+        if rec.updated and rec.updated < time.time() - self.ttl:
+            # брошенный расчёт: считаем, что состояния нет
+            rec = _Record()
+            self.expired += 1
+        self._hot[k] = rec
+        self._hot.move_to_end(k)
+        self._evict()
+        return rec
+
+    async def _load(self, k: str) -> _Record:
+        conn = await self._connection()
+        async with conn.execute("SELECT state, data, updated FROM fsm_states WHERE key=?", (k,)) as cur:
+            row = await cur.fetchone()
+        self.db_loads += 1
+        if row is None:
+            return _Record()
+        return _Record(row[0], json.loads(row[1]), row[2])
+
+    def _touch(self, key: StorageKey, rec: _Record):
+        rec.updated = time.time()
+        k = self.key_builder.build(key)
+        self._hot[k] = rec
+        self._dirty[k] = rec
+
+    def _evict(self):
+        # несохранённые записи остаются в _dirty до ближайшего flush, так что вытеснение их не теряет
+        while len(self._hot) > self.max_hot:
+            self._hot.popitem(last=False)
+            self.evicted += 1
+
+    async def _run(self):
+        next_expire = time.monotonic() + min(self.ttl, 600)
+        while not self._closing.is_set():
+            try:
+                await asyncio.wait_for(self._closing.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+                if time.monotonic() >= next_expire:
+                    await self.expire()
+                    next_expire = time.monotonic() + min(self.ttl, 600)
+            except Exception:
+                log.exception("Не удалось сохранить FSM-состояния")
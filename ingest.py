@@ -0,0 +1,312 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from datetime import datetime
+
+from dbconn import Database, write_op
+from schema import epoch, to_fen
+from totals import DayTotals, rows_by_day
+
+
+@dataclass
+class Replacement:
+    """Новое содержимое сообщения менеджера: все прежние строки по (chat_id,msg_id) заменяются."""
+    chat_id: int
+    msg_id: int
+    sender_id: int | None
+    no_list: list[float]
+    disc_list: list[float]
+    ts: datetime
+    day: int  # номер дня (schema.day_number) в часовом поясе группы
+    new: bool = False  # первая версия сообщения: прежних строк у него в базе нет (не правка)
+
+
+def _item_totals(it: Replacement) -> DayTotals:
+    no_fen = [to_fen(a) for a in it.no_list]
+    disc_fen = [to_fen(a) for a in it.disc_list]
+    return DayTotals(sum(no_fen), sum(disc_fen), len(no_fen) + len(disc_fen))
+
+
+@dataclass
+class IngestStats:
+    submitted: int = 0
+    coalesced: int = 0     # правки, схлопнутые с ещё не записанной версией
+    batches: int = 0
+    rows: int = 0
+    last_batch: int = 0
+    largest_batch: int = 0
+    max_depth: int = 0
+    last_flush_ms: float = 0.0
+    errors: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class IngestQueue:
+    """
+    Write-behind очередь для записей из группы менеджера.
+    Копит замены сообщений, повторные правки одного msg_id схлопывает,
+    и пишет пачкой (executemany) одной транзакцией — по размеру или по таймеру.
+    """
+
+    def __init__(self, db: Database, max_batch: int = 200, max_delay: float = 0.05,
+                 max_pending: int = 5000, written_cache: int = 20000):
+        self.db = db
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.stats = IngestStats()
+        self._pending: dict[tuple[int, int], Replacement] = {}
+        self._inflight: dict[tuple[int, int], Replacement] = {}  # пачка, которая пишется сейчас
+        # что недавно записанные сообщения сейчас дают в базе: (день, итоги) — для правок в очереди
+        self._written: OrderedDict[tuple[int, int], tuple[int, DayTotals]] = OrderedDict()
+        self.written_cache = written_cache
+        self._submits = 0       # счётчик submit
+        self._written_upto = 0  # submit с номером не больше этого уже записаны
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+        self._flush_lock = asyncio.Lock()
+        self._after_write = []  # колбэки (added, removed) после commit пачки
+        self._after_items = []  # колбэки (items) после commit пачки
+        self._after_batch = []  # колбэки (seconds, rows) — время записи пачки в базу
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def pending(self, chat_id: int, msg_id: int) -> Replacement | None:
+        """Ещё не записанная замена для сообщения, если она есть в очереди."""
+        return self._pending.get((chat_id, msg_id))
+
+    @property
+    def generation(self) -> int:
+        """Растёт с каждой записанной пачкой: по нему видно, не сменилось ли записанное за время чтения."""
+        return self.stats.batches
+
+    def pending_totals(self, chat_id: int) -> dict[int, DayTotals] | None:
+        """
+        Ещё не записанное изменение сумм группы по дням (очередь и пишущаяся пачка), — чтобы отчёт
+        мог прибавить его к итогам, не дожидаясь записи. Правка снимает то, что сообщение даёт
+        в базе сейчас; None — это неизвестно (сообщение записано не этой очередью или давно).
+        """
+        out: dict[int, DayTotals] = {}
+        for key in {**self._inflight, **self._pending}:
+            if key[0] != chat_id:
+                continue
+            first = self._inflight.get(key) or self._pending[key]
+            last = self._pending.get(key) or first
+            if not first.new:
+                base = self._written.get(key)
+                if base is None:
+                    return None
+                day, t = base
+                out[day] = DayTotals(-t.sum_no, -t.sum_disc, -t.count).plus(out.get(day))
+            out[last.day] = _item_totals(last).plus(out.get(last.day))
+        return out
+
+    def forget(self, chat_id: int, msg_ids=None):
+        """Строки сообщений (всех сообщений группы, если msg_ids None) изменены в обход очереди."""
+        if msg_ids is None:
+            for key in [k for k in self._written if k[0] == chat_id]:
+                del self._written[key]
+        else:
+            for msg_id in msg_ids:
+                self._written.pop((chat_id, msg_id), None)
+
+    def touches(self, chat_id: int, sender_id: int | None = None, msg_id: int | None = None) -> bool:
+        """Есть ли незаписанное для группы (отправителя, сообщения) — тогда читать entries только после flush."""
+        for src in (self._inflight, self._pending):
+            for (c, m), it in src.items():
+                if c == chat_id and (msg_id is None or m == msg_id) \
+                        and (sender_id is None or it.sender_id == sender_id):
+                    return True
+        return False
+
+    def add_after_write(self, callback):
+        """
+        callback(added, removed) вызывается после commit пачки;
+        added/removed — {(chat_id, day): DayTotals} по вставленным и удалённым строкам.
+        """
+        self._after_write.append(callback)
+
+    def add_after_items(self, callback):
+        """callback(items) — сами записанные замены (Replacement), в порядке записи, после commit."""
+        self._after_items.append(callback)
+
+    def add_after_batch(self, callback):
+        """callback(seconds, rows) — сколько заняла транзакция пачки и сколько строк вставлено."""
+        self._after_batch.append(callback)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="ingest-queue")
+
+    async def stop(self):
+        # не cancel(): отмена посреди записи откатила бы транзакцию и потеряла пачку
+        self._closing = True
+        self._wakeup.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while self._pending:
+            await self.flush()
+
+    async def submit(self, item: Replacement):
+        """Ставит замену в очередь. Не ждёт записи, кроме случая переполнения очереди."""
+        if self.depth >= self.max_pending:
+            await self.flush()
+        key = (item.chat_id, item.msg_id)
+        prev = self._pending.get(key)
+        if prev is not None:
+            self.stats.coalesced += 1
+            if prev.new and not item.new:
+                item = replace(item, new=True)  # правка ещё не записанного: в базе по-прежнему ничего
+        self._pending[key] = item
+        self._submits += 1
+        self.stats.submitted += 1
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        self._wakeup.set()
+
+    async def write_now(self, items: list[Replacement]):
+        """
+        Пишет замены сразу, одной транзакцией, минуя очередь (догрузка после простоя).
+        Повторы одного (chat_id,msg_id) схлопываются — остаётся последняя версия.
+        """
+        batch: dict[tuple[int, int], Replacement] = {}
+        for it in items:
+            key = (it.chat_id, it.msg_id)
+            if key in batch:
+                self.stats.coalesced += 1
+            batch[key] = it
+        self.stats.submitted += len(items)
+        # уже стоящее в очереди старше — пусть ляжет раньше и не затрёт эту пачку
+        await self.flush()
+        async with self._flush_lock:
+            self._inflight = batch
+            try:
+                await self._write(list(batch.values()))
+            finally:
+                self._inflight = {}
+
+    async def flush(self):
+        """
+        Немедленно пишет всё, что поставлено в очередь до вызова. Нужна перед чтением/удалением записей.
+        Одна пачка, без повторов: иначе под постоянным потоком сообщений flush не заканчивался бы.
+        Ждавшие блокировку, чьё уже записала чужая пачка, выходят сразу — без своей записи.
+        """
+        target = self._submits
+        async with self._flush_lock:
+            if not self._pending or self._written_upto >= target:
+                return
+            batch, self._pending = self._pending, {}
+            upto = self._submits
+            self._inflight = batch
+            try:
+                await self._write(list(batch.values()))
+                self._written_upto = upto
+            except Exception:
+                # возвращаем пачку в очередь, не затирая более свежие правки
+                for key, item in batch.items():
+                    self._pending.setdefault(key, item)
+                raise
+            finally:
+                self._inflight = {}
+
+    async def _run(self):
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._closing:
+                break
+            deadline = time.monotonic() + self.max_delay
+            while self.depth < self.max_batch and not self._closing:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=left)
+                except asyncio.TimeoutError:
+                    break
+                self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # пачка осталась в очереди — повторим чуть позже
+                self.stats.errors += 1
+                await asyncio.sleep(1.0)
+                self._wakeup.set()
+
+    async def _write(self, items: list[Replacement]):
+        started = time.perf_counter()
+        keys = [(it.chat_id, it.msg_id) for it in items]
+        rows = []
+        added: dict[tuple[int, int], DayTotals] = {}
+        item_totals = []
+        for it in items:
+            ts = epoch(it.ts)
+            rows.extend((ts, it.day, to_fen(a), 0, it.chat_id, it.msg_id, it.sender_id) for a in it.no_list)
+            rows.extend((ts, it.day, to_fen(a), 1, it.chat_id, it.msg_id, it.sender_id) for a in it.disc_list)
+            it_t = _item_totals(it)
+            item_totals.append(it_t)
+            t = added.setdefault((it.chat_id, it.day), DayTotals())
+            t.sum_no += it_t.sum_no
+            t.sum_disc += it_t.sum_disc
+            t.count += it_t.count
+        t0 = time.perf_counter()
+        removed = await self.db.run(ingest_batch, keys, rows, bool(self._after_write))
+        seconds = time.perf_counter() - t0
+        for it, it_t in zip(items, item_totals):
+            key = (it.chat_id, it.msg_id)
+            self._written.pop(key, None)
+            self._written[key] = (it.day, it_t)
+        while len(self._written) > self.written_cache:
+            self._written.popitem(last=False)
+        for cb in self._after_write:
+            cb(added, removed)
+        for cb in self._after_items:
+            cb(items)
+        for cb in self._after_batch:
+            cb(seconds, len(rows))
+        s = self.stats
+        s.batches += 1
+        s.rows += len(rows)
+        s.last_batch = len(items)
+        s.largest_batch = max(s.largest_batch, len(items))
+        s.last_flush_ms = (time.perf_counter() - started) * 1000
+
+
+_IN_CHUNK = 500  # msg_id в одном IN (...): под лимитом параметров SQLite
+
+
+@write_op
+async def ingest_batch(conn, keys: list[tuple[int, int]], rows: list[tuple],
+                       want_removed: bool) -> dict[tuple[int, int], DayTotals]:
+    """Заменяет строки сообщений keys на rows. Возвращает итоги удалённого (если want_removed)."""
+    removed = {}
+    if want_removed:
+        # chat_id=? AND msg_id IN (...) — поиск по idx_entries_chat_msg на каждый msg_id, один запрос
+        # на группу; RETURNING — снятые строки без отдельного SELECT
+        by_chat: dict[int, list[int]] = {}
+        for chat_id, msg_id in keys:
+            by_chat.setdefault(chat_id, []).append(msg_id)
+        deleted = []
+        for chat_id, msg_ids in by_chat.items():
+            for i in range(0, len(msg_ids), _IN_CHUNK):
+                part = msg_ids[i:i + _IN_CHUNK]
+                async with conn.execute(f"""
+                    DELETE FROM entries WHERE chat_id=? AND msg_id IN ({",".join("?" * len(part))})
+                    RETURNING chat_id, day, is_discount, amount_fen, 1
+                """, (chat_id, *part)) as cur:
+                    deleted.extend(await cur.fetchall())
+        removed = rows_by_day(deleted)
+    else:
+        await conn.executemany("DELETE FROM entries WHERE chat_id=? AND msg_id=?", keys)
+    if rows:
+        await conn.executemany(
+            "INSERT INTO entries(ts,day,amount_fen,is_discount,chat_id,msg_id,sender_id) VALUES(?,?,?,?,?,?,?)",
+            rows
+        )
+    return removed
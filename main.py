@@ -1,27 +1,57 @@
 import asyncio
 import os
 import csv
+import io
+import logging
+import secrets
+import signal
+import tempfile
+import time
+from contextlib import suppress
+from dataclasses import replace
 from pathlib import Path
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 
 import aiosqlite
 from aiogram import Bot, Dispatcher, F
 from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, FSInputFile, BufferedInputFile
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.context import FSMContext
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
+
+from dbconn import Database, write_op
+from schema import day_date, day_number, from_fen, migrate
+from ingest import IngestQueue, Replacement
+from totals import TotalsCache, DayTotals, read_day, rows_by_day
+from export import export_entries, xlsx_available
+from archive import Archiver, archives_for, list_archives, range_totals
+from catchup import Catchup
+from daily import DailyReports, DayReport, parse_report_at
+from shard import ShardFront, WorkerLink
+from chats import EDITABLE, ChatConfig, ChatRegistry
+from undo import UndoJournal, UndoResult
+from whatif import DayRecalc, RateSet, load_rate_sets, parse_overrides, recompute, save_rate_set
+from parsing import parse_mixed_lines
+from rates import DEFAULT_TIERS, TierTable
+from output import MESSAGE_LIMIT, send_paged, split_lines, split_text
+from outbox import GLOBAL_RATE, Outbox, Outgoing
+from fingerprint import Fingerprint, FingerprintCache, fingerprint
+from fsm_storage import SQLiteStorage
+from csvlog import CsvLog
+from webhook import WebhookServer
+from metrics import HandlerTimingMiddleware, Metrics
 
 # ================== КОНФИГ =====================
 API_TOKEN = os.getenv("TGTOKEN")  # токен бота
 
-# Группа, где менеджер(ы) кидают суммы (+/-)
+# Группа, где менеджер(ы) кидают суммы (+/-). Групп может быть много (таблица chats,
+# команды /groups, /group, /chat); эта регистрируется при первом запуске
 MANAGER_CHAT_ID = -1002759641457
 
-# Кто может вызывать отчёт/удаление (твоя учётка)
+# Кто может вызывать отчёт/удаление (твоя учётка) — админы всех групп
 ADMIN_CHAT_ID = [5682655968, 7400953103]  # список
 
 def is_admin(user_id: int) -> bool:
@@ -30,6 +60,14 @@ def is_admin(user_id: int) -> bool:
 # Часовой пояс для "сегодня"
 REPORT_TZ = os.getenv("REPORT_TZ", "Europe/Moscow")
 
+# Ежедневный отчёт: в REPORT_AT (ЧЧ:ММ по часовому поясу группы) итоги прошедших суток
+# снимаются и рассылаются админам группы и общим, так что время — уже следующих суток
+# (по умолчанию 00:05); пусто или off — не рассылать.
+# Пропущенное за простой (не больше REPORT_CATCHUP_DAYS дней) досылается при запуске
+REPORT_AT = parse_report_at(os.getenv("REPORT_AT", "00:05"))
+REPORT_CATCHUP_DAYS = int(os.getenv("REPORT_CATCHUP_DAYS", "3"))
+REPORT_FRONT_DELAY = 30.0  # при WORKERS > 1: сек до первого прогона, пока воркеры догружают простой
+
 # Ставки выплат партнёру (в руб./за 1 юань)
 PAY_NO_DISCOUNT_RUB_PER_CNY = 0.15   # без скидки
 PAY_DISCOUNT_RUB_PER_CNY   = 0.10    # со скидкой
@@ -38,13 +76,162 @@ PAY_DISCOUNT_RUB_PER_CNY   = 0.10    # со скидкой
 CHECK_ADD_NO_DISCOUNT = 0.10
 CHECK_ADD_DISCOUNT    = 0.05
 
+# Ставки, надбавки и часовой пояс выше — значения по умолчанию для новых групп;
+# у каждой группы свои (/chat set), они же берутся в личном расчёте её админа
+DEFAULT_CHAT = ChatConfig(
+    chat_id=MANAGER_CHAT_ID,
+    pay_no=PAY_NO_DISCOUNT_RUB_PER_CNY, pay_disc=PAY_DISCOUNT_RUB_PER_CNY,
+    check_add_no=CHECK_ADD_NO_DISCOUNT, check_add_disc=CHECK_ADD_DISCOUNT,
+    tz=REPORT_TZ,
+)
+
+# Диапазоны сумм для курсов: нижние границы через запятую, например "0,1000,3000,10000,30000".
+# Не задано — стандартные пять диапазонов.
+_tier_bounds = os.getenv("RATE_TIER_BOUNDS")
+RATE_TIERS = (TierTable.from_bounds([float(b) for b in _tier_bounds.split(",")])
+              if _tier_bounds else DEFAULT_TIERS)
+
+# Больше стольких проверочных строк — список уходит файлом, а не пачкой сообщений
+VERIFY_DOC_THRESHOLD = int(os.getenv("VERIFY_DOC_THRESHOLD", "300"))
+# /whatif за период длиннее стольких дней — по дням файлом, в сообщении только итог
+WHATIF_DOC_DAYS = int(os.getenv("WHATIF_DOC_DAYS", "31"))
+# самый длинный период /whatif: пересчёт — один проход по строкам периода (и его архивам) на одном
+# соединении читателя; предел ограничивает, сколько ждёт ответ и сколько держатся читатель и снимок WAL
+WHATIF_MAX_DAYS = int(os.getenv("WHATIF_MAX_DAYS", "366"))
+
 DATA_DIR = Path("data")
 DB_PATH = DATA_DIR / "report.db"
 LOG_CSV = DATA_DIR / "log.csv"  # опционально (необязательный csv-лог)
+FSM_DB_PATH = DATA_DIR / "fsm.db"  # состояния диалога расчёта (переживают перезапуск)
+
+# FSM: сколько состояний держать в памяти, через сколько секунд брошенный расчёт забывается
+# и как часто изменения сбрасываются в базу
+FSM_HOT_SIZE = int(os.getenv("FSM_HOT_SIZE", "1000"))
+FSM_TTL = float(os.getenv("FSM_TTL", str(24 * 3600)))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "2"))
+
+# CSV-лог расчётов: пишется в фоне; ротация по размеру файла (байт) и число старых файлов
+LOG_CSV_COLUMNS = ["ts_iso", "date", "sum_no", "sum_disc", "total_cny", "payout_no", "payout_disc", "payout_total"]
+LOG_CSV_MAX_BYTES = int(os.getenv("LOG_CSV_MAX_BYTES", str(5 * 2**20)))
+LOG_CSV_BACKUPS = int(os.getenv("LOG_CSV_BACKUPS", "5"))
+
+# Сколько read-only соединений держать для отчётов
+DB_READERS = int(os.getenv("DB_READERS", "2"))
+
+# Пакетная запись сообщений менеджера: размер пачки и окно ожидания (сек)
+INGEST_MAX_BATCH = int(os.getenv("INGEST_MAX_BATCH", "200"))
+INGEST_MAX_DELAY = float(os.getenv("INGEST_MAX_DELAY", "0.05"))
+
+# Сколько сообщений помнить для проверки «правка не изменила суммы»
+FINGERPRINT_CACHE_SIZE = int(os.getenv("FINGERPRINT_CACHE_SIZE", "10000"))
+
+# Исходящие в группу менеджера: окно схлопывания подтверждений «Принято» (сек, 0 — только
+# то, что уже скопилось в очереди) и предел очереди
+OUTBOX_COALESCE_WINDOW = float(os.getenv("OUTBOX_COALESCE_WINDOW", "0"))
+OUTBOX_MAX_QUEUE = int(os.getenv("OUTBOX_MAX_QUEUE", "2000"))
+
+# Периодическая сверка кэша сумм с базой (сек, 0 — выключено)
+TOTALS_SELF_CHECK_INTERVAL = float(os.getenv("TOTALS_SELF_CHECK_INTERVAL", "0"))
+
+# Webhook вместо polling: задан WEBHOOK_URL (публичный https-адрес) — бот поднимает aiohttp-сервер.
+# WEBHOOK_SECRET сверяется с заголовком X-Telegram-Bot-Api-Secret-Token. Не задан — при каждом запуске
+# берётся случайный: set_webhook регистрирует его заново, а запросы без него не принимаются.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+# Замеры для /stats: по скольким последним вызовам считать квантили; METRICS_PORT > 0 —
+# ещё и GET /metrics в формате Prometheus на METRICS_HOST:METRICS_PORT
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1000"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Архив: закрытые месяцы старше ARCHIVE_HOT_MONTHS (не считая текущего) переносятся
+# из report.db в ARCHIVE_DIR/ГГГГ-ММ.db. ARCHIVE_KEEP_MONTHS — срок хранения архивов
+# (0 — бессрочно), ARCHIVE_VACUUM — сжимать архив после переноса, ARCHIVE_INTERVAL —
+# как часто запускать перенос (сек, 0 — только вручную командой /archive run)
+ARCHIVE_DIR = DATA_DIR / "archive"
+ARCHIVE_HOT_MONTHS = int(os.getenv("ARCHIVE_HOT_MONTHS", "2"))
+ARCHIVE_KEEP_MONTHS = int(os.getenv("ARCHIVE_KEEP_MONTHS", "0"))
+ARCHIVE_VACUUM = os.getenv("ARCHIVE_VACUUM", "1") == "1"
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", str(6 * 3600)))
+
+# При старте догрузить апдейты, накопившиеся за время простоя (0 — сбрасывать их, как раньше)
+CATCHUP_ON_START = os.getenv("CATCHUP_ON_START", "1") == "1"
+
+# /undo N и /redo: сколько последних сообщений и отмен помнить на отправителя; UNDO_DAYS —
+# на сколько прошлых суток группы /undo может заходить (0 — только сегодняшние)
+UNDO_DEPTH = int(os.getenv("UNDO_DEPTH", "20"))
+UNDO_DAYS = int(os.getenv("UNDO_DAYS", "0"))
+
+# WORKERS > 1 — несколько процессов: основной принимает апдейты и один пишет в report.db,
+# а обрабатывают их WORKERS воркеров, каждый — свою часть чатов (по chat_id, см. shard.py).
+# У каждого воркера свои файлы fsm-N.db и log-N.csv; после смены WORKERS начатые
+# в личке расчёты (FSM) начинаются заново
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+log = logging.getLogger(__name__)
 
 # ================== БОТ ==================
 bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
+fsm_storage = SQLiteStorage(FSM_DB_PATH, max_hot=FSM_HOT_SIZE, ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL)
+dp = Dispatcher(storage=fsm_storage)
+db = Database(DB_PATH, readers=DB_READERS)  # открывается в main()
+ingest = IngestQueue(db, max_batch=INGEST_MAX_BATCH, max_delay=INGEST_MAX_DELAY)
+totals_cache = TotalsCache()  # суммы по (группа, день) в памяти, прогревается в main()
+chats = ChatRegistry(db, DEFAULT_CHAT, super_admins=ADMIN_CHAT_ID)  # загружается в main()
+fingerprints = FingerprintCache(FINGERPRINT_CACHE_SIZE)
+calc_log = CsvLog(LOG_CSV, LOG_CSV_COLUMNS, max_bytes=LOG_CSV_MAX_BYTES, backups=LOG_CSV_BACKUPS)
+metrics = Metrics(window=METRICS_WINDOW)
+dp.message.middleware(HandlerTimingMiddleware(metrics))
+dp.edited_message.middleware(HandlerTimingMiddleware(metrics))
+
+# парсер вызывается на каждое сообщение группы — его время меряем отдельно
+_parse_mixed_lines = metrics.timed("parser.parse_mixed_lines",
+                                   rows=lambda r: len(r[0]) + len(r[1]))(parse_mixed_lines)
+
+def _on_ingest_written(added: dict[tuple[int, int], DayTotals], removed: dict[tuple[int, int], DayTotals]):
+    totals_cache.apply(removed, -1)
+    totals_cache.apply(added)
+
+ingest.add_after_write(_on_ingest_written)
+ingest.add_after_batch(lambda seconds, rows: metrics.observe("db.ingest_batch", seconds, rows))
+
+undo_journal = UndoJournal(db, depth=UNDO_DEPTH)  # загружается в main()
+ingest.add_after_items(undo_journal.observe)
+undo_journal.add_after_apply(_on_ingest_written)
+
+archiver = Archiver(db, ARCHIVE_DIR, hot_months=ARCHIVE_HOT_MONTHS, keep_months=ARCHIVE_KEEP_MONTHS,
+                    vacuum=ARCHIVE_VACUUM)
+archiver.add_after_archive(totals_cache.drop_day)
+
+# лимит Telegram общий на бота — при нескольких воркерах каждый берёт свою долю,
+# и ещё одну — основной процесс: он тоже шлёт (ежедневные отчёты админам)
+OUTBOX_SENDERS = WORKERS + 1 if WORKERS > 1 else 1
+outbox = Outbox(bot, global_rate=GLOBAL_RATE / OUTBOX_SENDERS, max_queue=OUTBOX_MAX_QUEUE,
+                coalesce_window=OUTBOX_COALESCE_WINDOW)
+
+def _summarize_accepted(items: list[Outgoing]) -> str:
+    n_no = sum(it.payload["n_no"] for it in items)
+    n_disc = sum(it.payload["n_disc"] for it in items)
+    total = sum(it.payload["total"] for it in items)
+    ids = ", ".join(str(it.payload["msg_id"]) for it in items)
+    return (
+        f"Принято сообщений: {len(items)} (msg_id {ids}): "
+        f"+{n_no} без скидки, -{n_disc} со скидкой. Сумма: {_format_cny(total)}"
+    )
+
+outbox.set_summarizer("accepted", _summarize_accepted)
+
+metrics.gauge("ingest.depth", lambda: ingest.depth)
+metrics.gauge("outbox.depth", lambda: outbox.depth)
+metrics.gauge("fsm.hot", lambda: fsm_storage.hot_size)
+metrics.gauge("fsm.dirty", lambda: fsm_storage.dirty_size)
+metrics.gauge("fingerprints.size", lambda: len(fingerprints))
+metrics.gauge("chats.count", lambda: len(chats))
 
 # ================== КЛАВИАТУРЫ ==================
 main_kb = ReplyKeyboardMarkup(
@@ -61,14 +248,11 @@ cancel_kb = ReplyKeyboardMarkup(
 
 # ================== FSM ДЛЯ РАСЧЁТА ==================
 class ProfitStates(StatesGroup):
-    rate_ge_30000 = State()
-    rate_10000_30000 = State()
-    rate_3000_10000 = State()
-    rate_1000_3000 = State()
-    rate_lt_1000 = State()
+    rate = State()            # курс для очередного диапазона из RATE_TIERS (номер — в tier_step)
     amounts_mixed = State()   # единый столбик сумм
 
 # ================== УТИЛИТЫ ==================
+# без привязки к группе (архив, личный расчёт) — часовой пояс по умолчанию
 def _tznow() -> datetime:
     return datetime.now(ZoneInfo(REPORT_TZ))
 
@@ -90,194 +274,237 @@ def _format_cny(x: float) -> str:
     return f"{x:,.2f} ¥".replace(",", " ")
 
 def _pick_rate_for_amount(cny_amount: float, rates: dict) -> float:
-    if cny_amount >= 30000:
-        return rates["ge_30000"]
-    if 10000 <= cny_amount < 30000:
-        return rates["r_10000_30000"]
-    if 3000 <= cny_amount < 10000:
-        return rates["r_3000_10000"]
-    if 1000 <= cny_amount < 3000:
-        return rates["r_1000_3000"]
-    return rates["lt_1000"]
-
-def _parse_mixed_lines(text: str) -> tuple[list[float], list[float]]:
-    """
-    Возвращает (без_скидки, со_скидкой) из форматов:
-      bs1000  | bs 1000  -> без скидки
-      s1000   | s 1000   -> со скидкой
-    Регистр не важен. Остальные строки игнорируются.
-    """
-    no_disc, disc = [], []
-    for raw in text.replace("\t", "\n").splitlines():
-        line = raw.strip().lower().replace(",", ".")
-        if not line:
-            continue
-
-        # допускаем разделение пробелом: 'bs 1000' / 's 1000'
-        parts = line.split()
-        token = "".join(parts)  # склеиваем, чтобы 'bs 1000' -> 'bs1000'
-
-        def parse_amount(s: str) -> float | None:
-            # вытащим число из хвоста токена
-            num = "".join(ch for ch in s if (ch.isdigit() or ch in "."))
-            if not num:
-                return None
-            try:
-                v = float(num)
-                return v if v > 0 else None
-            except ValueError:
-                return None
-
-        if token.startswith("bs"):
-            val = parse_amount(token[2:])
-            if val is not None:
-                no_disc.append(val)
-            continue
-
-        if token.startswith("s"):
-            val = parse_amount(token[1:])
-            if val is not None:
-                disc.append(val)
-            continue
-
-        # всё остальное теперь игнорируем
-    return no_disc, disc
-
+    return RATE_TIERS.pick(cny_amount, rates)
 
 # ================== БД ==================
 async def init_db():
     DATA_DIR.mkdir(parents=True, exist_ok=True)
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS entries(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT NOT NULL,
-            date TEXT NOT NULL,
-            amount REAL NOT NULL,
-            is_discount INTEGER NOT NULL, -- 0 без скидки, 1 со скидкой
-            chat_id INTEGER NOT NULL,
-            msg_id INTEGER NOT NULL,
-            sender_id INTEGER
-        )
-        """)
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_entries_date ON entries(date)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_entries_msg ON entries(chat_id, msg_id)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_entries_sender_date ON entries(sender_id, date)")
-        await db.commit()
-
-async def replace_message_entries(chat_id: int, msg_id: int, sender_id: int | None,
-                                  no_list: list[float], disc_list: list[float]):
-    """Полностью заменяет записи, привязанные к (chat_id,msg_id) на новые значения."""
-    now = _tznow()
-    d = _today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("DELETE FROM entries WHERE chat_id=? AND msg_id=?", (chat_id, msg_id))
-        for a in no_list:
-            await db.execute(
-                "INSERT INTO entries(ts,date,amount,is_discount,chat_id,msg_id,sender_id) VALUES(?,?,?,?,?,?,?)",
-                (now.isoformat(), d, float(a), 0, chat_id, msg_id, sender_id)
-            )
-        for a in disc_list:
-            await db.execute(
-                "INSERT INTO entries(ts,date,amount,is_discount,chat_id,msg_id,sender_id) VALUES(?,?,?,?,?,?,?)",
-                (now.isoformat(), d, float(a), 1, chat_id, msg_id, sender_id)
-            )
-        await db.commit()
-
-async def clear_today() -> tuple[int, float, float]:
-    """Удаляет все записи за текущие сутки. Возвращает (count, sum_no, sum_disc)."""
-    d = _today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT 
-              COUNT(*),
-              COALESCE(SUM(CASE WHEN is_discount=0 THEN amount END),0),
-              COALESCE(SUM(CASE WHEN is_discount=1 THEN amount END),0)
-            FROM entries WHERE date=?
-        """, (d,)) as cur:
-            row = await cur.fetchone()
-        cnt, sum_no, sum_disc = row or (0, 0.0, 0.0)
-        await db.execute("DELETE FROM entries WHERE date=?", (d,))
-        await db.commit()
-    return int(cnt), float(sum_no), float(sum_disc)
+        # новая база создаётся сразу в последней версии схемы, старая обновляется (см. schema.py)
+        await migrate(db)
+
+async def init_chats():
+    """Загружает группы; в пустую таблицу (первый запуск) заносит MANAGER_CHAT_ID."""
+    await chats.load()
+    if not len(chats):
+        await chats.add(MANAGER_CHAT_ID)
+
+@metrics.timed("ingest.enqueue")  # только постановка в очередь; сама запись — db.ingest_batch
+async def replace_message_entries(cfg: ChatConfig, msg_id: int, sender_id: int | None,
+                                  no_list: list[float], disc_list: list[float], new: bool = False):
+    """
+    Полностью заменяет записи, привязанные к (cfg.chat_id,msg_id) на новые значения.
+    Запись отложенная: замена уходит в очередь ingest и пишется пачкой.
+    new — новое сообщение, не правка: пока оно в очереди, отчёты прибавляют его суммы без записи.
+    """
+    now = cfg.now()
+    await ingest.submit(Replacement(
+        chat_id=cfg.chat_id, msg_id=msg_id, sender_id=sender_id,
+        no_list=list(no_list), disc_list=list(disc_list),
+        ts=now, day=day_number(now.date()), new=new,
+    ))
+    fingerprints.put((cfg.chat_id, msg_id), fingerprint(no_list, disc_list))
+
+@metrics.timed("db.stored_fingerprint", rows=lambda fp: len(fp[0]) + len(fp[1]))
+async def stored_fingerprint(chat_id: int, msg_id: int) -> Fingerprint:
+    """Что сейчас записано по сообщению: из кэша, из очереди записи или из базы."""
+    key = (chat_id, msg_id)
+    fp = fingerprints.get(key)
+    if fp is not None:
+        return fp
+    pending = ingest.pending(chat_id, msg_id)
+    if pending is not None:
+        fp = fingerprint(pending.no_list, pending.disc_list)
+    else:
+        async with db.read() as conn:
+            async with conn.execute(
+                "SELECT amount_fen, is_discount FROM entries WHERE chat_id=? AND msg_id=? ORDER BY id",
+                (chat_id, msg_id)
+            ) as cur:
+                rows = await cur.fetchall()
+        fp = (tuple(a for a, d in rows if not d), tuple(a for a, d in rows if d))
+    fingerprints.put(key, fp)
+    return fp
+
+async def _flush_if(chat_id: int, sender_id: int | None = None, msg_id: int | None = None):
+    """Запись очереди ingest — только если в ней есть что-то для этой группы (отправителя, сообщения)."""
+    if ingest.touches(chat_id, sender_id=sender_id, msg_id=msg_id):
+        await ingest.flush()
+
+async def _with_pending(chat_id: int, read):
+    """
+    (read(), {день: DayTotals}) — итоги из кэша или day_totals и ещё не записанное в очереди ingest,
+    которое к ним надо прибавить; без ожидания записи. Если очередь не знает, что снимет из базы
+    правка (сообщение записано давно или не ею), очередь сначала записывается.
+    """
+    for _ in range(3):
+        gen = ingest.generation
+        extra = ingest.pending_totals(chat_id)
+        if extra is None:
+            break
+        res = await read()
+        if ingest.generation == gen:  # за время чтения ни одна пачка не записалась
+            return res, extra
+    await ingest.flush()
+    return await read(), {}
+
+@metrics.timed("db.clear_today", rows=lambda r: r[0])
+async def clear_today(cfg: ChatConfig) -> tuple[int, float, float]:
+    """Удаляет все записи группы за её текущие сутки. Возвращает (count, sum_no, sum_disc)."""
+    d = day_number(cfg.today())
+    await _flush_if(cfg.chat_id)
+    cnt, sum_no, sum_disc = await db.run(_clear_day_tx, cfg.chat_id, d)
+    totals_cache.drop(cfg.chat_id, d)
+    undo_journal.forget_day(cfg.chat_id, d)
+    ingest.forget(cfg.chat_id)
+    fingerprints.discard_chat(cfg.chat_id)
+    return int(cnt), from_fen(sum_no), from_fen(sum_disc)
+
+@write_op
+async def _clear_day_tx(conn, chat_id: int, d: int) -> tuple[int, int, int]:
+    async with conn.execute("""
+        SELECT 
+          COUNT(*),
+          COALESCE(SUM(CASE WHEN is_discount=0 THEN amount_fen END),0),
+          COALESCE(SUM(CASE WHEN is_discount=1 THEN amount_fen END),0)
+        FROM entries WHERE chat_id=? AND day=?
+    """, (chat_id, d)) as cur:
+        row = await cur.fetchone()
+    await conn.execute("DELETE FROM entries WHERE chat_id=? AND day=?", (chat_id, d))
+    return row or (0, 0, 0)
 
 # --- вместо delete_by_msg_id ---
+@metrics.timed("db.delete_by_msg_id", rows=lambda r: r[0])
 async def delete_by_msg_id(chat_id: int, msg_id: int) -> tuple[int, float, float]:
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT 
-              COUNT(*),
-              COALESCE(SUM(CASE WHEN is_discount=0 THEN amount END),0),
-              COALESCE(SUM(CASE WHEN is_discount=1 THEN amount END),0)
-            FROM entries WHERE chat_id=? AND msg_id=?
-        """, (chat_id, msg_id)) as cur:
-            row = await cur.fetchone()
-        cnt, sum_no, sum_disc = (row or (0, 0.0, 0.0))
-        await db.execute("DELETE FROM entries WHERE chat_id=? AND msg_id=?", (chat_id, msg_id))
-        await db.commit()
-    return int(cnt), float(sum_no), float(sum_disc)
+    await _flush_if(chat_id, msg_id=msg_id)
+    removed = await db.run(_delete_msg_tx, chat_id, msg_id)
+    totals_cache.apply(removed, -1)
+    undo_journal.forget(chat_id, msg_id)
+    ingest.forget(chat_id, [msg_id])
+    fingerprints.put((chat_id, msg_id), fingerprint([], []))
+    cnt = sum(t.count for t in removed.values())
+    sum_no = sum(t.sum_no for t in removed.values())
+    sum_disc = sum(t.sum_disc for t in removed.values())
+    return int(cnt), from_fen(sum_no), from_fen(sum_disc)
+
+@write_op
+async def _delete_msg_tx(conn, chat_id: int, msg_id: int) -> dict[tuple[int, int], DayTotals]:
+    # разбивка по дням нужна, чтобы поправить кэш сумм (правка могла пережить полночь)
+    async with conn.execute("""
+        SELECT chat_id, day, is_discount, SUM(amount_fen), COUNT(*)
+        FROM entries WHERE chat_id=? AND msg_id=?
+        GROUP BY chat_id, day, is_discount
+    """, (chat_id, msg_id)) as cur:
+        removed = rows_by_day(await cur.fetchall())
+    await conn.execute("DELETE FROM entries WHERE chat_id=? AND msg_id=?", (chat_id, msg_id))
+    return removed
 
 
 # --- вместо undo_last_for_sender ---
-async def undo_last_for_sender(sender_id: int) -> tuple[bool, int, float, float, int]:
-    d = _today().isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT msg_id
-            FROM entries
-            WHERE sender_id=? AND date=?
-            ORDER BY ts DESC
-            LIMIT 1
-        """, (sender_id, d)) as cur:
-            row = await cur.fetchone()
-        if not row:
-            return False, 0, 0.0, 0.0, 0
-        msg_id = int(row[0])
-
-        async with db.execute("""
-            SELECT 
-              COUNT(*),
-              COALESCE(SUM(CASE WHEN is_discount=0 THEN amount END),0),
-              COALESCE(SUM(CASE WHEN is_discount=1 THEN amount END),0)
-            FROM entries WHERE msg_id=? AND date=? AND sender_id=?
-        """, (msg_id, d, sender_id)) as cur2:
-            row2 = await cur2.fetchone()
-        cnt, sum_no, sum_disc = (row2 or (0, 0.0, 0.0))
-
-        await db.execute("DELETE FROM entries WHERE msg_id=? AND date=? AND sender_id=?", (msg_id, d, sender_id))
-        await db.commit()
-    return True, int(cnt), float(sum_no), float(sum_disc), msg_id
-
-
-# --- вместо aggregate_for_day ---
-async def aggregate_for_day(day: date) -> dict:
+@metrics.timed("db.undo_for_sender", rows=lambda r: r.count if r else 0)
+async def undo_for_sender(cfg: ChatConfig, sender_id: int, n: int = 1) -> UndoResult | None:
+    """Снимает n последних сообщений отправителя (за сегодня и UNDO_DAYS прошлых суток)."""
+    await _flush_if(cfg.chat_id, sender_id=sender_id)
+    res = await undo_journal.undo(cfg.chat_id, sender_id, n, day_number(cfg.today()) - UNDO_DAYS)
+    if res is not None:
+        ingest.forget(cfg.chat_id, res.msg_ids)
+        for msg_id in res.msg_ids:
+            fingerprints.discard((cfg.chat_id, msg_id))
+    return res
+
+@metrics.timed("db.redo_for_sender", rows=lambda r: r.count if r else 0)
+async def redo_for_sender(cfg: ChatConfig, sender_id: int) -> UndoResult | None:
+    """Возвращает последнее отменённое отправителем."""
+    await _flush_if(cfg.chat_id, sender_id=sender_id)
+    res = await undo_journal.redo(cfg.chat_id, sender_id)
+    if res is not None:
+        ingest.forget(cfg.chat_id, res.msg_ids)
+        for msg_id in res.msg_ids:
+            fingerprints.discard((cfg.chat_id, msg_id))
+    return res
+
+
+def _totals_with_payouts(cfg: ChatConfig, sum_no: float, sum_disc: float) -> dict:
     totals = {
         "sum_no": 0.0, "sum_disc": 0.0, "total_cny": 0.0,
         "payout_no": 0.0, "payout_disc": 0.0, "payout_total": 0.0
     }
-    d = day.isoformat()
-    async with aiosqlite.connect(DB_PATH) as db:
-        async with db.execute("""
-            SELECT
-              COALESCE(SUM(CASE WHEN is_discount=0 THEN amount END),0),
-              COALESCE(SUM(CASE WHEN is_discount=1 THEN amount END),0)
-            FROM entries WHERE date=?
-        """, (d,)) as cur:
-            row = await cur.fetchone()
-        sum_no, sum_disc = row or (0.0, 0.0)
-
     totals["sum_no"] = float(sum_no)
     totals["sum_disc"] = float(sum_disc)
     totals["total_cny"] = totals["sum_no"] + totals["sum_disc"]
-    totals["payout_no"] = totals["sum_no"] * PAY_NO_DISCOUNT_RUB_PER_CNY
-    totals["payout_disc"] = totals["sum_disc"] * PAY_DISCOUNT_RUB_PER_CNY
+    totals["payout_no"] = totals["sum_no"] * cfg.pay_no
+    totals["payout_disc"] = totals["sum_disc"] * cfg.pay_disc
     totals["payout_total"] = totals["payout_no"] + totals["payout_disc"]
     return totals
 
+# --- вместо aggregate_for_day ---
+@metrics.timed("db.aggregate_for_day")
+async def aggregate_for_day(cfg: ChatConfig, day: date) -> dict:
+    # суммы берём из кэша в памяти и прибавляем то, что ещё ждёт записи в очереди
+    d = day_number(day)
+    t, extra = await _with_pending(cfg.chat_id, lambda: _day_totals(cfg.chat_id, d))
+    t = t.plus(extra.get(d))
+    return _totals_with_payouts(cfg, from_fen(t.sum_no), from_fen(t.sum_disc))
+
+
+async def _day_totals(chat_id: int, d: int) -> DayTotals:
+    if WORKERS <= 1:
+        return totals_cache.get(chat_id, d)
+    # воркер видит в кэше только свои записи, а отчёт может быть о группе другого воркера
+    async with db.read() as conn:
+        return await read_day(conn, chat_id, d)
+
+@metrics.timed("db.aggregate_for_range", rows=lambda r: len(r[0]))
+async def aggregate_for_range(cfg: ChatConfig, start: date, end: date) -> tuple[list[tuple[date, dict]], dict]:
+    """
+    Итоги группы за период [start, end] из day_totals: (по дням, общий итог). Сырые entries не читаются;
+    закрытые месяцы берутся из архивов, подключаемых только на время запроса.
+    """
+    d0, d1 = day_number(start), day_number(end)
+
+    async def read():
+        async with db.read() as conn:
+            return await range_totals(conn, ARCHIVE_DIR, cfg.chat_id, d0, d1)
+
+    by_day, extra = await _with_pending(cfg.chat_id, read)
+    for d, t in extra.items():
+        if d0 <= d <= d1:
+            by_day[d] = t.plus(by_day.get(d))
+    rows = sorted(by_day.items())
+    per_day = [(day_date(d), _totals_with_payouts(cfg, from_fen(t.sum_no), from_fen(t.sum_disc))) for d, t in rows]
+    # общий итог — из целых фэней, без накопления погрешности float
+    grand = _totals_with_payouts(cfg, from_fen(sum(t.sum_no for _, t in rows)),
+                                 from_fen(sum(t.sum_disc for _, t in rows)))
+    return per_day, grand
+
+
+@metrics.timed("db.check_totals")
+async def check_totals(fix: bool = False):
+    """Сверка кэша сумм со свежим SQL-агрегатом. Возвращает список расхождений."""
+    await ingest.flush()
+    # снимок базы и копия кэша — в один момент: иначе пачка, записанная между ними, выглядела бы расхождением
+    async with db.read_snapshot(totals_cache.snapshot) as (conn, cached):
+        return await totals_cache.check(conn, cached, fix=fix)
+
+async def totals_self_check_loop(interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            drifts = await check_totals(fix=True)
+        except Exception:
+            log.exception("Сверка кэша сумм не удалась")
+            continue
+        for dr in drifts:
+            log.warning("Расхождение кэша сумм группы %s за %s: кэш %s, база %s",
+                        dr.chat_id, day_date(dr.day), dr.cached, dr.actual)
+
+
+def _title(cfg: ChatConfig) -> str:
+    return f" — {cfg.title}" if cfg.title else ""
 
-def format_daily_report(day: date, totals: dict) -> str:
+def format_daily_report(cfg: ChatConfig, day: date, totals: dict) -> str:
     return (
-        f"<b>Ежедневный отчёт за {day.strftime('%d.%m.%Y')}</b>\n\n"
+        f"<b>Ежедневный отчёт за {day.strftime('%d.%m.%Y')}{_title(cfg)}</b>\n\n"
         f"<b>Суммы в юанях:</b>\n"
         f"Без скидки: {_format_cny(totals['sum_no'])}\n"
         f"Со скидкой: {_format_cny(totals['sum_disc'])}\n"
@@ -287,6 +514,119 @@ def format_daily_report(day: date, totals: dict) -> str:
         f"Со скидкой: {_format_rub(totals['payout_disc'])}\n"
         f"Итого к выплате: <b>{_format_rub(totals['payout_total'])}</b>\n"
     )
+def format_range_report(cfg: ChatConfig, start: date, end: date,
+                        per_day: list[tuple[date, dict]], grand: dict) -> str:
+    lines = [f"<b>Отчёт за период {start.strftime('%d.%m.%Y')} – {end.strftime('%d.%m.%Y')}{_title(cfg)}</b>\n"]
+    if per_day:
+        lines.append("<b>По дням (¥ без скидки / со скидкой → к выплате):</b>")
+        day_fmt = "%d.%m" if start.year == end.year else "%d.%m.%Y"
+        for day, t in per_day:
+            lines.append(
+                f"{day.strftime(day_fmt)}: {_format_cny(t['sum_no'])} / {_format_cny(t['sum_disc'])} "
+                f"→ {_format_rub(t['payout_total'])}"
+            )
+        lines.append("")
+    else:
+        lines.append("<i>За период записей нет.</i>\n")
+    lines.append("<b>Суммы в юанях:</b>")
+    lines.append(f"Без скидки: {_format_cny(grand['sum_no'])}")
+    lines.append(f"Со скидкой: {_format_cny(grand['sum_disc'])}")
+    lines.append(f"Всего: <b>{_format_cny(grand['total_cny'])}</b>\n")
+    lines.append("<b>Выплаты партнёру:</b>")
+    lines.append(f"Без скидки: {_format_cny(grand['sum_no'])} × {cfg.pay_no:.2f} ₽/¥ = {_format_rub(grand['payout_no'])}")
+    lines.append(f"Со скидкой: {_format_cny(grand['sum_disc'])} × {cfg.pay_disc:.2f} ₽/¥ = {_format_rub(grand['payout_disc'])}")
+    lines.append(f"Итого к выплате: <b>{_format_rub(grand['payout_total'])}</b>")
+    return "\n".join(lines)
+
+# --- ежедневный отчёт: снимки закрытых дней (daily.py) ---
+@metrics.timed("db.snapshot_day", rows=lambda r: r.count)
+async def snapshot_day(cfg: ChatConfig, d: int, prev: DayReport | None = None) -> DayReport:
+    """Итоги и текст отчёта группы за день d; prev — прежний снимок, его ставки выплат сохраняются."""
+    async def read():
+        async with db.read() as conn:
+            # день может быть и в архиве (досылка после долгого простоя, запрос за старую дату)
+            return (await range_totals(conn, ARCHIVE_DIR, cfg.chat_id, d, d)).get(d) or DayTotals()
+
+    t, extra = await _with_pending(cfg.chat_id, read)
+    t = t.plus(extra.get(d))
+    if prev is not None:
+        cfg = replace(cfg, pay_no=prev.pay_no, pay_disc=prev.pay_disc)
+    totals = _totals_with_payouts(cfg, from_fen(t.sum_no), from_fen(t.sum_disc))
+    return DayReport(cfg.chat_id, d, t.sum_no, t.sum_disc, t.count, cfg.pay_no, cfg.pay_disc,
+                     format_daily_report(cfg, day_date(d), totals), int(time.time()))
+
+def _push_report(cfg: ChatConfig, rep: DayReport, late: bool):
+    """Рассылка админам группы и общим; день без записей не рассылается."""
+    if not rep.count:
+        return
+    text = rep.text + ("\n<i>Отправлено с опозданием: бот в это время не работал.</i>" if late else "")
+    for uid in sorted(set(cfg.admins) | chats.super_admins):
+        outbox.send(uid, text)
+    metrics.inc("report.pushed")
+
+async def _report_groups() -> list[ChatConfig]:
+    if WORKERS > 1:
+        await chats.load()  # настройки меняют воркеры; основному процессу они не сообщают
+    return chats.all()
+
+daily_reports = DailyReports(db, REPORT_AT, snapshot_day, _push_report, catchup_days=REPORT_CATCHUP_DAYS)
+
+async def closed_day_report(cfg: ChatConfig, day: date) -> DayReport:
+    """Отчёт за закрытый день — из снимка; архивный день не сверяется, он уже не меняется."""
+    extra = ingest.pending_totals(cfg.chat_id)
+    if extra is None or day_number(day) in extra:
+        await ingest.flush()  # очередь меняет этот день (правка может снять строки и с прошлых суток)
+    return await daily_reports.get(cfg, day_number(day), verify=not archiver.is_archived(day, cfg.today()))
+
+def _parse_day(text: str, year: int | None = None) -> date | None:
+    """'2025-08-19', '19.08.2025' или '19.08' (год берётся из year, по умолчанию текущий)."""
+    t = text.strip()
+    try:
+        if "-" in t:
+            return date.fromisoformat(t)
+        parts = t.split(".")
+        if len(parts) == 2:
+            return date(year or _today().year, int(parts[1]), int(parts[0]))
+        if len(parts) == 3:
+            return date(int(parts[2]), int(parts[1]), int(parts[0]))
+    except ValueError:
+        return None
+    return None
+
+def _parse_period(args: str | None, today: date) -> tuple[date, date] | None:
+    """week | month | FROM [TO]; без аргументов — текущая неделя."""
+    words = (args or "week").split()
+    if words == ["week"]:
+        return today - timedelta(days=today.weekday()), today
+    if words == ["month"]:
+        return today.replace(day=1), today
+    if len(words) in (1, 2):
+        start = _parse_day(words[0], today.year)
+        end = _parse_day(words[1], start.year if start else None) if len(words) == 2 else today
+        if start and end and start <= end:
+            return start, end
+    return None
+
+# === Группы менеджеров ===
+def manager_group(message: Message) -> dict | bool:
+    """Фильтр: сообщение из зарегистрированной группы; хэндлер получает её настройки в cfg."""
+    cfg = chats.get(message.chat.id)
+    return {"cfg": cfg} if cfg is not None else False
+
+async def _admin_target(message: Message) -> ChatConfig | None:
+    """
+    Группа, к которой относится админская команда: та, где она дана, либо (из лички) выбранная
+    через /group или единственная доступная. None — нет прав или группа не ясна (с подсказкой).
+    """
+    uid = message.from_user.id if message.from_user else 0
+    if message.chat.id in chats:
+        return chats.get(message.chat.id) if chats.is_admin(uid, message.chat.id) else None
+    cfg = chats.target_for(uid)
+    if cfg is None and chats.admin_chats(uid):
+        await message.answer("Команда относится к группе: выберите её — <code>/groups</code>, "
+                             "затем <code>/group &lt;chat_id&gt;</code>.")
+    return cfg
+
 # === Команды в ЛС и в группе ===
 @dp.message(Command("myid"))
 async def myid(message: Message):
@@ -295,39 +635,328 @@ async def myid(message: Message):
 
 @dp.message(Command("clear_today"))
 async def clear_today_cmd(message: Message):
-    uid = message.from_user.id if message.from_user else 0
-    if uid not in ADMIN_CHAT_ID and message.chat.id not in ADMIN_CHAT_ID:
+    cfg = await _admin_target(message)
+    if cfg is None:
         return
 
-    cnt, sum_no, sum_disc = await clear_today()
+    cnt, sum_no, sum_disc = await clear_today(cfg)
     await message.answer(
-        f"Очищено за сегодня: {cnt} записей.\n"
+        f"Очищено за сегодня{_title(cfg)}: {cnt} записей.\n"
         f"Было: без скидки {_format_cny(sum_no)}, со скидкой {_format_cny(sum_disc)}."
     )
 
 @dp.message(Command("report_today"))
 async def report_today(message: Message):
     # разрешаем админу из любого чата
-    uid = message.from_user.id if message.from_user else 0
-    if uid not in ADMIN_CHAT_ID and message.chat.id not in ADMIN_CHAT_ID:
+    cfg = await _admin_target(message)
+    if cfg is None:
+        return
+    today = cfg.today()
+    totals = await aggregate_for_day(cfg, today)
+    await message.answer(format_daily_report(cfg, today, totals))
+
+@dp.message(Command("report"))
+async def report_range(message: Message, command: CommandObject):
+    cfg = await _admin_target(message)
+    if cfg is None:
+        return
+    period = _parse_period(command.args, cfg.today())
+    if period is None:
+        await message.answer(
+            "Формат: <code>/report week</code>, <code>/report month</code> "
+            "или <code>/report 01.08.2025 31.08.2025</code>"
+        )
+        return
+    start, end = period
+    per_day, grand = await aggregate_for_range(cfg, start, end)
+    await send_paged(message.answer, split_text(format_range_report(cfg, start, end, per_day, grand)))
+
+@dp.message(Command("report_day"))
+async def report_day(message: Message, command: CommandObject):
+    """Отчёт за один день, по умолчанию вчерашний; закрытые дни — из снимка."""
+    cfg = await _admin_target(message)
+    if cfg is None:
+        return
+    today = cfg.today()
+    day = _parse_day(command.args, today.year) if command.args else today - timedelta(days=1)
+    if day is None or day > today:
+        await message.answer("Формат: <code>/report_day 19.08.2025</code> (без даты — вчера)")
+        return
+    if day == today:
+        await message.answer(format_daily_report(cfg, today, await aggregate_for_day(cfg, today)))
+        return
+    await message.answer((await closed_day_report(cfg, day)).text)
+
+@dp.message(Command("export"))
+async def export_cmd(message: Message, command: CommandObject):
+    cfg = await _admin_target(message)
+    if cfg is None:
+        return
+    words = (command.args or "").split()
+    fmt = "csv"
+    if words and words[-1].lower() in ("csv", "xlsx"):
+        fmt = words.pop().lower()
+    period = _parse_period(" ".join(words), cfg.today()) if words else None
+    if period is None:
+        await message.answer(
+            "Формат: <code>/export 01.08.2025 31.08.2025 [csv|xlsx]</code> "
+            "(также <code>week</code> / <code>month</code>)"
+        )
+        return
+    if fmt == "xlsx" and not xlsx_available():
+        await message.answer("XLSX недоступен (нет openpyxl), выгружаю в CSV.")
+        fmt = "csv"
+    start, end = period
+    await ingest.flush()
+    with tempfile.TemporaryDirectory(dir=DATA_DIR) as tmp:
+        path = Path(tmp) / f"entries_{start.isoformat()}_{end.isoformat()}.{fmt}"
+        async with db.read() as conn:
+            count = await export_entries(conn, cfg.chat_id, start, end, path, cfg.pay_no, cfg.pay_disc,
+                                         tz=cfg.zone, fmt=fmt,
+                                         archives=archives_for(ARCHIVE_DIR, day_number(start), day_number(end)))
+        if not count:
+            await message.answer("За период записей нет.")
+            return
+        await message.answer_document(
+            FSInputFile(path),
+            caption=f"Записи за {start.strftime('%d.%m.%Y')} – {end.strftime('%d.%m.%Y')}{_title(cfg)}: {count} строк."
+        )
+
+@metrics.timed("db.whatif", rows=lambda r: len(r[0]))
+async def whatif_for_range(cfg: ChatConfig, start: date, end: date,
+                           overrides: dict) -> tuple[list[DayRecalc], int]:
+    """
+    Пересчёт дней группы за [start, end] по сохранённым курсам и по ним же с подменами overrides.
+    Дни без сохранённых курсов считаются по текущим ставкам группы. Возвращает (дни, сколько дней с курсами).
+    ValueError — период длиннее WHATIF_MAX_DAYS или подмены не подходят к сохранённым диапазонам.
+    """
+    d0, d1 = day_number(start), day_number(end)
+    if d1 - d0 + 1 > WHATIF_MAX_DAYS:
+        raise ValueError(f"период {d1 - d0 + 1} дн. — больше {WHATIF_MAX_DAYS} дн. за раз не пересчитываю, "
+                         f"разбейте его на части")
+    await ingest.flush()
+    async with db.read() as conn:
+        stored = await load_rate_sets(conn, cfg.chat_id, d0, d1)
+        base = [stored.get(d) or RateSet.defaults(cfg) for d in range(d0, d1 + 1)]
+        alt = [rs.with_overrides(overrides, RATE_TIERS.bounds) for rs in base]
+        days = await recompute(conn, cfg.chat_id, d0, d1, [base, alt],
+                               archives=archives_for(ARCHIVE_DIR, d0, d1))
+    return days, len(stored)
+
+def _format_change(before: float | None, after: float | None) -> str:
+    if before is None and after is None:
+        return "—"
+    if before is None:
+        return f"— → {_format_rub(after)}"
+    if after is None:
+        return f"{_format_rub(before)} → —"
+    return f"{_format_rub(before)} → {_format_rub(after)} ({after - before:+,.2f})".replace(",", " ")
+
+def format_whatif(cfg: ChatConfig, start: date, end: date, args: list[str], days: list[DayRecalc],
+                  stored: int, per_day: bool) -> str:
+    lines = [f"<b>Пересчёт за {start.strftime('%d.%m.%Y')} – {end.strftime('%d.%m.%Y')}{_title(cfg)}</b>",
+             f"Вместо сохранённого: <code>{' '.join(args) or '—'}</code>",
+             f"Дней с записями: {len(days)}, с сохранёнными курсами: {stored}\n"]
+    if not days:
+        lines.append("<i>За период записей нет.</i>")
+        return "\n".join(lines)
+    if per_day:
+        lines.append("<b>По дням: ¥ | проверка ₽ было → стало | к выплате было → стало</b>")
+        day_fmt = "%d.%m" if start.year == end.year else "%d.%m.%Y"
+        for d in days:
+            base, alt = d.figures
+            lines.append(f"{day_date(d.day).strftime(day_fmt)}: {_format_cny(from_fen(d.sum_no + d.sum_disc))} | "
+                         f"{_format_change(base.check_total, alt.check_total)} | "
+                         f"{_format_change(base.payout_total, alt.payout_total)}")
+        lines.append("")
+    # итог проверочных сумм — только по дням, где они известны в обоих вариантах
+    both = [d for d in days if d.figures[0].check_total is not None and d.figures[1].check_total is not None]
+    lines.append(f"<b>Всего:</b> {_format_cny(from_fen(sum(d.sum_no + d.sum_disc for d in days)))}")
+    lines.append(f"Проверочные суммы ({len(both)} дн.): " + _format_change(
+        sum(d.figures[0].check_total for d in both) if both else None,
+        sum(d.figures[1].check_total for d in both) if both else None))
+    lines.append("К выплате: " + _format_change(sum(d.figures[0].payout_total for d in days),
+                                               sum(d.figures[1].payout_total for d in days)))
+    return "\n".join(lines)
+
+def _whatif_csv(days: list[DayRecalc]) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=";")
+    w.writerow(["date", "rows", "sum_no", "sum_disc", "check_before", "check_after",
+                "payout_before", "payout_after"])
+    for d in days:
+        base, alt = d.figures
+        w.writerow([day_date(d.day).isoformat(), d.count, f"{from_fen(d.sum_no):.2f}", f"{from_fen(d.sum_disc):.2f}",
+                    "" if base.check_total is None else f"{base.check_total:.2f}",
+                    "" if alt.check_total is None else f"{alt.check_total:.2f}",
+                    f"{base.payout_total:.2f}", f"{alt.payout_total:.2f}"])
+    return buf.getvalue().encode("utf-8")
+
+@dp.message(Command("whatif"))
+async def whatif_cmd(message: Message, command: CommandObject):
+    """
+    /whatif <период> [rates=…] [bounds=…] [pay_no=…] [pay_disc=…] [add_no=…] [add_disc=…] —
+    как изменились бы проверочные суммы и выплаты по дням, будь курсы или ставки другими.
+    Период — как в /report; курсы — через запятую по возрастанию диапазонов.
+    """
+    cfg = await _admin_target(message)
+    if cfg is None:
         return
-    totals = await aggregate_for_day(_today())
-    await message.answer(format_daily_report(_today(), totals))
+    words = (command.args or "").split()
+    period_words = [w for w in words if "=" not in w]
+    args = [w for w in words if "=" in w]
+    period = _parse_period(" ".join(period_words), cfg.today()) if period_words else None
+    try:
+        overrides = parse_overrides(args)
+        if period is None:
+            raise ValueError("нужен период")
+        start, end = period
+        days, stored = await whatif_for_range(cfg, start, end, overrides)
+    except ValueError as e:
+        bounds = ",".join(f"{b:g}" for b in RATE_TIERS.bounds)
+        await message.answer(
+            f"Не посчитал: {e}.\nФормат: <code>/whatif 01.01.2025 31.12.2025 rates=12,11.9,11.85,11.8,11.75</code> "
+            f"(курсы по диапазонам от {bounds} ¥), а также <code>bounds=</code>, <code>pay_no=</code>, "
+            f"<code>pay_disc=</code>, <code>add_no=</code>, <code>add_disc=</code>"
+        )
+        return
+    per_day = len(days) <= WHATIF_DOC_DAYS
+    text = format_whatif(cfg, start, end, args, days, stored, per_day)
+    await send_paged(message.answer, split_text(text))
+    if not per_day:
+        await message.answer_document(
+            BufferedInputFile(_whatif_csv(days), filename=f"whatif_{start.isoformat()}_{end.isoformat()}.csv"),
+            caption=f"Пересчёт по дням: {len(days)} строк."
+        )
 
 # === Команды именно в группе менеджера ===
-@dp.message(F.chat.id == MANAGER_CHAT_ID, Command("undo"))
-async def undo_cmd(message: Message):
+def _msg_ids_text(msg_ids: list[int]) -> str:
+    return f"msg_id={msg_ids[0]}" if len(msg_ids) == 1 else f"msg_id: {', '.join(map(str, msg_ids))}"
+
+async def _reply_undo(message: Message, cfg: ChatConfig, n: int):
+    res = await undo_for_sender(cfg, message.from_user.id, n)
+    if res is None:
+        text = "Нечего отменять за сегодня." if UNDO_DAYS <= 0 else "Нечего отменять."
+        outbox.send(message.chat.id, text, reply_to=message.message_id)
+        return
+    outbox.send(
+        message.chat.id,
+        f"Отменено ({_msg_ids_text(res.msg_ids)}): {res.count} строк. "
+        f"Минус: без скидки {_format_cny(from_fen(res.sum_no))}, со скидкой {_format_cny(from_fen(res.sum_disc))}.",
+        reply_to=message.message_id
+    )
+
+@dp.message(manager_group, Command("undo"))
+async def undo_cmd(message: Message, cfg: ChatConfig, command: CommandObject):
+    if not message.from_user:
+        return
+    arg = (command.args or "").strip()
+    if arg and (not arg.isdigit() or int(arg) < 1):
+        outbox.send(message.chat.id, f"Формат: /undo или /undo N (N до {UNDO_DEPTH}).",
+                    reply_to=message.message_id)
+        return
+    await _reply_undo(message, cfg, min(int(arg or 1), UNDO_DEPTH))
+
+@dp.message(manager_group, Command("redo"))
+async def redo_cmd(message: Message, cfg: ChatConfig):
     if not message.from_user:
         return
-    ok, cnt, sum_no, sum_disc, msg_id = await undo_last_for_sender(message.from_user.id)
-    if not ok:
-        await message.reply("Нечего отменять за сегодня.")
+    res = await redo_for_sender(cfg, message.from_user.id)
+    if res is None:
+        outbox.send(message.chat.id, "Нечего возвращать.", reply_to=message.message_id)
+        return
+    if not res.count:
+        outbox.send(message.chat.id, "Отменённые сообщения с тех пор исправлены — возвращать нечего.",
+                    reply_to=message.message_id)
         return
-    await message.reply(
-        f"Отменено (msg_id={msg_id}): {cnt} строк. "
-        f"Минус: без скидки {_format_cny(sum_no)}, со скидкой {_format_cny(sum_disc)}."
+    outbox.send(
+        message.chat.id,
+        f"Возвращено ({_msg_ids_text(res.msg_ids)}): {res.count} строк. "
+        f"Плюс: без скидки {_format_cny(from_fen(res.sum_no))}, со скидкой {_format_cny(from_fen(res.sum_disc))}.",
+        reply_to=message.message_id
     )
 
+# === Группы: список, выбор, настройки ===
+def _format_chat(cfg: ChatConfig) -> str:
+    admins = ", ".join(map(str, cfg.admins)) or "только общие"
+    return (
+        f"<b>{cfg.name}</b> (<code>{cfg.chat_id}</code>)\n"
+        f"Выплаты: {cfg.pay_no:.2f} / {cfg.pay_disc:.2f} ₽/¥ (без скидки / со скидкой)\n"
+        f"Надбавки в проверке: {cfg.check_add_no:.2f} / {cfg.check_add_disc:.2f}\n"
+        f"Часовой пояс: {cfg.tz}\n"
+        f"Админы: {admins}"
+    )
+
+@dp.message(Command("groups"))
+async def groups_cmd(message: Message):
+    uid = message.from_user.id if message.from_user else 0
+    mine = chats.admin_chats(uid)
+    if not mine:
+        return
+    current = chats.target_for(uid)
+    lines = [f"<b>Группы: {len(mine)}</b>"]
+    lines += [f"{'▶ ' if current and c.chat_id == current.chat_id else ''}<code>{c.chat_id}</code> {c.title}"
+              for c in mine]
+    lines.append("<code>/group &lt;chat_id&gt;</code> — с какой группой работать из лички")
+    await send_paged(message.answer, split_lines(lines))
+
+@dp.message(Command("group"))
+async def group_cmd(message: Message, command: CommandObject):
+    uid = message.from_user.id if message.from_user else 0
+    if not chats.admin_chats(uid):
+        return
+    arg = (command.args or "").strip()
+    try:
+        chat_id = int(arg)
+    except ValueError:
+        await message.answer("Формат: <code>/group &lt;chat_id&gt;</code> (список — <code>/groups</code>)")
+        return
+    if not chats.select(uid, chat_id):
+        await message.answer("Нет такой группы среди ваших.")
+        return
+    await message.answer("Отчёты, выгрузка и удаление из лички — теперь по группе:\n" + _format_chat(chats.get(chat_id)))
+
+@dp.message(Command("chat"))
+async def chat_cmd(message: Message, command: CommandObject):
+    """
+    /chat — настройки группы; /chat set <поле> <значение>; /chat reload — перечитать таблицу.
+    Суперадмины ещё: /chat add (в самой группе) и /chat remove <chat_id>.
+    """
+    uid = message.from_user.id if message.from_user else 0
+    words = (command.args or "").split(maxsplit=2)
+    action = words[0].lower() if words else ""
+    if action == "add":
+        if not chats.is_super(uid) or message.chat.type not in ("group", "supergroup"):
+            return
+        cfg = await chats.add(message.chat.id, message.chat.title or "")
+        await message.answer("Группа подключена.\n" + _format_chat(cfg))
+        return
+    if action == "remove" and chats.is_super(uid):
+        if len(words) < 2 or not words[1].lstrip("-").isdigit() or int(words[1]) not in chats:
+            await message.answer("Формат: <code>/chat remove &lt;chat_id&gt;</code>")
+            return
+        await chats.remove(int(words[1]))
+        await message.answer("Группа отключена; её записи остаются в базе.")
+        return
+    if action == "reload" and chats.is_super(uid):
+        await chats.reload()
+        await message.answer(f"Настройки групп перечитаны: {len(chats)}.")
+        return
+    cfg = await _admin_target(message)
+    if cfg is None:
+        return
+    if action == "set":
+        if len(words) < 3:
+            await message.answer("Формат: <code>/chat set &lt;поле&gt; &lt;значение&gt;</code>; поля: "
+                                 + ", ".join(EDITABLE))
+            return
+        try:
+            cfg = await chats.update(cfg.chat_id, words[1], words[2])
+        except ValueError as e:
+            await message.answer(f"Не сохранено: {e}")
+            return
+    await message.answer(_format_chat(cfg))
+
 # ================== ХЭНДЛЕРЫ: ОБЩЕЕ МЕНЮ ==================
 @dp.message(F.text == "/start")
 async def cmd_start(message: Message, state: FSMContext):
@@ -347,72 +976,51 @@ async def cancel(message: Message, state: FSMContext):
 @dp.message(F.text == "📊 Расчёт прибыли")
 async def start_profit_calc(message: Message, state: FSMContext):
     await state.clear()
-    await state.update_data(rates={})
-    await message.answer("Какой был курс сегодня <b>от 30000 юаней</b>? (в ₽ за 1 ¥)", reply_markup=cancel_kb)
-    await state.set_state(ProfitStates.rate_ge_30000)
+    await state.update_data(rates={}, tier_step=0)
+    first = RATE_TIERS.ask_order()[0]
+    await message.answer(
+        f"Какой был курс сегодня <b>{RATE_TIERS.question(first)}</b>? (в ₽ за 1 ¥)",
+        reply_markup=cancel_kb
+    )
+    await state.set_state(ProfitStates.rate)
 
-@dp.message(ProfitStates.rate_ge_30000)
-async def rate_ge_30000(message: Message, state: FSMContext):
-    rate = _parse_float(message.text)
-    if rate is None:
-        await message.answer("Введите положительное число, например: 11.75")
-        return
+def _dialog_fits_tiers(rates, step: int) -> bool:
+    """
+    Курсы из состояния диалога (FSM хранится в SQLite и переживает перезапуск) заданы для нынешних
+    RATE_TIERS: введены ровно первые step вопросов. Иначе диапазоны сменили, пока диалог ждал.
+    """
+    order = RATE_TIERS.ask_order()
+    if not isinstance(rates, dict) or not isinstance(step, int) or not 0 <= step <= len(order):
+        return False
+    return set(rates) == {RATE_TIERS.tiers[i].key for i in order[:step]}
+
+async def _restart_profit_calc(message: Message, state: FSMContext):
+    await message.answer("Диапазоны курсов с начала расчёта изменились — начнём заново.")
+    await start_profit_calc(message, state)
+
+@dp.message(ProfitStates.rate)
+async def rate_step(message: Message, state: FSMContext):
+    order = RATE_TIERS.ask_order()
     data = await state.get_data()
-    rates = data.get("rates", {})
-    rates["ge_30000"] = rate
-    await state.update_data(rates=rates)
-    await message.answer("Какой курс был <b>от 10000 до 30000 юаней</b>? (₽/¥)")
-    await state.set_state(ProfitStates.rate_10000_30000)
-
-@dp.message(ProfitStates.rate_10000_30000)
-async def rate_10000_30000(message: Message, state: FSMContext):
-    rate = _parse_float(message.text)
-    if rate is None:
-        await message.answer("Введите положительное число, например: 11.80")
+    step = data.get("tier_step", 0)
+    if step == len(order) or not _dialog_fits_tiers(data.get("rates", {}), step):
+        await _restart_profit_calc(message, state)
         return
-    data = await state.get_data()
-    rates = data.get("rates", {})
-    rates["r_10000_30000"] = rate
-    await state.update_data(rates=rates)
-    await message.answer("Какой был курс <b>от 3000 до 10000 юаней</b>? (₽/¥)")
-    await state.set_state(ProfitStates.rate_3000_10000)
+    tier = RATE_TIERS.tiers[order[step]]
 
-@dp.message(ProfitStates.rate_3000_10000)
-async def rate_3000_10000(message: Message, state: FSMContext):
     rate = _parse_float(message.text)
     if rate is None:
-        await message.answer("Введите положительное число, например: 11.85")
+        await message.answer(f"Введите положительное число, например: {tier.example}")
         return
-    data = await state.get_data()
     rates = data.get("rates", {})
-    rates["r_3000_10000"] = rate
-    await state.update_data(rates=rates)
-    await message.answer("Какой был курс <b>от 1000 до 3000 юаней</b>? (₽/¥)")
-    await state.set_state(ProfitStates.rate_1000_3000)
+    rates[tier.key] = rate
+    step += 1
+    await state.update_data(rates=rates, tier_step=step)
 
-@dp.message(ProfitStates.rate_1000_3000)
-async def rate_1000_3000(message: Message, state: FSMContext):
-    rate = _parse_float(message.text)
-    if rate is None:
-        await message.answer("Введите положительное число, например: 11.90")
+    if step < len(order):
+        await message.answer(f"Какой был курс <b>{RATE_TIERS.question(order[step])}</b>? (₽/¥)")
         return
-    data = await state.get_data()
-    rates = data.get("rates", {})
-    rates["r_1000_3000"] = rate
-    await state.update_data(rates=rates)
-    await message.answer("Какой был курс <b>до 1000 юаней</b>? (₽/¥)")
-    await state.set_state(ProfitStates.rate_lt_1000)
 
-@dp.message(ProfitStates.rate_lt_1000)
-async def rate_lt_1000(message: Message, state: FSMContext):
-    rate = _parse_float(message.text)
-    if rate is None:
-        await message.answer("Введите положительное число, например: 12.00")
-        return
-    data = await state.get_data()
-    rates = data.get("rates", {})
-    rates["lt_1000"] = rate
-    await state.update_data(rates=rates)
     await message.answer(
         "Введите <b>в ОДИН столбик</b> суммы юаней.\n"
         "Отмечайте тип заявки:\n"
@@ -430,55 +1038,52 @@ async def myid(message: Message):
 
 @dp.message(ProfitStates.amounts_mixed)
 async def amounts_mixed(message: Message, state: FSMContext):
+    data = await state.get_data()
+    if not _dialog_fits_tiers(data.get("rates"), len(RATE_TIERS)):
+        await _restart_profit_calc(message, state)
+        return
     no_list, disc_list = _parse_mixed_lines(message.text)
     if not no_list and not disc_list:
         await message.answer("Не нашёл чисел. Пример:\n<code>\n+1500\n-900\n+12000\n-2600\n</code>")
         return
 
-    data = await state.get_data()
     rates: dict = data["rates"]
+    # ставки и надбавки — группы, с которой работает админ; у остальных — значения по умолчанию
+    target = chats.target_for(message.from_user.id if message.from_user else 0)
+    cfg = target or DEFAULT_CHAT
 
     sum_no = sum(no_list)
     sum_disc = sum(disc_list)
     total_cny = sum_no + sum_disc
 
-    payout_no = sum_no * PAY_NO_DISCOUNT_RUB_PER_CNY
-    payout_disc = sum_disc * PAY_DISCOUNT_RUB_PER_CNY
+    payout_no = sum_no * cfg.pay_no
+    payout_disc = sum_disc * cfg.pay_disc
     payout_total = payout_no + payout_disc
 
-    # (опционально) CSV-лог одного расчёта:
-    DATA_DIR.mkdir(parents=True, exist_ok=True)
-    if not LOG_CSV.exists():
-        with LOG_CSV.open("w", newline="", encoding="utf-8") as f:
-            w = csv.writer(f, delimiter=";")
-            w.writerow(["ts_iso","date","sum_no","sum_disc","total_cny","payout_no","payout_disc","payout_total"])
-    with LOG_CSV.open("a", newline="", encoding="utf-8") as f:
-        now = _tznow()
-        w = csv.writer(f, delimiter=";")
-        w.writerow([now.isoformat(), _today().isoformat(), f"{sum_no:.6f}", f"{sum_disc:.6f}",
+    # (опционально) CSV-лог одного расчёта: строка уходит в буфер, на диск пишет фоновая задача
+    now = _tznow()
+    calc_log.write([now.isoformat(), _today().isoformat(), f"{sum_no:.6f}", f"{sum_disc:.6f}",
                     f"{total_cny:.6f}", f"{payout_no:.6f}", f"{payout_disc:.6f}", f"{payout_total:.6f}"])
 
-    # Проверочные строки
-    lines_check_no = []
-    for a in no_list:
-        r = _pick_rate_for_amount(a, rates)
-        rub = a * (r + CHECK_ADD_NO_DISCOUNT)
-        lines_check_no.append(f"{a:,.2f} ¥ × ({r:.4f} + {CHECK_ADD_NO_DISCOUNT:.2f}) = {_format_rub(rub)}".replace(",", " "))
+    # курсы дня сохраняются за группу, если считает её админ, — по ним потом работает /whatif
+    saved = None
+    if target is not None:
+        saved = cfg.today()
+        await db.run(save_rate_set, cfg.chat_id, day_number(saved), RateSet.from_dialog(RATE_TIERS, rates, cfg),
+                     message.from_user.id, int(now.timestamp()))
 
-    lines_check_disc = []
-    for a in disc_list:
-        r = _pick_rate_for_amount(a, rates)
-        rub = a * (r + CHECK_ADD_DISCOUNT)
-        lines_check_disc.append(f"{a:,.2f} ¥ × ({r:.4f} + {CHECK_ADD_DISCOUNT:.2f}) = {_format_rub(rub)}".replace(",", " "))
+    # Проверочные строки: курсы и суммы в ₽ считаются сразу для всего списка
+    rates_no, rub_no = RATE_TIERS.rub_many(no_list, rates, cfg.check_add_no)
+    rates_disc, rub_disc = RATE_TIERS.rub_many(disc_list, rates, cfg.check_add_disc)
 
     msg = []
     msg.append("<b>Итоги за день (ввод из диалога)</b>\n")
     msg.append("<b>Курсы (₽/¥):</b>")
-    msg.append(f"≥ 30000 ¥: <b>{rates['ge_30000']}</b>")
-    msg.append(f"10000–30000 ¥: <b>{rates['r_10000_30000']}</b>")
-    msg.append(f"3000–10000 ¥: <b>{rates['r_3000_10000']}</b>")
-    msg.append(f"1000–3000 ¥: <b>{rates['r_1000_3000']}</b>")
-    msg.append(f"&lt; 1000 ¥: <b>{rates['lt_1000']}</b>\n")  # экранируем <
+    for i in RATE_TIERS.ask_order():
+        msg.append(f"{RATE_TIERS.label(i)}: <b>{rates[RATE_TIERS.tiers[i].key]}</b>")
+    if saved:
+        msg.append(f"<i>Курсы сохранены за {saved.strftime('%d.%m.%Y')}{_title(cfg)}.</i>")
+    msg[-1] += "\n"
 
     msg.append("<b>Суммы в юанях:</b>")
     msg.append(f"Без скидки: {_format_cny(sum_no)}")
@@ -486,60 +1091,105 @@ async def amounts_mixed(message: Message, state: FSMContext):
     msg.append(f"Всего: <b>{_format_cny(total_cny)}</b>\n")
 
     msg.append("<b>Выплаты партнёру:</b>")
-    msg.append(f"Без скидки: {_format_cny(sum_no)} × {PAY_NO_DISCOUNT_RUB_PER_CNY:.2f} ₽/¥ = <b>{_format_rub(payout_no)}</b>")
-    msg.append(f"Со скидкой: {_format_cny(sum_disc)} × {PAY_DISCOUNT_RUB_PER_CNY:.2f} ₽/¥ = <b>{_format_rub(payout_disc)}</b>")
+    msg.append(f"Без скидки: {_format_cny(sum_no)} × {cfg.pay_no:.2f} ₽/¥ = <b>{_format_rub(payout_no)}</b>")
+    msg.append(f"Со скидкой: {_format_cny(sum_disc)} × {cfg.pay_disc:.2f} ₽/¥ = <b>{_format_rub(payout_disc)}</b>")
     msg.append(f"Итого к выплате: <b>{_format_rub(payout_total)}</b>\n")
 
-    msg.append("<b>Проверьте суммы в рублях (без скидки):</b>")
-    msg.extend("• " + s for s in lines_check_no) if lines_check_no else msg.append("—")
-    msg.append("\n<b>Проверьте суммы в рублях (со скидкой):</b>")
-    msg.extend("• " + s for s in lines_check_disc) if lines_check_disc else msg.append("—")
-
-    text = "\n".join(msg)
-    if len(text) > 3900:
-        cut_label = "<b>Проверьте суммы в рублях (без скидки):</b>"
-        cut_idx = msg.index(cut_label) if cut_label in msg else len(msg)
-        text = "\n".join(msg[:cut_idx]) + "\n\n<i>Список проверочных расчётов слишком длинный. Уменьшите количество строк.</i>"
-
-    await message.answer(text, reply_markup=main_kb)
+    head = "\n".join(msg)
+    check = [
+        "<b>Проверьте суммы в рублях (без скидки):</b>",
+        _format_check_block(no_list, rates_no, rub_no, cfg.check_add_no),
+        "\n<b>Проверьте суммы в рублях (со скидкой):</b>",
+        _format_check_block(disc_list, rates_disc, rub_disc, cfg.check_add_disc),
+    ]
+    text = head + "\n" + "\n".join(check)
     await state.clear()
 
+    if len(text) <= MESSAGE_LIMIT:
+        await message.answer(text, reply_markup=main_kb)
+    elif len(no_list) + len(disc_list) > VERIFY_DOC_THRESHOLD:
+        # очень длинный список — итоги сообщением, проверочные строки файлом
+        await message.answer(head + "\n<i>Проверочные расчёты — в файле ниже.</i>")
+        data = _check_csv(cfg, no_list, rates_no, rub_no, disc_list, rates_disc, rub_disc)
+        await message.answer_document(
+            BufferedInputFile(data, filename=f"check_{_today().isoformat()}.csv"),
+            caption=f"Проверочные расчёты: {len(no_list) + len(disc_list)} строк.",
+            reply_markup=main_kb
+        )
+    else:
+        await send_paged(message.answer, split_lines(text.split("\n")), reply_markup=main_kb)
+
+def _format_check_block(amounts: list[float], picked: list[float], rubs: list[float], add: float) -> str:
+    """Блок строк «сумма × (курс + надбавка) = ₽»; разделители тысяч меняются один раз на весь блок."""
+    if not amounts:
+        return "—"
+    return "\n".join(
+        f"• {a:,.2f} ¥ × ({r:.4f} + {add:.2f}) = {rub:,.2f} ₽"
+        for a, r, rub in zip(amounts, picked, rubs)
+    ).replace(",", " ")
+
+def _check_csv(cfg: ChatConfig, no_list, rates_no, rub_no, disc_list, rates_disc, rub_disc) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=";")
+    w.writerow(["type", "amount_cny", "rate", "check_add", "rub"])
+    w.writerows(("no_disc", f"{a:.2f}", f"{r:.4f}", f"{cfg.check_add_no:.2f}", f"{rub:.2f}")
+                for a, r, rub in zip(no_list, rates_no, rub_no))
+    w.writerows(("disc", f"{a:.2f}", f"{r:.4f}", f"{cfg.check_add_disc:.2f}", f"{rub:.2f}")
+                for a, r, rub in zip(disc_list, rates_disc, rub_disc))
+    return buf.getvalue().encode("utf-8")
+
 # ================== ГРУППА МЕНЕДЖЕРА: НОВЫЕ СООБЩЕНИЯ ==================
-@dp.message(F.chat.id == MANAGER_CHAT_ID, F.text)
-async def manager_group_listener(message: Message):
+@dp.message(manager_group, F.text)
+async def manager_group_listener(message: Message, cfg: ChatConfig):
     no_list, disc_list = _parse_mixed_lines(message.text)
     if not no_list and not disc_list:
+        metrics.inc("listener.ignored")
         return  # игнорим нерелевантные сообщения
 
     await replace_message_entries(
-        chat_id=message.chat.id,
+        cfg,
         msg_id=message.message_id,
         sender_id=message.from_user.id if message.from_user else None,
         no_list=no_list,
-        disc_list=disc_list
+        disc_list=disc_list,
+        new=True,
     )
 
-    await message.reply(
+    total = sum(no_list) + sum(disc_list)
+    # ответ уходит через очередь: подряд идущие подтверждения схлопываются в одну сводку
+    outbox.send(
+        message.chat.id,
         f"Принято: +{len(no_list)} без скидки, -{len(disc_list)} со скидкой. "
-        f"Сумма: {_format_cny(sum(no_list) + sum(disc_list))}"
+        f"Сумма: {_format_cny(total)}",
+        reply_to=message.message_id,
+        coalesce="accepted",
+        payload={"n_no": len(no_list), "n_disc": len(disc_list), "total": total, "msg_id": message.message_id},
     )
 
 # ================== ГРУППА МЕНЕДЖЕРА: РЕДАКТИРОВАННЫЕ СООБЩЕНИЯ ==================
-@dp.edited_message(F.chat.id == MANAGER_CHAT_ID, F.text)
-async def manager_group_edited(message: Message):
+@dp.edited_message(manager_group, F.text)
+async def manager_group_edited(message: Message, cfg: ChatConfig):
+    # строки сообщений из закрытых месяцев уже в архиве: правку нельзя применить, не задвоив суммы
+    if archiver.is_archived(message.date.astimezone(cfg.zone).date(), cfg.today()):
+        metrics.inc("edited.archived")
+        outbox.send(message.chat.id, f"msg_id={message.message_id} из закрытого месяца (уже в архиве), "
+                                     f"правка не учтена.", reply_to=message.message_id)
+        return
     no_list, disc_list = _parse_mixed_lines(message.text)
+    # Правка не затронула суммы (опечатка в тексте) — переписывать и отвечать незачем
+    if await stored_fingerprint(message.chat.id, message.message_id) == fingerprint(no_list, disc_list):
+        fingerprints.stats.skipped += 1
+        metrics.inc("edited.unchanged")
+        return
     # Если отредактировали в нерелевантное — просто удалим прежние записи по msg_id
     await replace_message_entries(
-        chat_id=message.chat.id,
+        cfg,
         msg_id=message.message_id,
         sender_id=message.from_user.id if message.from_user else None,
         no_list=no_list,
         disc_list=disc_list
     )
-    await bot.send_message(
-        chat_id=message.chat.id,
-        text=f"Обновлено для msg_id={message.message_id}: +{len(no_list)}, -{len(disc_list)}."
-    )
+    outbox.send(message.chat.id, f"Обновлено для msg_id={message.message_id}: +{len(no_list)}, -{len(disc_list)}.")
 
 # ================== КОМАНДЫ: ОТЧЁТ/УДАЛЕНИЕ/ОТМЕНА ==================
 def _is_admin_context(message: Message) -> bool:
@@ -549,22 +1199,115 @@ def _is_admin_context(message: Message) -> bool:
 
 @dp.message(F.text == "/report_today")
 async def report_today(message: Message):
-    if not _is_admin_context(message):
+    cfg = await _admin_target(message)
+    if cfg is None:
         return
-    totals = await aggregate_for_day(_today())
-    txt = format_daily_report(_today(), totals)
+    today = cfg.today()
+    totals = await aggregate_for_day(cfg, today)
+    txt = format_daily_report(cfg, today, totals)
     await message.answer(txt)
 
+@dp.message(F.text == "/ingest_stats")
+async def ingest_stats(message: Message):
+    if not _is_admin_context(message):
+        return
+    st = ingest.stats
+    await message.answer(
+        "<b>Очередь записи:</b>\n"
+        f"В очереди сейчас: {ingest.depth} (максимум {st.max_depth})\n"
+        f"Принято замен: {st.submitted}, схлопнуто правок: {st.coalesced}\n"
+        f"Пачек: {st.batches}, строк: {st.rows}\n"
+        f"Последняя пачка: {st.last_batch} сообщ. за {st.last_flush_ms:.1f} мс (макс. {st.largest_batch})\n"
+        f"Ошибок записи: {st.errors}\n\n"
+        f"<b>Кэш отпечатков правок:</b> {len(fingerprints)} / {fingerprints.max_size}\n"
+        f"Попаданий: {fingerprints.stats.hits}, промахов: {fingerprints.stats.misses}, "
+        f"вытеснено: {fingerprints.stats.evictions}\n"
+        f"Пропущено правок без изменений: {fingerprints.stats.skipped}"
+    )
+
+@dp.message(F.text == "/outbox_stats")
+async def outbox_stats(message: Message):
+    if not _is_admin_context(message):
+        return
+    st = outbox.stats
+    await message.answer(
+        "<b>Очередь отправки:</b>\n"
+        f"В очереди сейчас: {outbox.depth} (максимум {st.max_depth})\n"
+        f"Поставлено: {st.queued}, отправлено: {st.sent}, отброшено: {st.dropped}\n"
+        f"Схлопнуто в сводки: {st.coalesced}\n"
+        f"Ожиданий retry_after: {st.retry_after_waits} ({st.retry_after_seconds:.0f} с)\n"
+        f"Ошибок отправки: {st.errors}"
+    )
+
+@dp.message(Command("stats"))
+async def stats_cmd(message: Message, command: CommandObject):
+    if not _is_admin_context(message):
+        return
+    await send_paged(message.answer, split_lines(metrics.report_lines()))
+    if (command.args or "").strip().lower() == "reset":
+        metrics.reset()
+        await message.answer("Замеры сброшены.")
+
+@dp.message(Command("archive"))
+async def archive_cmd(message: Message, command: CommandObject):
+    if not _is_admin_context(message):
+        return
+    if (command.args or "").strip().lower() == "run":
+        if WORKERS > 1:
+            await message.answer("При нескольких воркерах перенос в архив делает основной процесс "
+                                 "по расписанию (ARCHIVE_INTERVAL).")
+            return
+        await ingest.flush()
+        res = await archiver.run(_today())
+        moved = ", ".join(f"{m}: {n}" for m, n in res.months) or "нечего переносить"
+        expired = ", ".join(res.expired) or "нет"
+        await message.answer(f"Перенесено строк — {moved}. Удалено по сроку: {expired}. ({res.seconds:.1f} с)")
+        return
+    files = list_archives(ARCHIVE_DIR)
+    lines = [
+        "<b>Архив</b>",
+        f"В основной базе — с {archiver.hot_start(_today()).strftime('%d.%m.%Y')}; "
+        f"архивы хранятся {f'{ARCHIVE_KEEP_MONTHS} мес.' if ARCHIVE_KEEP_MONTHS else 'бессрочно'}",
+    ]
+    lines += [f"{p.name}: {p.stat().st_size / 2**20:.1f} МиБ" for _, _, p in files] or ["Архивов пока нет."]
+    if archiver.last:
+        lines.append(f"Последний перенос: {archiver.last.rows} строк за {archiver.last.seconds:.1f} с")
+    lines.append("<code>/archive run</code> — перенести закрытые месяцы сейчас")
+    await message.answer("\n".join(lines))
+
+@dp.message(F.text.in_({"/check_totals", "/check_totals fix"}))
+async def check_totals_cmd(message: Message):
+    if not _is_admin_context(message):
+        return
+    if WORKERS > 1:
+        await message.answer("При нескольких воркерах кэша сумм нет: итоги читаются из базы.")
+        return
+    fix = message.text.endswith("fix")
+    drifts = await check_totals(fix=fix)
+    if not drifts:
+        await message.answer("Кэш сумм совпадает с базой.")
+        return
+    lines = [f"<b>Расхождений: {len(drifts)}</b>" + (" (исправлено)" if fix else "")]
+    for dr in drifts[:30]:
+        cfg = chats.get(dr.chat_id)
+        lines.append(
+            f"{cfg.name if cfg else dr.chat_id}, {day_date(dr.day).strftime('%d.%m.%Y')}: "
+            f"кэш {dr.cached.count} шт / {_format_cny(from_fen(dr.cached.sum_no + dr.cached.sum_disc))}, "
+            f"база {dr.actual.count} шт / {_format_cny(from_fen(dr.actual.sum_no + dr.actual.sum_disc))}"
+        )
+    await message.answer("\n".join(lines))
+
 @dp.message(F.text.startswith("/delete"))
 async def delete_msg(message: Message):
-    if not _is_admin_context(message):
+    cfg = await _admin_target(message)
+    if cfg is None:
         return
     parts = message.text.strip().split()
     if len(parts) != 2 or not parts[1].isdigit():
         await message.answer("Формат: <code>/delete &lt;msg_id&gt;</code>")
         return
     msg_id = int(parts[1])
-    cnt, sum_no, sum_disc = await delete_by_msg_id(MANAGER_CHAT_ID, msg_id)
+    cnt, sum_no, sum_disc = await delete_by_msg_id(cfg.chat_id, msg_id)
     await message.answer(
         f"Удалено {cnt} строк по msg_id={msg_id}. "
         f"Снято: без скидки {_format_cny(sum_no)}, со скидкой {_format_cny(sum_disc)}."
@@ -573,25 +1316,200 @@ async def delete_msg(message: Message):
 @dp.message(F.text == "/undo")
 async def undo_cmd(message: Message):
     # Разрешаем только из группы менеджера и только автору отменять своё
-    if message.chat.id != MANAGER_CHAT_ID or not message.from_user:
-        return
-    ok, cnt, sum_no, sum_disc, msg_id = await undo_last_for_sender(message.from_user.id)
-    if not ok:
-        await message.reply("Нечего отменять за сегодня.")
+    cfg = chats.get(message.chat.id)
+    if cfg is None or not message.from_user:
         return
-    await message.reply(
-        f"Отменено (msg_id={msg_id}): {cnt} строк. "
-        f"Минус: без скидки {_format_cny(sum_no)}, со скидкой {_format_cny(sum_disc)}."
+    await _reply_undo(message, cfg, 1)
+
+# ================== ДОГРУЗКА ПОСЛЕ ПРОСТОЯ ==================
+def _catchup_replacement(message: Message, edited: bool) -> Replacement | None:
+    cfg = chats.get(message.chat.id)
+    tz = cfg.zone
+    if edited and archiver.is_archived(message.date.astimezone(tz).date(), cfg.today()):
+        metrics.inc("edited.archived")
+        return None
+    no_list, disc_list = parse_mixed_lines(message.text)
+    if not no_list and not disc_list and not edited:
+        return None  # болтовня без сумм; правка «в пустое» же должна снять прежние строки
+    # день — когда сообщение написано (или исправлено), а не когда бот до него добрался
+    if edited and message.edit_date:
+        when = datetime.fromtimestamp(message.edit_date, tz)  # в aiogram edit_date — unix-время
+    else:
+        when = message.date.astimezone(tz)
+    return Replacement(
+        chat_id=message.chat.id, msg_id=message.message_id,
+        sender_id=message.from_user.id if message.from_user else None,
+        no_list=no_list, disc_list=disc_list, ts=when, day=day_number(when.date()),
     )
 
+async def catch_up():
+    """Пачками записывает то, что прислали, пока бот не работал, и шлёт в каждую группу одну сводку."""
+    # getUpdates не работает при установленном webhook; накопленные апдейты при снятии сохраняются
+    await bot.delete_webhook(drop_pending_updates=False)
+    catchup = Catchup(bot, dp, ingest, chats.__contains__, _catchup_replacement)
+    st = await catchup.run(dp.resolve_used_update_types())
+    metrics.observe("catchup", st.seconds, st.rows)
+    if st.updates:
+        log.info("Догрузка после простоя: %s", st.as_dict())
+    for chat_id, (messages, rows, total) in catchup.by_chat().items():
+        outbox.send(
+            chat_id,
+            f"Пока бот был недоступен: учтено сообщений {messages} "
+            f"({rows} строк на {_format_cny(total)}).",
+        )
+
 # ================== main() ==================
 async def main():
     if not API_TOKEN:
         raise RuntimeError("Не задан токен в переменной окружения TGTOKEN_TEST")
+    if WORKERS > 1:
+        await run_front()
+        return
     await init_db()
-    # убрать возможный webhook, чтобы не было конфликтов при polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    await db.open()
+    await archiver.upgrade()
+    await init_chats()
+    await undo_journal.load()
+    async with db.read() as conn:
+        await totals_cache.warm(conn)
+    ingest.start()
+    calc_log.start()
+    if ARCHIVE_INTERVAL > 0:
+        archiver.start(ARCHIVE_INTERVAL, _today)
+    checker = None
+    metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT) if METRICS_PORT > 0 else None
+    if TOTALS_SELF_CHECK_INTERVAL > 0:
+        checker = asyncio.create_task(totals_self_check_loop(TOTALS_SELF_CHECK_INTERVAL))
+    server = None
+    try:
+        if CATCHUP_ON_START:
+            await catch_up()
+        if REPORT_AT is not None:
+            # после догрузки: снимок пропущенного дня должен учесть догруженное
+            daily_reports.start(_report_groups)
+        if WEBHOOK_URL:
+            server = WebhookServer(dp, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                                   drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
+            metrics.gauge("webhook.in_flight", lambda: server.in_flight)
+            await run_webhook(server)
+        else:
+            # убрать возможный webhook, чтобы не было конфликтов при polling
+            await bot.delete_webhook(drop_pending_updates=not CATCHUP_ON_START)
+            await dp.start_polling(bot)
+    finally:
+        if checker:
+            checker.cancel()
+            with suppress(asyncio.CancelledError):
+                await checker
+        if server:
+            await server.stop()
+        await daily_reports.stop()
+        await outbox.stop()
+        await fsm_storage.close()
+        await calc_log.stop()
+        await archiver.stop()
+        await ingest.stop()
+        await db.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if server:
+            await bot.session.close()
+
+def _stop_signal() -> asyncio.Event:
+    """Событие, которое выставят SIGINT/SIGTERM."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: остаётся KeyboardInterrupt
+    return stop
+
+async def run_webhook(server: WebhookServer):
+    """Поднимает сервер, регистрирует webhook и ждёт SIGINT/SIGTERM."""
+    stop = _stop_signal()
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+    await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                          allowed_updates=dp.resolve_used_update_types(),
+                          drop_pending_updates=not CATCHUP_ON_START)
+    await stop.wait()
+    # сначала перестать принимать и доработать принятое, потом закрывать очереди и базу
+    await server.drain()
+
+# ================== НЕСКОЛЬКО ПРОЦЕССОВ (WORKERS > 1) ==================
+async def run_front():
+    """
+    Основной процесс: миграции, архив, приём апдейтов и единственное пишущее соединение.
+    Апдейты уходят воркерам (worker_process) по chat_id, их транзакции выполняются здесь.
+    """
+    await init_db()
+    await db.open()
+    await archiver.upgrade()
+    await init_chats()
+    front = ShardFront(db, WORKERS, worker_process)
+    front.add_after_update(lambda seconds, ok: metrics.observe("shard.update", seconds))
+    metrics.gauge("shard.in_flight", lambda: front.in_flight)
+    await front.start()
+    if ARCHIVE_INTERVAL > 0:
+        archiver.start(ARCHIVE_INTERVAL, _today)
+    if REPORT_AT is not None:
+        # накопленное за простой воркеры разбирают параллельно — первый прогон чуть позже
+        daily_reports.start(_report_groups, delay=REPORT_FRONT_DELAY)
+    metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT) if METRICS_PORT > 0 else None
+    server = None
+    try:
+        # накопленное за простой не сбрасываем: воркеры получат его первым (порядок внутри чата тот же)
+        if WEBHOOK_URL:
+            server = WebhookServer(front, bot, path=WEBHOOK_PATH, secret=WEBHOOK_SECRET,
+                                   drain_timeout=WEBHOOK_DRAIN_TIMEOUT)
+            await run_webhook(server)
+        else:
+            await bot.delete_webhook(drop_pending_updates=not CATCHUP_ON_START)
+            await front.poll(bot, _stop_signal(), dp.resolve_used_update_types())
+    finally:
+        if server:
+            await server.stop()
+        await daily_reports.stop()
+        await front.stop()
+        await outbox.stop()
+        await archiver.stop()
+        await db.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+
+async def run_worker(index: int, port: int, token: str):
+    """Воркер: обрабатывает апдейты своих чатов, пишет через основной процесс."""
+    link = await WorkerLink.connect(port, token, index)
+    db.use_remote(link.call)
+    fsm_storage.path = FSM_DB_PATH.with_name(f"fsm-{index}.db")  # хранилища ещё не открыты
+    calc_log.path = LOG_CSV.with_name(f"log-{index}.csv")
+    await db.open()
+    await chats.load()
+    await undo_journal.load()
+    link.on_notify("chats", chats.load)
+    chats.add_after_change(lambda: link.notify("chats"))
+    ingest.start()
+    calc_log.start()
+    try:
+        await link.serve(dp, bot)
+    finally:
+        await outbox.stop()
+        await fsm_storage.close()
+        await calc_log.stop()
+        await ingest.stop()
+        await db.close()
+        await link.close()
+        await bot.session.close()
+
+def worker_process(index: int, port: int, token: str):
+    """Точка входа процесса-воркера (ShardFront запускает её через spawn)."""
+    # Ctrl+C и SIGTERM приходят всей группе процессов: воркер останавливает основной процесс,
+    # чтобы воркер успел доработать очередь и отправить последние записи
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(run_worker(index, port, token))
 
 if __name__ == "__main__":
     asyncio.run(main())
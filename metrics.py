@@ -0,0 +1,180 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Верхние границы корзин (сек) для Prometheus-гистограмм
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Последние window замеров (для квантилей в /stats) плюс накопительные
+    счётчики по корзинам с момента запуска (для Prometheus).
+    """
+
+    __slots__ = ("buckets", "counts", "count", "sum", "max", "rows", "_recent")
+
+    def __init__(self, window: int = 1000, buckets: tuple[float, ...] = BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя — +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self._recent: deque[float] = deque(maxlen=window)
+
+    def observe(self, seconds: float, rows: int | None = None):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        if rows:
+            self.rows += rows
+        self._recent.append(seconds)
+
+    def quantiles(self, *qs: float) -> list[float]:
+        recent = sorted(self._recent)
+        if not recent:
+            return [0.0] * len(qs)
+        return [recent[min(len(recent) - 1, int(q * len(recent)))] for q in qs]
+
+
+class Metrics:
+    """Реестр замеров: время операций (с числом строк), счётчики событий и снимаемые на лету величины."""
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.timings: dict[str, Histogram] = {}
+        self.counters: dict[str, int] = {}
+        self._gauges: dict[str, Callable[[], float]] = {}
+        self.started = time.time()
+
+    def observe(self, name: str, seconds: float, rows: int | None = None):
+        h = self.timings.get(name)
+        if h is None:
+            h = self.timings[name] = Histogram(self.window)
+        h.observe(seconds, rows)
+
+    def inc(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def gauge(self, name: str, read: Callable[[], float]):
+        self._gauges[name] = read
+
+    def gauges(self) -> dict[str, float]:
+        return {name: read() for name, read in self._gauges.items()}
+
+    def timed(self, name: str, rows: Callable[[Any], int] | None = None):
+        """Декоратор: меряет время вызова (sync или async); rows(result) — сколько строк затронуто."""
+        def wrap(fn):
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def timed_async(*args, **kwargs):
+                    t0 = time.perf_counter()
+                    result = await fn(*args, **kwargs)
+                    self.observe(name, time.perf_counter() - t0, rows(result) if rows else None)
+                    return result
+                return timed_async
+
+            @functools.wraps(fn)
+            def timed_sync(*args, **kwargs):
+                t0 = time.perf_counter()
+                result = fn(*args, **kwargs)
+                self.observe(name, time.perf_counter() - t0, rows(result) if rows else None)
+                return result
+            return timed_sync
+        return wrap
+
+    def reset(self):
+        self.timings.clear()
+        self.counters.clear()
+        self.started = time.time()
+
+    # ---------- вывод ----------
+    def report_lines(self) -> list[str]:
+        lines = [f"<b>Замеры за {_format_uptime(time.time() - self.started)}</b> "
+                 f"(квантили по последним {self.window} вызовам)"]
+        for name in sorted(self.timings):
+            h = self.timings[name]
+            p50, p99 = h.quantiles(0.5, 0.99)
+            line = (f"<code>{name}</code>: {h.count} шт, p50 {p50 * 1000:.2f} мс, "
+                    f"p99 {p99 * 1000:.2f} мс, макс {h.max * 1000:.2f} мс")
+            if h.rows:
+                line += f", строк {h.rows}"
+            lines.append(line)
+        if self.counters:
+            lines.append("")
+            lines.extend(f"<code>{name}</code>: {n}" for name, n in sorted(self.counters.items()))
+        gauges = self.gauges()
+        if gauges:
+            lines.append("")
+            lines.extend(f"<code>{name}</code>: {value:g}" for name, value in sorted(gauges.items()))
+        return lines
+
+    def prometheus(self, prefix: str = "wbcalc") -> str:
+        """Текстовый формат Prometheus (exposition format 0.0.4)."""
+        out = [f"# TYPE {prefix}_duration_seconds histogram"]
+        for name in sorted(self.timings):
+            h = self.timings[name]
+            acc = 0
+            for le, n in zip(h.buckets, h.counts):
+                acc += n
+                out.append(f'{prefix}_duration_seconds_bucket{{op="{name}",le="{le}"}} {acc}')
+            out.append(f'{prefix}_duration_seconds_bucket{{op="{name}",le="+Inf"}} {h.count}')
+            out.append(f'{prefix}_duration_seconds_sum{{op="{name}"}} {h.sum}')
+            out.append(f'{prefix}_duration_seconds_count{{op="{name}"}} {h.count}')
+        out.append(f"# TYPE {prefix}_rows_total counter")
+        out.extend(f'{prefix}_rows_total{{op="{name}"}} {h.rows}'
+                   for name, h in sorted(self.timings.items()) if h.rows)
+        out.append(f"# TYPE {prefix}_events_total counter")
+        out.extend(f'{prefix}_events_total{{name="{name}"}} {n}' for name, n in sorted(self.counters.items()))
+        out.append(f"# TYPE {prefix}_gauge gauge")
+        out.extend(f'{prefix}_gauge{{name="{name}"}} {value}' for name, value in sorted(self.gauges().items()))
+        return "\n".join(out) + "\n"
+
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        """Поднимает отдельный HTTP-сервер с GET /metrics. Остановка — runner.cleanup()."""
+        async def handle(request: web.Request) -> web.Response:
+            return web.Response(text=self.prometheus(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Внутренний middleware aiogram: время работы каждого хэндлера (по имени функции)."""
+
+    def __init__(self, metrics: Metrics, prefix: str = "handler"):
+        self.metrics = metrics
+        self.prefix = prefix
+
+    async def __call__(self, handler: Callable[[TelegramObject, dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: dict[str, Any]) -> Any:
+        h = data.get("handler")
+        name = f"{self.prefix}.{h.callback.__name__}" if h is not None else self.prefix
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.inc(f"{name}.errors")
+            raise
+        finally:
+            self.metrics.observe(name, time.perf_counter() - t0)
+
+
+def _format_uptime(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин"
@@ -0,0 +1,188 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.types import ReplyParameters
+
+log = logging.getLogger(__name__)
+
+# Лимиты Telegram: ~20 сообщений в минуту в одну группу, ~1 в секунду в личку, ~30 в секунду всего
+GROUP_RATE = 20 / 60
+PRIVATE_RATE = 1.0
+GLOBAL_RATE = 25.0
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self) -> float:
+        """Сколько ждать до свободного токена (0 — можно отправлять сразу)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+@dataclass
+class Outgoing:
+    chat_id: int
+    text: str
+    reply_to: int | None = None
+    kwargs: dict = field(default_factory=dict)
+    coalesce: str | None = None   # ключ схлопывания: подряд идущие элементы с одним ключом
+    payload: dict = field(default_factory=dict)
+    ready_at: float = 0.0
+
+
+@dataclass
+class OutboxStats:
+    queued: int = 0
+    sent: int = 0
+    dropped: int = 0
+    coalesced: int = 0       # сколько сообщений влилось в сводки
+    retry_after_waits: int = 0
+    retry_after_seconds: float = 0.0
+    errors: int = 0
+    max_depth: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений. Хэндлеры кладут ответ и сразу возвращаются,
+    а отправка идёт в фоне: token bucket на каждый чат, общий лимит на бота,
+    ожидание retry_after при 429 и схлопывание однотипных подтверждений в сводку.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = GLOBAL_RATE, group_rate: float = GROUP_RATE,
+                 private_rate: float = PRIVATE_RATE, burst: float = 3, max_queue: int = 2000,
+                 coalesce_window: float = 0.0):
+        self.bot = bot
+        self.group_rate = group_rate
+        self.private_rate = private_rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.coalesce_window = coalesce_window
+        self.stats = OutboxStats()
+        self._global = TokenBucket(global_rate, global_rate)
+        self._global_lock = asyncio.Lock()
+        self._buckets: dict[int, TokenBucket] = {}
+        self._queues: dict[int, deque[Outgoing]] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        self._summarizers: dict[str, Callable[[list[Outgoing]], str]] = {}
+        self._closed = False
+
+    @property
+    def depth(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def set_summarizer(self, key: str, summarize: Callable[[list[Outgoing]], str]):
+        """Как превратить несколько схлопнутых элементов с ключом key в один текст."""
+        self._summarizers[key] = summarize
+
+    def send(self, chat_id: int, text: str, reply_to: int | None = None,
+             coalesce: str | None = None, payload: dict | None = None, **kwargs) -> bool:
+        """Ставит сообщение в очередь. False — очередь переполнена, сообщение отброшено."""
+        if self._closed or self.depth >= self.max_queue:
+            self.stats.dropped += 1
+            return False
+        item = Outgoing(chat_id, text, reply_to, kwargs, coalesce, payload or {})
+        if coalesce and self.coalesce_window > 0:
+            item.ready_at = time.monotonic() + self.coalesce_window
+        self._queues.setdefault(chat_id, deque()).append(item)
+        self.stats.queued += 1
+        self.stats.max_depth = max(self.stats.max_depth, self.depth)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._run_chat(chat_id), name=f"outbox-{chat_id}")
+        return True
+
+    async def stop(self, timeout: float = 10.0):
+        """Дожидается отправки очереди (не дольше timeout), остальное отбрасывает."""
+        self._closed = True
+        workers = list(self._workers.values())
+        if workers:
+            _, pending = await asyncio.wait(workers, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self.stats.dropped += self.depth
+        self._queues.clear()
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        b = self._buckets.get(chat_id)
+        if b is None:
+            rate = self.group_rate if chat_id < 0 else self.private_rate
+            b = self._buckets[chat_id] = TokenBucket(rate, self.burst)
+        return b
+
+    def _take_next(self, q: deque[Outgoing]) -> Outgoing:
+        item = q.popleft()
+        if item.coalesce not in self._summarizers:
+            return item
+        # всё, что уже накопилось подряд с тем же ключом, уходит одной сводкой
+        group = [item]
+        while q and q[0].coalesce == item.coalesce:
+            group.append(q.popleft())
+        if len(group) == 1:
+            return item
+        self.stats.coalesced += len(group)
+        return Outgoing(item.chat_id, self._summarizers[item.coalesce](group), kwargs=item.kwargs)
+
+    async def _run_chat(self, chat_id: int):
+        q = self._queues[chat_id]
+        bucket = self._bucket(chat_id)
+        try:
+            while q:
+                wait = q[0].ready_at - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                wait = bucket.delay()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                item = self._take_next(q)
+                bucket.take()
+                await self._deliver(item)
+        finally:
+            self._workers.pop(chat_id, None)
+            if not q:
+                self._queues.pop(chat_id, None)
+
+    async def _deliver(self, item: Outgoing):
+        kwargs = dict(item.kwargs)
+        if item.reply_to is not None:
+            kwargs["reply_parameters"] = ReplyParameters(message_id=item.reply_to, allow_sending_without_reply=True)
+        for _ in range(MAX_RETRIES):
+            async with self._global_lock:
+                wait = self._global.delay()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    self._global.delay()
+                self._global.take()
+            try:
+                await self.bot.send_message(chat_id=item.chat_id, text=item.text, **kwargs)
+                self.stats.sent += 1
+                return
+            except TelegramRetryAfter as e:
+                self.stats.retry_after_waits += 1
+                self.stats.retry_after_seconds += e.retry_after
+                await asyncio.sleep(e.retry_after)
+            except TelegramAPIError:
+                log.exception("Не удалось отправить сообщение в чат %s", item.chat_id)
+                self.stats.errors += 1
+                return
+        self.stats.dropped += 1
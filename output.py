@@ -0,0 +1,50 @@
+import asyncio
+from typing import Awaitable, Callable
+
+# Лимит Telegram — 4096 символов; оставляем запас под HTML-разметку
+MESSAGE_LIMIT = 3900
+# Пауза между частями одного длинного ответа, чтобы не упереться во flood-лимит
+PAGE_DELAY = 0.4
+
+
+def split_lines(lines: list[str], limit: int = MESSAGE_LIMIT) -> list[str]:
+    """
+    Склеивает строки в сообщения не длиннее limit, разрывая только по границам строк.
+    Строка длиннее limit режется по символам (для обычных отчётов так не бывает).
+    """
+    chunks: list[str] = []
+    buf: list[str] = []
+    size = 0
+    for line in lines:
+        while len(line) > limit:
+            if buf:
+                chunks.append("\n".join(buf))
+                buf, size = [], 0
+            chunks.append(line[:limit])
+            line = line[limit:]
+        extra = len(line) + (1 if buf else 0)
+        if buf and size + extra > limit:
+            chunks.append("\n".join(buf))
+            buf, size = [], 0
+            extra = len(line)
+        buf.append(line)
+        size += extra
+    if buf:
+        chunks.append("\n".join(buf))
+    return chunks
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> list[str]:
+    return [text] if len(text) <= limit else split_lines(text.split("\n"), limit)
+
+
+async def send_paged(send: Callable[..., Awaitable], chunks: list[str], delay: float = PAGE_DELAY, **last_kwargs):
+    """
+    Отправляет части по очереди с паузой. last_kwargs (например, reply_markup)
+    передаются только с последней частью.
+    """
+    for i, chunk in enumerate(chunks):
+        last = i == len(chunks) - 1
+        await send(chunk, **(last_kwargs if last else {}))
+        if not last:
+            await asyncio.sleep(delay)
@@ -0,0 +1,54 @@
+import re
+
+# Границы строк так же, как у str.splitlines(); \t старый парсер тоже считал переводом строки.
+_BREAKS = "\n\r\t\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+
+# str.isdigit() шире, чем \d: сюда попадают ещё надстрочные/обведённые цифры и т.п.
+# Старый парсер тоже оставлял их в числе (и потом float() на них падал) — повторяем это.
+# Готовый класс символов (isdigit() and not isdecimal(), Unicode 14): перебор всех кодовых точек
+# при импорте стоил ~75 мс на запуск каждого процесса. Сверка с isdigit() — в tests/test_parsing.py.
+_EXTRA_DIGITS = (
+    "\u00b2\u00b3\u00b9\u1369-\u1371\u19da\u2070\u2074-\u2079\u2080-\u2089"
+    "\u2460-\u2468\u2474-\u247c\u2488-\u2490\u24ea\u24f5-\u24fd\u24ff"
+    "\u2776-\u277e\u2780-\u2788\u278a-\u2792"
+    "\U00010a40-\U00010a43\U00010e60-\U00010e68\U00011052-\U0001105a\U0001f100-\U0001f10a"
+)
+
+# Начало строки (после пробелов): "bs" (можно через пробел) или "s", регистр любой.
+# Хвост строки целиком — из него потом достаём цифры и точки/запятые.
+_LINE_RE = re.compile(
+    rf"(?:\A|[{_BREAKS}])[^\S{_BREAKS}]*(?:([bB])[^\S{_BREAKS}]*[sS]|[sS])[^\S{_BREAKS}]*([^{_BREAKS}]*)"
+)
+_NON_NUMBER_RE = re.compile(rf"[^\d.,{_EXTRA_DIGITS}]+")
+
+
+def parse_mixed_lines(text: str) -> tuple[list[float], list[float]]:
+    """
+    Возвращает (без_скидки, со_скидкой) из форматов:
+      bs1000  | bs 1000  -> без скидки
+      s1000   | s 1000   -> со скидкой
+    Регистр не важен. Остальные строки игнорируются.
+    Из хвоста строки берутся все цифры и точки (запятая = точка), как и раньше.
+    """
+    no_disc, disc = [], []
+    # быстрый отказ для обычной переписки: без буквы s подходящих строк не бывает
+    if "s" not in text and "S" not in text:
+        return no_disc, disc
+
+    sub = _NON_NUMBER_RE.sub
+    for is_bs, tail in _LINE_RE.findall(text):
+        if tail.isdecimal():
+            # частый случай "bs1500" / "s 2600": одни цифры, чистить нечего
+            v = float(tail)
+        else:
+            num = sub("", tail)
+            if not num:
+                continue
+            try:
+                v = float(num.replace(",", "."))
+            except ValueError:
+                continue
+        if v > 0:
+            (no_disc if is_bs else disc).append(v)
+    return no_disc, disc
+
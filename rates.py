@@ -0,0 +1,102 @@
+from bisect import bisect_right
+from dataclasses import dataclass
+
+try:  # numpy не обязателен: без него пакетный расчёт идёт на чистом Python
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# с какого размера списка выгоднее считать через numpy
+NUMPY_MIN_BATCH = 256
+
+
+@dataclass(frozen=True)
+class Tier:
+    key: str        # ключ курса в словаре rates (хранится в FSM)
+    lower: float    # нижняя граница диапазона, включительно (¥)
+    example: str = "11.75"
+
+
+class TierTable:
+    """
+    Диапазоны сумм (¥) для курсов, отсортированные по нижней границе.
+    Курс для суммы ищется бинарным поиском по границам.
+    """
+
+    def __init__(self, tiers: list[Tier]):
+        tiers = sorted(tiers, key=lambda t: t.lower)
+        if not tiers or tiers[0].lower != 0:
+            raise ValueError("Первый диапазон должен начинаться с 0")
+        if len({t.lower for t in tiers}) != len(tiers) or len({t.key for t in tiers}) != len(tiers):
+            raise ValueError("Границы и ключи диапазонов должны быть уникальны")
+        self.tiers: tuple[Tier, ...] = tuple(tiers)
+        self.bounds: list[float] = [t.lower for t in tiers]
+        self.keys: list[str] = [t.key for t in tiers]
+        self._np_bounds = np.asarray(self.bounds, dtype=float) if np is not None else None
+
+    @classmethod
+    def from_bounds(cls, bounds: list[float]) -> "TierTable":
+        """Таблица по списку нижних границ, например [0, 1000, 3000, 10000, 30000]."""
+        return cls([Tier(key=f"from_{b:g}", lower=float(b)) for b in bounds])
+
+    def __len__(self) -> int:
+        return len(self.tiers)
+
+    def index_for(self, cny_amount: float) -> int:
+        return max(bisect_right(self.bounds, cny_amount) - 1, 0)
+
+    def pick(self, cny_amount: float, rates: dict) -> float:
+        return rates[self.keys[self.index_for(cny_amount)]]
+
+    def pick_many(self, amounts: list[float], rates: dict) -> list[float]:
+        """Курсы для целого списка сумм за один проход."""
+        values = [rates[k] for k in self.keys]
+        if np is not None and len(amounts) >= NUMPY_MIN_BATCH:
+            idx = np.searchsorted(self._np_bounds, np.asarray(amounts, dtype=float), side="right") - 1
+            np.maximum(idx, 0, out=idx)
+            return np.asarray(values, dtype=float)[idx].tolist()
+        bounds = self.bounds
+        return [values[max(bisect_right(bounds, a) - 1, 0)] for a in amounts]
+
+    def rub_many(self, amounts: list[float], rates: dict, add: float) -> tuple[list[float], list[float]]:
+        """(курс, сумма в ₽ = amount × (курс + add)) для каждой суммы из списка."""
+        picked = self.pick_many(amounts, rates)
+        if np is not None and len(amounts) >= NUMPY_MIN_BATCH:
+            rub = (np.asarray(amounts, dtype=float) * (np.asarray(picked) + add)).tolist()
+        else:
+            rub = [a * (r + add) for a, r in zip(amounts, picked)]
+        return picked, rub
+
+    def upper(self, i: int) -> float | None:
+        return self.tiers[i + 1].lower if i + 1 < len(self.tiers) else None
+
+    def question(self, i: int) -> str:
+        """Диапазон словами для вопроса в диалоге: 'от 10000 до 30000 юаней'."""
+        lo, hi = self.tiers[i].lower, self.upper(i)
+        if hi is None:
+            return f"от {lo:g} юаней"
+        if lo == 0:
+            return f"до {hi:g} юаней"
+        return f"от {lo:g} до {hi:g} юаней"
+
+    def label(self, i: int) -> str:
+        """Диапазон для отчёта (HTML): '10000–30000 ¥'."""
+        lo, hi = self.tiers[i].lower, self.upper(i)
+        if hi is None:
+            return f"≥ {lo:g} ¥"
+        if lo == 0:
+            return f"&lt; {hi:g} ¥"
+        return f"{lo:g}–{hi:g} ¥"
+
+    def ask_order(self) -> list[int]:
+        """В диалоге курсы спрашиваем от крупных сумм к мелким."""
+        return list(range(len(self.tiers) - 1, -1, -1))
+
+
+DEFAULT_TIERS = TierTable([
+    Tier("ge_30000", 30000, "11.75"),
+    Tier("r_10000_30000", 10000, "11.80"),
+    Tier("r_3000_10000", 3000, "11.85"),
+    Tier("r_1000_3000", 1000, "11.90"),
+    Tier("lt_1000", 0, "12.00"),
+])
@@ -0,0 +1,498 @@
+"""
+Схема report.db и её миграции. Версия хранится в PRAGMA user_version.
+
+v1 — исходная схема: amount REAL, ts и date — ISO-строки, итоги по дням в daily_totals.
+v2 — компактная: суммы в фэнях (INTEGER, 1 ¥ = 100 фэней), ts — unix-время (сек),
+     day — номер дня от 1970-01-01; итоги по дням в day_totals, тоже в фэнях.
+v3 — несколько групп менеджеров: настройки групп в chats, итоги в day_totals по (chat_id, day),
+     индексы entries начинаются с chat_id, чтобы запросы одной группы не задевали строки других.
+v4 — курсы из диалога расчёта по дням (day_rates), чтобы историю можно было пересчитать (whatif.py).
+v5 — журнал отменённых /undo строк (undo_journal), чтобы /redo мог их вернуть (undo.py).
+v6 — снимки ежедневных отчётов за закрытые дни (day_reports, daily.py).
+
+Миграция v1 -> v2 идёт онлайн: новая таблица заполняется пачками по id, каждая пачка —
+отдельная короткая транзакция, а всё, что пишется в старую таблицу тем временем,
+зеркалируется в новую триггерами. Затем одна короткая транзакция подменяет таблицы,
+и старая вычищается такими же пачками.
+
+    python schema.py data/report.db [--batch 5000] [--pause 0.1] [--vacuum]
+"""
+import argparse
+import asyncio
+import logging
+import math
+import time
+from datetime import date, datetime
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import aiosqlite
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 6
+MIGRATION_BATCH = 5000
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def day_number(d: date) -> int:
+    return d.toordinal() - _EPOCH_ORDINAL
+
+
+def day_date(n: int) -> date:
+    return date.fromordinal(n + _EPOCH_ORDINAL)
+
+
+def to_fen(amount: float) -> int:
+    # округление половины вверх, как ROUND() в SQLite (суммы всегда положительные)
+    return math.floor(amount * 100 + 0.5)
+
+
+def from_fen(fen: int) -> float:
+    return fen / 100
+
+
+def epoch(ts: datetime) -> int:
+    return int(ts.timestamp())
+
+
+# ---------- v2 ----------
+# idx_entries_day — покрывающий для агрегатов по дням (SUM по типу не читает саму таблицу),
+# idx_entries_chat_msg — замена/удаление по сообщению,
+# idx_entries_sender — покрывающий для «последнее сообщение отправителя за день» (/undo):
+# и отбор, и ORDER BY ts, msg_id идут по индексу без обращения к таблице и без сортировки.
+_V2_TABLES = (
+    """
+    CREATE TABLE IF NOT EXISTS {entries}(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts INTEGER NOT NULL,           -- unix-время, сек
+        day INTEGER NOT NULL,          -- номер дня от 1970-01-01 в REPORT_TZ
+        amount_fen INTEGER NOT NULL,   -- сумма в фэнях
+        is_discount INTEGER NOT NULL,  -- 0 без скидки, 1 со скидкой
+        chat_id INTEGER NOT NULL,
+        msg_id INTEGER NOT NULL,
+        sender_id INTEGER
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_entries_day ON {entries}(day, is_discount, amount_fen)",
+    "CREATE INDEX IF NOT EXISTS idx_entries_chat_msg ON {entries}(chat_id, msg_id)",
+    "CREATE INDEX IF NOT EXISTS idx_entries_sender ON {entries}(sender_id, day, ts, msg_id)",
+    # Итоги по дням для отчётов за период; держатся в актуальном виде триггерами,
+    # поэтому любой путь записи в entries (очередь, /delete, /undo, очистка) их обновляет.
+    """
+    CREATE TABLE IF NOT EXISTS day_totals(
+        day INTEGER PRIMARY KEY,
+        sum_no INTEGER NOT NULL DEFAULT 0,
+        sum_disc INTEGER NOT NULL DEFAULT 0,
+        cnt INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_totals_ins AFTER INSERT ON {entries} BEGIN
+        INSERT INTO day_totals(day, sum_no, sum_disc, cnt)
+        VALUES (NEW.day,
+                CASE WHEN NEW.is_discount=0 THEN NEW.amount_fen ELSE 0 END,
+                CASE WHEN NEW.is_discount=1 THEN NEW.amount_fen ELSE 0 END,
+                1)
+        ON CONFLICT(day) DO UPDATE SET
+            sum_no = sum_no + excluded.sum_no,
+            sum_disc = sum_disc + excluded.sum_disc,
+            cnt = cnt + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_totals_del AFTER DELETE ON {entries} BEGIN
+        UPDATE day_totals SET
+            sum_no = sum_no - CASE WHEN OLD.is_discount=0 THEN OLD.amount_fen ELSE 0 END,
+            sum_disc = sum_disc - CASE WHEN OLD.is_discount=1 THEN OLD.amount_fen ELSE 0 END,
+            cnt = cnt - 1
+        WHERE day = OLD.day;
+        DELETE FROM day_totals WHERE day = OLD.day AND cnt <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_totals_upd AFTER UPDATE OF day, amount_fen, is_discount ON {entries} BEGIN
+        UPDATE day_totals SET
+            sum_no = sum_no - CASE WHEN OLD.is_discount=0 THEN OLD.amount_fen ELSE 0 END,
+            sum_disc = sum_disc - CASE WHEN OLD.is_discount=1 THEN OLD.amount_fen ELSE 0 END,
+            cnt = cnt - 1
+        WHERE day = OLD.day;
+        DELETE FROM day_totals WHERE day = OLD.day AND cnt <= 0;
+        INSERT INTO day_totals(day, sum_no, sum_disc, cnt)
+        VALUES (NEW.day,
+                CASE WHEN NEW.is_discount=0 THEN NEW.amount_fen ELSE 0 END,
+                CASE WHEN NEW.is_discount=1 THEN NEW.amount_fen ELSE 0 END,
+                1)
+        ON CONFLICT(day) DO UPDATE SET
+            sum_no = sum_no + excluded.sum_no,
+            sum_disc = sum_disc + excluded.sum_disc,
+            cnt = cnt + 1;
+    END
+    """,
+)
+
+# ---------- v3 ----------
+# Таблица entries та же, что в v2; меняются индексы, итоги по дням и добавляются настройки групп.
+# idx_entries_chat_day — покрывающий для итогов и выгрузки одной группы,
+# idx_entries_sender — покрывающий для /undo внутри группы.
+_V3_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_entries_chat_day ON entries(chat_id, day, is_discount, amount_fen)",
+    "CREATE INDEX IF NOT EXISTS idx_entries_chat_msg ON entries(chat_id, msg_id)",
+    "CREATE INDEX IF NOT EXISTS idx_entries_sender ON entries(chat_id, sender_id, day, ts, msg_id)",
+)
+_V3_CHATS = """
+    CREATE TABLE IF NOT EXISTS chats(
+        chat_id INTEGER PRIMARY KEY,
+        title TEXT NOT NULL DEFAULT '',
+        pay_no REAL NOT NULL,          -- выплата партнёру, ₽ за 1 ¥ без скидки
+        pay_disc REAL NOT NULL,        -- то же со скидкой
+        check_add_no REAL NOT NULL,    -- надбавки к курсу в проверочных строках
+        check_add_disc REAL NOT NULL,
+        admins TEXT NOT NULL DEFAULT '',  -- user_id админов группы через запятую
+        tz TEXT NOT NULL,              -- часовой пояс «сегодня» группы
+        updated INTEGER NOT NULL DEFAULT 0
+    )
+"""
+_V3_DAY_TOTALS = (
+    """
+    CREATE TABLE IF NOT EXISTS {table}(
+        chat_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        sum_no INTEGER NOT NULL DEFAULT 0,
+        sum_disc INTEGER NOT NULL DEFAULT 0,
+        cnt INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (chat_id, day)
+    ) WITHOUT ROWID
+    """,
+)
+_V3_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_totals_ins AFTER INSERT ON entries BEGIN
+        INSERT INTO day_totals(chat_id, day, sum_no, sum_disc, cnt)
+        VALUES (NEW.chat_id, NEW.day,
+                CASE WHEN NEW.is_discount=0 THEN NEW.amount_fen ELSE 0 END,
+                CASE WHEN NEW.is_discount=1 THEN NEW.amount_fen ELSE 0 END,
+                1)
+        ON CONFLICT(chat_id, day) DO UPDATE SET
+            sum_no = sum_no + excluded.sum_no,
+            sum_disc = sum_disc + excluded.sum_disc,
+            cnt = cnt + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_totals_del AFTER DELETE ON entries BEGIN
+        UPDATE day_totals SET
+            sum_no = sum_no - CASE WHEN OLD.is_discount=0 THEN OLD.amount_fen ELSE 0 END,
+            sum_disc = sum_disc - CASE WHEN OLD.is_discount=1 THEN OLD.amount_fen ELSE 0 END,
+            cnt = cnt - 1
+        WHERE chat_id = OLD.chat_id AND day = OLD.day;
+        DELETE FROM day_totals WHERE chat_id = OLD.chat_id AND day = OLD.day AND cnt <= 0;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_totals_upd AFTER UPDATE OF chat_id, day, amount_fen, is_discount ON entries BEGIN
+        UPDATE day_totals SET
+            sum_no = sum_no - CASE WHEN OLD.is_discount=0 THEN OLD.amount_fen ELSE 0 END,
+            sum_disc = sum_disc - CASE WHEN OLD.is_discount=1 THEN OLD.amount_fen ELSE 0 END,
+            cnt = cnt - 1
+        WHERE chat_id = OLD.chat_id AND day = OLD.day;
+        DELETE FROM day_totals WHERE chat_id = OLD.chat_id AND day = OLD.day AND cnt <= 0;
+        INSERT INTO day_totals(chat_id, day, sum_no, sum_disc, cnt)
+        VALUES (NEW.chat_id, NEW.day,
+                CASE WHEN NEW.is_discount=0 THEN NEW.amount_fen ELSE 0 END,
+                CASE WHEN NEW.is_discount=1 THEN NEW.amount_fen ELSE 0 END,
+                1)
+        ON CONFLICT(chat_id, day) DO UPDATE SET
+            sum_no = sum_no + excluded.sum_no,
+            sum_disc = sum_disc + excluded.sum_disc,
+            cnt = cnt + 1;
+    END
+    """,
+)
+
+# ---------- v4 ----------
+# Один набор на (группа, день): последний введённый в диалоге расчёта. Границы и курсы —
+# через запятую по возрастанию границ; ставки и надбавки — те, что действовали при вводе.
+_V4_DAY_RATES = """
+    CREATE TABLE IF NOT EXISTS day_rates(
+        chat_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        bounds TEXT NOT NULL,          -- нижние границы диапазонов, ¥
+        rates TEXT NOT NULL,           -- курс ₽/¥ для каждого диапазона
+        pay_no REAL NOT NULL,
+        pay_disc REAL NOT NULL,
+        check_add_no REAL NOT NULL,
+        check_add_disc REAL NOT NULL,
+        set_by INTEGER,                -- user_id того, кто вводил курсы
+        updated INTEGER NOT NULL,
+        PRIMARY KEY (chat_id, day)
+    ) WITHOUT ROWID
+"""
+
+# ---------- v5 ----------
+# Строки, снятые /undo, — как были в entries; batch — номер /undo у отправителя: один /redo
+# возвращает их вместе. Таблица маленькая: у отправителя хранится не больше UNDO_DEPTH отмен.
+_V5_UNDO_JOURNAL = (
+    """
+    CREATE TABLE IF NOT EXISTS undo_journal(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER NOT NULL,
+        sender_id INTEGER NOT NULL,
+        batch INTEGER NOT NULL,
+        msg_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        amount_fen INTEGER NOT NULL,
+        is_discount INTEGER NOT NULL,
+        undone INTEGER NOT NULL        -- unix-время отмены
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_undo_sender ON undo_journal(chat_id, sender_id, batch)",
+)
+
+# ---------- v6 ----------
+# Отчёт за закрытый день группы, как его разослали: итоги в фэнях, ставки выплат на момент
+# снимка и готовый текст. Запросы за этот день отдают его, а не считают заново.
+_V6_DAY_REPORTS = """
+    CREATE TABLE IF NOT EXISTS day_reports(
+        chat_id INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        sum_no INTEGER NOT NULL,
+        sum_disc INTEGER NOT NULL,
+        cnt INTEGER NOT NULL,
+        pay_no REAL NOT NULL,
+        pay_disc REAL NOT NULL,
+        text TEXT NOT NULL,
+        made INTEGER NOT NULL,         -- unix-время снимка
+        sent INTEGER,                  -- когда разослан админам; NULL — ещё не рассылался
+        PRIMARY KEY (chat_id, day)
+    ) WITHOUT ROWID
+"""
+
+# Строка v1 -> значения v2 (в тех же единицах, что to_fen/day_number/epoch)
+_V1_TO_V2 = """
+    {r}.id,
+    CAST(strftime('%s', {r}.ts) AS INTEGER),
+    CAST(julianday({r}.date) - 2440587.5 AS INTEGER),
+    CAST(ROUND({r}.amount * 100) AS INTEGER),
+    {r}.is_discount, {r}.chat_id, {r}.msg_id, {r}.sender_id
+"""
+_V2_COLUMNS = "id, ts, day, amount_fen, is_discount, chat_id, msg_id, sender_id"
+
+# Пока идёт копирование, изменения старой таблицы повторяются в новой
+_MIRROR_TRIGGERS = (
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_migrate_ins AFTER INSERT ON entries BEGIN
+        INSERT OR IGNORE INTO entries_v2({_V2_COLUMNS}) SELECT {_V1_TO_V2.format(r="NEW")};
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_migrate_del AFTER DELETE ON entries BEGIN
+        DELETE FROM entries_v2 WHERE id = OLD.id;
+    END
+    """,
+    # не INSERT OR REPLACE: неявное удаление при REPLACE не запускает триггеры day_totals
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_migrate_upd AFTER UPDATE ON entries BEGIN
+        DELETE FROM entries_v2 WHERE id = OLD.id;
+        INSERT INTO entries_v2({_V2_COLUMNS}) SELECT {_V1_TO_V2.format(r="NEW")};
+    END
+    """,
+)
+
+
+async def _table_exists(conn: aiosqlite.Connection, name: str) -> bool:
+    async with conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)) as cur:
+        return await cur.fetchone() is not None
+
+
+async def user_version(conn: aiosqlite.Connection) -> int:
+    async with conn.execute("PRAGMA user_version") as cur:
+        return (await cur.fetchone())[0]
+
+
+async def create_latest(conn: aiosqlite.Connection):
+    """Пустая база сразу в последней версии."""
+    await conn.execute(_V2_TABLES[0].format(entries="entries"))
+    for sql in (*_V3_INDEXES, _V3_CHATS, *(t.format(table="day_totals") for t in _V3_DAY_TOTALS), *_V3_TRIGGERS,
+                _V4_DAY_RATES, *_V5_UNDO_JOURNAL, _V6_DAY_REPORTS):
+        await conn.execute(sql)
+    await conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    await conn.commit()
+
+
+async def _migrate_v1_to_v2(conn: aiosqlite.Connection, batch: int, pause: float):
+    # 1. новая таблица с индексами и итогами + зеркалирование изменений старой
+    for sql in _V2_TABLES:
+        await conn.execute(sql.format(entries="entries_v2"))
+    for sql in _MIRROR_TRIGGERS:
+        await conn.execute(sql)
+    await conn.commit()
+
+    # 2. копирование пачками по id; OR IGNORE — строки, уже попавшие через триггер
+    #    или прерванный прошлый запуск, не дублируются. Только до max(id) на момент установки
+    #    триггеров: более новые строки они уже перенесли, а иначе под постоянной записью
+    #    копирование догоняло бы её бесконечно
+    async with conn.execute("SELECT COALESCE(MAX(id), 0) FROM entries") as cur:
+        (end,) = await cur.fetchone()
+    last, copied, started = 0, 0, time.monotonic()
+    while last < end:
+        async with conn.execute(
+            "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM entries WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+            (last, end, batch)
+        ) as cur:
+            hi, n = await cur.fetchone()
+        if not n:
+            break
+        await conn.execute(f"""
+            INSERT OR IGNORE INTO entries_v2({_V2_COLUMNS})
+            SELECT {_V1_TO_V2.format(r="entries")} FROM entries WHERE id > ? AND id <= ?
+        """, (last, hi))
+        await conn.commit()
+        last, copied = hi, copied + n
+        if pause:
+            await asyncio.sleep(pause)
+    log.info("Миграция v2: скопировано %s строк за %.1f с", copied, time.monotonic() - started)
+
+    # 3. подмена — только переименования: DROP большой таблицы держал бы запись секундами
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        for name in ("trg_migrate_ins", "trg_migrate_del", "trg_migrate_upd",
+                     "trg_entries_ins", "trg_entries_del", "trg_entries_upd"):
+            await conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        await conn.execute("DROP TABLE IF EXISTS daily_totals")
+        await conn.execute("ALTER TABLE entries RENAME TO entries_v1")
+        await conn.execute("ALTER TABLE entries_v2 RENAME TO entries")
+        await conn.execute("PRAGMA user_version=2")
+        await conn.commit()
+    except BaseException:
+        await conn.rollback()
+        raise
+
+    # 4. старая таблица вычищается пачками и удаляется уже пустой
+    await _drop_in_batches(conn, "entries_v1", batch, pause)
+
+
+async def _drop_in_batches(conn: aiosqlite.Connection, table: str, batch: int, pause: float):
+    while True:
+        cur = await conn.execute(
+            f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table} ORDER BY id LIMIT ?)", (batch,)
+        )
+        await conn.commit()
+        if cur.rowcount < batch:
+            break
+        if pause:
+            await asyncio.sleep(pause)
+    await conn.execute(f"DROP TABLE {table}")
+    await conn.commit()
+
+
+async def _migrate_v2_to_v3(conn: aiosqlite.Connection, batch: int, pause: float):
+    # Одна транзакция: итоги по (chat_id, day) пересчитываются из entries по покрывающему
+    # индексу, индексы перестраиваются. Идёт при старте бота до приёма апдейтов;
+    # на миллионе строк — секунды (см. bench/schema_v2.py для порядка величин).
+    started = time.monotonic()
+    await conn.execute("BEGIN IMMEDIATE")
+    try:
+        await conn.execute(_V3_CHATS)
+        for name in ("trg_totals_ins", "trg_totals_del", "trg_totals_upd"):
+            await conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        await conn.execute(_V3_DAY_TOTALS[0].format(table="day_totals_v3"))
+        await conn.execute("""
+            INSERT INTO day_totals_v3(chat_id, day, sum_no, sum_disc, cnt)
+            SELECT chat_id, day,
+                   COALESCE(SUM(CASE WHEN is_discount=0 THEN amount_fen END), 0),
+                   COALESCE(SUM(CASE WHEN is_discount=1 THEN amount_fen END), 0),
+                   COUNT(*)
+            FROM entries GROUP BY chat_id, day
+        """)
+        await conn.execute("DROP TABLE day_totals")
+        await conn.execute("ALTER TABLE day_totals_v3 RENAME TO day_totals")
+        for name in ("idx_entries_day", "idx_entries_sender"):
+            await conn.execute(f"DROP INDEX IF EXISTS {name}")
+        for sql in (*_V3_INDEXES, *_V3_TRIGGERS):
+            await conn.execute(sql)
+        await conn.execute("PRAGMA user_version=3")
+        await conn.commit()
+    except BaseException:
+        await conn.rollback()
+        raise
+    log.info("Миграция v3: итоги и индексы по группам перестроены за %.1f с", time.monotonic() - started)
+
+
+async def _migrate_v3_to_v4(conn: aiosqlite.Connection, batch: int, pause: float):
+    await conn.execute(_V4_DAY_RATES)
+    await conn.execute("PRAGMA user_version=4")
+    await conn.commit()
+
+
+async def _migrate_v4_to_v5(conn: aiosqlite.Connection, batch: int, pause: float):
+    for sql in _V5_UNDO_JOURNAL:
+        await conn.execute(sql)
+    await conn.execute("PRAGMA user_version=5")
+    await conn.commit()
+
+
+async def _migrate_v5_to_v6(conn: aiosqlite.Connection, batch: int, pause: float):
+    await conn.execute(_V6_DAY_REPORTS)
+    await conn.execute("PRAGMA user_version=6")
+    await conn.commit()
+
+
+async def _mark_v1(conn: aiosqlite.Connection, batch: int, pause: float):
+    # базы до появления версий: схема v1 уже создана прежним init_db
+    await conn.execute("PRAGMA user_version=1")
+    await conn.commit()
+
+
+# версия -> шаг, который приводит к ней базу предыдущей версии
+MIGRATIONS: dict[int, Callable[[aiosqlite.Connection, int, float], Awaitable[None]]] = {
+    1: _mark_v1,
+    2: _migrate_v1_to_v2,
+    3: _migrate_v2_to_v3,
+    4: _migrate_v3_to_v4,
+    5: _migrate_v4_to_v5,
+    6: _migrate_v5_to_v6,
+}
+
+
+async def migrate(conn: aiosqlite.Connection, batch: int = MIGRATION_BATCH, pause: float = 0.0) -> int:
+    """Доводит базу до SCHEMA_VERSION. Возвращает версию, с которой начали."""
+    start = await user_version(conn)
+    if start == 0 and not await _table_exists(conn, "entries"):
+        await create_latest(conn)
+        return start
+    if start > SCHEMA_VERSION:
+        raise RuntimeError(f"База версии {start} новее, чем поддерживает код ({SCHEMA_VERSION})")
+    for version in range(start + 1, SCHEMA_VERSION + 1):
+        log.info("Миграция схемы: v%s -> v%s", version - 1, version)
+        await MIGRATIONS[version](conn, batch, pause)
+    if await _table_exists(conn, "entries_v1"):
+        # прошлая миграция прервалась на удалении старой таблицы
+        await _drop_in_batches(conn, "entries_v1", batch, pause)
+    return start
+
+
+async def _main(path: Path, batch: int, pause: float, vacuum: bool):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute("PRAGMA journal_mode=WAL")
+        await conn.execute("PRAGMA busy_timeout=5000")
+        start = await migrate(conn, batch, pause)
+        print(f"{path}: v{start} -> v{await user_version(conn)}")
+        if vacuum:
+            # освобождённое старой таблицей место возвращается только так; блокирует базу на время работы
+            await conn.execute("VACUUM")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("db", type=Path)
+    ap.add_argument("--batch", type=int, default=MIGRATION_BATCH)
+    # пауза должна быть дольше шага ожидания busy_timeout (до 100 мс), иначе работающий бот
+    # не успевает вклиниться между пачками
+    ap.add_argument("--pause", type=float, default=0.1, help="пауза между пачками, сек")
+    ap.add_argument("--vacuum", action="store_true", help="сжать файл после миграции")
+    args = ap.parse_args()
+    asyncio.run(_main(args.db, args.batch, args.pause, args.vacuum))
@@ -0,0 +1,382 @@
+"""
+Режим нескольких процессов (WORKERS > 1). Основной процесс (ShardFront) принимает апдейты —
+polling или webhook — и раздаёт их воркерам по chat_id: все апдейты одного чата попадают
+в один и тот же процесс, а там идут строго по очереди (правки и /undo не обгоняют сообщения).
+Разные чаты обрабатываются параллельно — и между процессами, и внутри воркера.
+
+Пишет в report.db только основной процесс: воркеры присылают ему транзакции по имени
+(dbconn.write_op) через локальное соединение, а он выполняет их по одной на своём пишущем
+соединении — без борьбы процессов за блокировку SQLite. Читают воркеры сами (WAL).
+
+Связь — TCP на 127.0.0.1 со случайным портом и одноразовым токеном; кадр — длина + pickle.
+Первый кадр воркера — не pickle, а сырые индекс и токен фиксированной длины: pickle.loads
+выполняет код, поэтому до него доходят только соединения, предъявившие токен.
+"""
+import asyncio
+import logging
+import multiprocessing
+import pickle
+import secrets
+import struct
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+from dbconn import WRITE_OPS, Database
+
+log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+_HELLO = struct.Struct("!I16s")  # индекс воркера, токен (secrets.token_hex(16) в байтах)
+HELLO_TIMEOUT = 5.0
+HOST = "127.0.0.1"
+
+
+async def _send(writer: asyncio.StreamWriter, msg: tuple):
+    data = pickle.dumps(msg, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(_HEADER.pack(len(data)) + data)
+    await writer.drain()
+
+
+async def _recv(reader: asyncio.StreamReader) -> tuple | None:
+    try:
+        (size,) = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+        data = await reader.readexactly(size)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        return None
+    try:
+        return pickle.loads(data)
+    except Exception:
+        log.warning("Непонятный кадр (%s байт) — соединение закрыто", size)
+        return None
+
+
+def chat_of(update: Update) -> int:
+    """Чат, к которому относится апдейт (по нему выбирается воркер); 0 — не определить."""
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = getattr(event.message, "chat", None)  # callback_query
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user else 0
+
+
+def shard_of(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+@dataclass
+class ShardStats:
+    routed: list[int] = field(default_factory=list)   # по воркерам
+    handled: int = 0
+    errors: int = 0
+    writes: int = 0        # транзакций, выполненных за воркеры
+    write_errors: int = 0
+    notices: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class ShardFront:
+    """
+    Основной процесс. target(index, port, token) запускается в каждом воркере (spawn) и должен
+    подключиться обратно через WorkerLink. Для Dispatcher-совместимости (WebhookServer) есть
+    feed_update(bot, update): апдейт только ставится в очередь воркера.
+    """
+
+    def __init__(self, db: Database, workers: int, target: Callable[[int, int, str], None],
+                 start_timeout: float = 60.0, stop_timeout: float = 30.0):
+        self.db = db
+        self.workers = workers
+        self.target = target
+        self.start_timeout = start_timeout
+        self.stop_timeout = stop_timeout
+        self.stats = ShardStats(routed=[0] * workers)
+        self._token = secrets.token_hex(16)
+        self._server: asyncio.AbstractServer | None = None
+        self._procs: list[multiprocessing.Process] = []
+        self._links: list[asyncio.StreamWriter | None] = [None] * workers
+        self._ready = asyncio.Event()
+        self._closed: list[asyncio.Event] = [asyncio.Event() for _ in range(workers)]
+        self._sent: dict[int, tuple[float, int]] = {}  # update_id -> (время отправки, воркер)
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._after_update = []  # колбэки (seconds, ok) по завершении апдейта в воркере
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._sent)
+
+    def add_after_update(self, callback):
+        self._after_update.append(callback)
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._accept, HOST, 0)
+        port = self._server.sockets[0].getsockname()[1]
+        ctx = multiprocessing.get_context("spawn")  # без fork: у родителя уже открыты соединения и цикл
+        for i in range(self.workers):
+            proc = ctx.Process(target=self.target, args=(i, port, self._token), name=f"worker-{i}", daemon=True)
+            proc.start()
+            self._procs.append(proc)
+        deadline = time.monotonic() + self.start_timeout
+        while not self._ready.is_set():
+            dead = [p.name for p in self._procs if p.exitcode is not None]
+            if dead or time.monotonic() > deadline:
+                await self.stop()
+                raise RuntimeError(f"Воркеры завершились при запуске: {', '.join(dead)}" if dead
+                                   else "Воркеры не подключились вовремя")
+            try:
+                await asyncio.wait_for(self._ready.wait(), 0.5)
+            except asyncio.TimeoutError:
+                pass
+        log.info("Запущено воркеров: %s", self.workers)
+
+    async def feed_update(self, bot: Bot, update: Update, **kwargs):
+        """Отдаёт апдейт воркеру его чата. Результат обработки не ждёт."""
+        index = shard_of(chat_of(update), self.workers)
+        link = self._links[index]
+        if link is None:
+            raise RuntimeError(f"Воркер {index} недоступен")
+        self._sent[update.update_id] = (time.perf_counter(), index)
+        self._idle.clear()
+        self.stats.routed[index] += 1
+        await _send(link, ("update", update.model_dump_json(exclude_unset=True, by_alias=True)))
+
+    async def join(self):
+        """Ждёт, пока воркеры доработают всё отправленное."""
+        await self._idle.wait()
+
+    async def poll(self, bot: Bot, stop: asyncio.Event, allowed_updates: list[str] | None = None,
+                   timeout: int = 30):
+        """Long polling в основном процессе: то же, что dp.start_polling, но с раздачей воркерам."""
+        offset = None
+        while not stop.is_set():
+            fetch = asyncio.ensure_future(bot.get_updates(offset=offset, timeout=timeout,
+                                                          allowed_updates=allowed_updates))
+            stopping = asyncio.ensure_future(stop.wait())
+            await asyncio.wait({fetch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if not fetch.done():
+                fetch.cancel()  # неподтверждённые апдейты Telegram отдаст при следующем запуске
+                break
+            try:
+                updates = fetch.result()
+            except Exception:
+                log.exception("getUpdates не удался, повтор через 5 с")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                await self.feed_update(bot, update)
+                offset = update.update_id + 1
+
+    async def stop(self):
+        """Просит воркеры доработать очередь и выйти; их последние записи ещё выполняются здесь."""
+        for link in self._links:
+            if link is not None:
+                try:
+                    await _send(link, ("stop",))
+                except ConnectionError:
+                    pass
+        for i, proc in enumerate(self._procs):
+            if self._links[i] is not None:  # не подключившегося воркера ждать нечего
+                try:
+                    await asyncio.wait_for(self._closed[i].wait(), self.stop_timeout)
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.get_running_loop().run_in_executor(None, proc.join, 5)
+            if proc.is_alive():
+                log.warning("Воркер %s не завершился, останавливаю", proc.name)
+                proc.terminate()
+        self._procs.clear()
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    # ---------- соединение с воркером ----------
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            index, token = _HELLO.unpack(await asyncio.wait_for(reader.readexactly(_HELLO.size), HELLO_TIMEOUT))
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError):
+            writer.close()
+            return
+        if not secrets.compare_digest(token, bytes.fromhex(self._token)) or not 0 <= index < len(self._links):
+            log.warning("Соединение без верного токена воркера — закрыто")
+            writer.close()
+            return
+        self._links[index] = writer
+        if all(self._links):
+            self._ready.set()
+        try:
+            while (msg := await _recv(reader)) is not None:
+                kind = msg[0]
+                if kind == "run":
+                    asyncio.create_task(self._run(writer, *msg[1:]))
+                elif kind == "done":
+                    self._done(*msg[1:])
+                elif kind == "notify":
+                    await self._notify(index, msg[1])
+        finally:
+            self._links[index] = None
+            self._closed[index].set()
+            writer.close()
+            # апдейты, которые воркер не успел доработать, считаются ошибками — join() не повиснет
+            for update_id in [u for u, (_, w) in self._sent.items() if w == index]:
+                self._done(update_id, False)
+
+    async def _run(self, writer: asyncio.StreamWriter, req_id: int, name: str, args: tuple):
+        try:
+            result = await self.db.run(WRITE_OPS[name], *args)
+            reply = ("result", req_id, True, result)
+            self.stats.writes += 1
+        except Exception as e:
+            self.stats.write_errors += 1
+            log.exception("Транзакция %s от воркера не выполнена", name)
+            reply = ("result", req_id, False, e if _picklable(e) else RuntimeError(repr(e)))
+        try:
+            await _send(writer, reply)
+        except ConnectionError:
+            pass
+
+    def _done(self, update_id: int, ok: bool):
+        sent = self._sent.pop(update_id, None)
+        if ok:
+            self.stats.handled += 1
+        else:
+            self.stats.errors += 1
+        if sent is not None:
+            for cb in self._after_update:
+                cb(time.perf_counter() - sent[0], ok)
+        if not self._sent:
+            self._idle.set()
+
+    async def _notify(self, source: int, topic: str):
+        self.stats.notices += 1
+        for i, link in enumerate(self._links):
+            if link is not None and i != source:
+                await _send(link, ("notify", topic))
+
+
+def _picklable(obj) -> bool:
+    try:
+        pickle.dumps(obj)
+        return True
+    except Exception:
+        return False
+
+
+class WorkerLink:
+    """
+    Сторона воркера: принимает апдейты и выполняет их через dp (по очереди внутри чата),
+    транзакции отправляет основному процессу (Database.use_remote(link.call)).
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, index: int):
+        self.index = index
+        self._reader = reader
+        self._writer = writer
+        self._req_ids = iter(range(1, 2**62))
+        self._calls: dict[int, asyncio.Future] = {}
+        self._tails: dict[int, asyncio.Task] = {}  # chat_id -> последний апдейт чата
+        self._tasks: set[asyncio.Task] = set()
+        self._topics: dict[str, list[Callable[[], Awaitable]]] = {}
+        self._stopped = asyncio.Event()
+        self._reader_task: asyncio.Task | None = None
+
+    @classmethod
+    async def connect(cls, port: int, token: str, index: int) -> "WorkerLink":
+        reader, writer = await asyncio.open_connection(HOST, port)
+        writer.write(_HELLO.pack(index, bytes.fromhex(token)))
+        await writer.drain()
+        return cls(reader, writer, index)
+
+    async def call(self, name: str, args: tuple):
+        """Выполнить транзакцию WRITE_OPS[name](conn, *args) в основном процессе."""
+        req_id = next(self._req_ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._calls[req_id] = fut
+        await _send(self._writer, ("run", req_id, name, args))
+        return await fut
+
+    def on_notify(self, topic: str, callback: Callable[[], Awaitable]):
+        self._topics.setdefault(topic, []).append(callback)
+
+    def notify(self, topic: str):
+        """Сообщить остальным воркерам (например, «chats» — перечитать настройки групп)."""
+        self._spawn(_send(self._writer, ("notify", topic)))
+
+    async def serve(self, dp: Dispatcher, bot: Bot, **data):
+        """Читает соединение до команды stop; возвращается, доработав принятые апдейты."""
+        self._reader_task = asyncio.create_task(self._read(dp, bot, data))
+        await self._stopped.wait()
+        while self._tasks:
+            await asyncio.wait(list(self._tasks))
+        # reader остаётся жить: ответы на транзакции при остановке (ingest.stop) ещё придут
+
+    async def close(self):
+        self._writer.close()
+        if self._reader_task is not None:
+            await self._reader_task
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+
+    async def _read(self, dp: Dispatcher, bot: Bot, data: dict):
+        while (msg := await _recv(self._reader)) is not None:
+            kind = msg[0]
+            if kind == "update":
+                update = Update.model_validate_json(msg[1], context={"bot": bot})
+                self._schedule(update, dp, bot, data)
+            elif kind == "result":
+                _, req_id, ok, value = msg
+                fut = self._calls.pop(req_id, None)
+                if fut is not None and not fut.done():
+                    fut.set_result(value) if ok else fut.set_exception(value)
+            elif kind == "notify":
+                for cb in self._topics.get(msg[1], ()):
+                    self._spawn(cb())
+            elif kind == "stop":
+                self._stopped.set()
+        # основной процесс закрыл соединение: ждущие транзакции не выполнятся
+        for fut in self._calls.values():
+            if not fut.done():
+                fut.set_exception(ConnectionError("соединение с основным процессом потеряно"))
+        self._calls.clear()
+        self._stopped.set()
+
+    def _schedule(self, update: Update, dp: Dispatcher, bot: Bot, data: dict):
+        chat_id = chat_of(update)
+        prev = self._tails.get(chat_id)
+        task = self._spawn(self._feed(prev, update, dp, bot, data))
+        self._tails[chat_id] = task
+        task.add_done_callback(lambda t: self._tails.pop(chat_id, None) if self._tails.get(chat_id) is t else None)
+
+    async def _feed(self, prev: asyncio.Task | None, update: Update, dp: Dispatcher, bot: Bot, data: dict):
+        if prev is not None:
+            await asyncio.wait([prev])  # порядок внутри чата
+        ok = True
+        try:
+            result = await dp.feed_update(bot, update, **data)
+            if isinstance(result, TelegramMethod):
+                await dp.silent_call_request(bot, result)
+        except Exception:
+            ok = False
+            log.exception("Воркер %s: ошибка обработки апдейта %s", self.index, update.update_id)
+        try:
+            await _send(self._writer, ("done", update.update_id, ok))
+        except ConnectionError:
+            pass
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
@@ -0,0 +1,35 @@
+"""
+Новый парсер (parsing.parse_mixed_lines) должен выдавать ровно то же, что прежний построчный
+(bench/parser_bench.py): корпус пограничных случаев оттуда же, плюс случайные строки.
+
+    python -m pytest tests
+"""
+import re
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "bench"))
+
+import parsing  # noqa: E402
+from parser_bench import CORPUS, check_equivalence, parse_mixed_lines_legacy  # noqa: E402
+
+
+@pytest.mark.parametrize("text", CORPUS + ["\n".join(CORPUS)])
+def test_corpus_matches_legacy(text):
+    assert parsing.parse_mixed_lines(text) == parse_mixed_lines_legacy(text)
+
+
+def test_random_lines_match_legacy():
+    check_equivalence(20000)
+
+
+def test_extra_digits_match_isdigit():
+    # готовый класс символов в parsing.py — то же, что isdigit() and not isdecimal() этого Python
+    extra = re.compile(f"[{parsing._EXTRA_DIGITS}]")
+    for cp in range(sys.maxunicode + 1):
+        c = chr(cp)
+        assert bool(extra.fullmatch(c)) == (c.isdigit() and not c.isdecimal()), f"U+{cp:04X}"
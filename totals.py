@@ -0,0 +1,125 @@
+from dataclasses import dataclass
+
+import aiosqlite
+
+
+@dataclass(slots=True)
+class DayTotals:
+    # суммы в фэнях (целые), поэтому совпадают с SQL до единицы при любом порядке сложения
+    sum_no: int = 0
+    sum_disc: int = 0
+    count: int = 0
+
+    def is_empty(self) -> bool:
+        return self.count == 0
+
+    def plus(self, other: "DayTotals | None") -> "DayTotals":
+        if other is None:
+            return self
+        return DayTotals(self.sum_no + other.sum_no, self.sum_disc + other.sum_disc, self.count + other.count)
+
+
+@dataclass
+class Drift:
+    chat_id: int
+    day: int
+    cached: DayTotals
+    actual: DayTotals
+
+
+def rows_by_day(rows) -> dict[tuple[int, int], DayTotals]:
+    """(chat_id, day, is_discount, SUM(amount_fen), COUNT(*)) -> {(chat_id, day): DayTotals}"""
+    out: dict[tuple[int, int], DayTotals] = {}
+    for chat_id, d, is_disc, s, cnt in rows:
+        t = out.setdefault((chat_id, d), DayTotals())
+        if is_disc:
+            t.sum_disc += int(s or 0)
+        else:
+            t.sum_no += int(s or 0)
+        t.count += int(cnt)
+    return out
+
+
+async def read_day(conn: aiosqlite.Connection, chat_id: int, day: int) -> DayTotals:
+    """Итог группы за день прямо из day_totals (одна строка по ключу) — когда кэша нет."""
+    async with conn.execute("SELECT sum_no, sum_disc, cnt FROM day_totals WHERE chat_id=? AND day=?",
+                            (chat_id, day)) as cur:
+        row = await cur.fetchone()
+    return DayTotals(*row) if row else DayTotals()
+
+
+class TotalsCache:
+    """
+    Текущие суммы по дням в памяти, отдельно по каждой группе: {chat_id: {номер дня: DayTotals}}.
+    Прогревается из SQLite при старте, дальше обновляется всеми путями записи,
+    поэтому отчёт за день не ходит в базу и не касается чужих групп.
+    """
+
+    def __init__(self):
+        self._chats: dict[int, dict[int, DayTotals]] = {}
+
+    async def warm(self, conn: aiosqlite.Connection):
+        # day_totals уже содержит готовые суммы по дням — полный скан entries не нужен
+        async with conn.execute("SELECT chat_id, day, sum_no, sum_disc, cnt FROM day_totals") as cur:
+            rows = await cur.fetchall()
+        self._chats = {}
+        for chat_id, d, sn, sd, c in rows:
+            self._chats.setdefault(chat_id, {})[d] = DayTotals(sn, sd, c)
+
+    def get(self, chat_id: int, day: int) -> DayTotals:
+        t = self._chats.get(chat_id, {}).get(day)
+        return DayTotals(t.sum_no, t.sum_disc, t.count) if t else DayTotals()
+
+    def add(self, chat_id: int, day: int, sum_no: int = 0, sum_disc: int = 0, count: int = 0):
+        """Прибавляет вклад строк (для удаления — отрицательные значения)."""
+        days = self._chats.setdefault(chat_id, {})
+        t = days.setdefault(day, DayTotals())
+        t.sum_no += sum_no
+        t.sum_disc += sum_disc
+        t.count += count
+        if t.count <= 0:
+            del days[day]
+
+    def apply(self, delta: dict[tuple[int, int], DayTotals], sign: int = 1):
+        for (chat_id, day), t in delta.items():
+            self.add(chat_id, day, sign * t.sum_no, sign * t.sum_disc, sign * t.count)
+
+    def drop(self, chat_id: int, day: int):
+        self._chats.get(chat_id, {}).pop(day, None)
+
+    def drop_day(self, day: int):
+        """День целиком ушёл из базы (архив) — у всех групп."""
+        for days in self._chats.values():
+            days.pop(day, None)
+
+    def days(self, chat_id: int) -> list[int]:
+        return sorted(self._chats.get(chat_id, {}))
+
+    def snapshot(self) -> dict[tuple[int, int], DayTotals]:
+        """Копия кэша {(chat_id, день): DayTotals} — для check."""
+        return {(chat_id, d): DayTotals(t.sum_no, t.sum_disc, t.count)
+                for chat_id, days in self._chats.items() for d, t in days.items()}
+
+    async def check(self, conn: aiosqlite.Connection, cached: dict[tuple[int, int], DayTotals],
+                    fix: bool = False) -> list[Drift]:
+        """
+        Сверяет cached (snapshot(), снятый в тот же момент, что и снимок базы conn) со свежим
+        агрегатом из SQL. При fix=True расходящиеся дни поправляются на разницу: записанное
+        в кэш за время сверки не теряется.
+        """
+        async with conn.execute("""
+            SELECT chat_id, day, is_discount, SUM(amount_fen), COUNT(*)
+            FROM entries GROUP BY chat_id, day, is_discount
+        """) as cur:
+            actual = rows_by_day(await cur.fetchall())
+        drifts = []
+        for key in sorted(set(actual) | set(cached)):
+            a = actual.get(key, DayTotals())
+            c = cached.get(key, DayTotals())
+            if a.count != c.count or a.sum_no != c.sum_no or a.sum_disc != c.sum_disc:
+                drifts.append(Drift(*key, DayTotals(c.sum_no, c.sum_disc, c.count), a))
+        if fix:
+            for dr in drifts:
+                self.add(dr.chat_id, dr.day, dr.actual.sum_no - dr.cached.sum_no,
+                         dr.actual.sum_disc - dr.cached.sum_disc, dr.actual.count - dr.cached.count)
+        return drifts
@@ -0,0 +1,267 @@
+"""
+Журнал отмен менеджеров: /undo N снимает N последних сообщений отправителя, /redo возвращает
+последнее отменённое.
+
+В памяти у каждого отправителя — его последние сообщения по порядку (ts, msg_id), как их
+выбирал прежний запрос ORDER BY ts DESC: загружаются одним запросом при первой отмене,
+дальше поддерживаются колбэком очереди ingest после каждой записанной пачки, так что
+повторные отмены в базу за поиском не ходят. Отмена и возврат — по одной транзакции
+(Database.run) на весь набор сообщений; снятые строки уходят в undo_journal и переживают
+перезапуск, пока их не вернут или не вытеснят более новые отмены (depth на отправителя).
+
+Изменения сумм отдаются колбэкам add_after_apply в том же виде, что у IngestQueue.add_after_write:
+кэш итогов поправляется по готовым суммам, без пересчёта.
+"""
+import asyncio
+import time
+from bisect import insort
+from dataclasses import dataclass, field
+from typing import Sequence
+
+from dbconn import Database, write_op
+from ingest import Replacement
+from schema import epoch
+from totals import DayTotals
+
+UNDO_DEPTH = 20
+
+# строка entries в журнале: (msg_id, ts, day, amount_fen, is_discount)
+Row = tuple[int, int, int, int, int]
+
+
+@dataclass(order=True, slots=True)
+class MessageOp:
+    """Записанное сообщение отправителя; порядок — как у ORDER BY ts, msg_id."""
+    ts: int
+    msg_id: int
+    day: int = field(compare=False)
+
+
+@dataclass
+class UndoResult:
+    msg_ids: list[int]
+    count: int = 0
+    sum_no: int = 0     # фэни
+    sum_disc: int = 0
+
+
+@dataclass
+class _Sender:
+    done: list[MessageOp] = field(default_factory=list)   # по возрастанию, последнее — в конце
+    by_msg: dict[int, MessageOp] = field(default_factory=dict)
+    loaded_from: int | None = None  # с какого дня загружены done; None — ещё не загружались
+    more: bool = False              # в базе могут быть сообщения старше загруженных
+    # пока done читаются из базы — что записано и удалено за это время (msg_id, op или None)
+    loading: list[tuple[int, "MessageOp | None"]] | None = None
+    redo: list[tuple[int, list[Row]]] = field(default_factory=list)  # (batch, строки), последнее — в конце
+
+
+def _totals(chat_id: int, rows: Sequence[Row]) -> dict[tuple[int, int], DayTotals]:
+    out: dict[tuple[int, int], DayTotals] = {}
+    for _, _, day, fen, is_disc in rows:
+        t = out.setdefault((chat_id, day), DayTotals())
+        if is_disc:
+            t.sum_disc += fen
+        else:
+            t.sum_no += fen
+        t.count += 1
+    return out
+
+
+def _result(msg_ids: list[int], rows: Sequence[Row]) -> UndoResult:
+    res = UndoResult(msg_ids)
+    for _, _, _, fen, is_disc in rows:
+        res.count += 1
+        if is_disc:
+            res.sum_disc += fen
+        else:
+            res.sum_no += fen
+    return res
+
+
+class UndoJournal:
+    def __init__(self, db: Database, depth: int = UNDO_DEPTH):
+        self.db = db
+        self.depth = max(1, depth)
+        self._senders: dict[tuple[int, int], _Sender] = {}
+        self._lock = asyncio.Lock()  # /undo и /redo одного отправителя не должны выбрать одно и то же
+        self._after_apply = []
+
+    def add_after_apply(self, callback):
+        """callback(added, removed) — {(chat_id, day): DayTotals} после commit отмены или возврата."""
+        self._after_apply.append(callback)
+
+    async def load(self):
+        """Отменённое до перезапуска — чтобы /redo работал и после него."""
+        async with self.db.read() as conn:
+            async with conn.execute("""
+                SELECT chat_id, sender_id, batch, msg_id, ts, day, amount_fen, is_discount
+                FROM undo_journal ORDER BY chat_id, sender_id, batch, id
+            """) as cur:
+                rows = await cur.fetchall()
+        self._senders.clear()
+        for chat_id, sender_id, batch, *row in rows:
+            redo = self._sender(chat_id, sender_id).redo
+            if not redo or redo[-1][0] != batch:
+                redo.append((batch, []))
+            redo[-1][1].append(tuple(row))
+
+    # ---------- колбэки записи ----------
+    def observe(self, items: list[Replacement]):
+        """Для IngestQueue.add_after_items: записанные сообщения встают наверх стека отправителя."""
+        for it in items:
+            if it.sender_id is None:
+                continue
+            s = self._senders.get((it.chat_id, it.sender_id))
+            if s is None:
+                continue  # не загружен — при первой отмене прочитается из базы как есть
+            op = MessageOp(epoch(it.ts), it.msg_id, it.day) if it.no_list or it.disc_list else None
+            if s.loading is not None:
+                s.loading.append((it.msg_id, op))
+            if s.loaded_from is not None:
+                self._put(s, it.msg_id, op)
+
+    def forget(self, chat_id: int, msg_id: int):
+        """Строки сообщения удалены в обход журнала (/delete)."""
+        for (c, _), s in self._senders.items():
+            if c == chat_id:
+                if s.loading is not None:
+                    s.loading.append((msg_id, None))
+                self._drop(s, msg_id)
+
+    def forget_day(self, chat_id: int, day: int):
+        """День группы очищен (/clear_today)."""
+        for (c, _), s in self._senders.items():
+            if c == chat_id:
+                for op in [op for op in s.done if op.day == day]:
+                    self._drop(s, op.msg_id)
+
+    # ---------- отмена и возврат ----------
+    async def undo(self, chat_id: int, sender_id: int, n: int, min_day: int) -> UndoResult | None:
+        """Снимает до n последних сообщений отправителя не раньше дня min_day. None — нечего отменять."""
+        n = max(1, min(n, self.depth))
+        async with self._lock:
+            s = self._sender(chat_id, sender_id)
+            if s.loaded_from is None or s.loaded_from > min_day or (s.more and len(s.done) < n):
+                await self._load_done(s, chat_id, sender_id, min_day)
+            ops = [op for op in reversed(s.done) if op.day >= min_day][:n]
+            if not ops:
+                return None
+            batch = (s.redo[-1][0] + 1) if s.redo else 1
+            # вытесняем самые старые отмены, чтобы журнал отправителя не рос: с новой их будет depth
+            drop = len(s.redo) - (self.depth - 1)
+            keep_from = 0 if drop <= 0 else (s.redo[drop][0] if drop < len(s.redo) else batch)
+            rows = await self.db.run(undo_tx, chat_id, sender_id, [op.msg_id for op in ops],
+                                     batch, int(time.time()), keep_from)
+            for op in ops:
+                self._drop(s, op.msg_id)
+            if keep_from:
+                s.redo = [b for b in s.redo if b[0] >= keep_from]
+            if rows:
+                s.redo.append((batch, rows))
+            self._applied({}, _totals(chat_id, rows))
+            return _result([op.msg_id for op in ops], rows)
+
+    async def redo(self, chat_id: int, sender_id: int) -> UndoResult | None:
+        """Возвращает строки последнего /undo. None — возвращать нечего."""
+        async with self._lock:
+            s = self._senders.get((chat_id, sender_id))
+            if s is None or not s.redo:
+                return None
+            batch, rows = s.redo[-1]
+            restored = await self.db.run(redo_tx, chat_id, sender_id, batch, rows)
+            s.redo.pop()  # только после commit: при сбое отмена остаётся в журнале и в памяти
+            if s.loaded_from is not None:
+                for msg_id, ts, day, _, _ in restored:
+                    if msg_id not in s.by_msg and day >= s.loaded_from:
+                        op = MessageOp(ts, msg_id, day)
+                        insort(s.done, op)
+                        s.by_msg[msg_id] = op
+            self._applied(_totals(chat_id, restored), {})
+            return _result(sorted({r[0] for r in restored}), restored)
+
+    # ---------- внутреннее ----------
+    def _sender(self, chat_id: int, sender_id: int) -> _Sender:
+        return self._senders.setdefault((chat_id, sender_id), _Sender())
+
+    def _put(self, s: _Sender, msg_id: int, op: MessageOp | None):
+        self._drop(s, msg_id)
+        if op is not None:
+            insort(s.done, op)
+            s.by_msg[msg_id] = op
+            if len(s.done) > self.depth:
+                del s.by_msg[s.done.pop(0).msg_id]
+                s.more = True
+
+    @staticmethod
+    def _drop(s: _Sender, msg_id: int):
+        op = s.by_msg.pop(msg_id, None)
+        if op is not None:
+            s.done.remove(op)
+
+    async def _load_done(self, s: _Sender, chat_id: int, sender_id: int, min_day: int):
+        # по индексу idx_entries_sender (chat_id, sender_id, day, ts, msg_id); строки одного
+        # сообщения записаны одной заменой — у них общие ts и день
+        s.loading = []
+        try:
+            async with self.db.read() as conn:
+                async with conn.execute("""
+                    SELECT MAX(ts), msg_id, MAX(day) FROM entries
+                    WHERE chat_id=? AND sender_id=? AND day >= ?
+                    GROUP BY msg_id ORDER BY MAX(ts) DESC, msg_id DESC LIMIT ?
+                """, (chat_id, sender_id, min_day, self.depth)) as cur:
+                    rows = await cur.fetchall()
+            s.done = sorted(MessageOp(ts, msg_id, day) for ts, msg_id, day in rows)
+            s.by_msg = {op.msg_id: op for op in s.done}
+            s.loaded_from = min_day
+            s.more = len(rows) == self.depth
+            # записанное во время чтения могло не попасть в его снимок — накладываем поверх
+            for msg_id, op in s.loading:
+                self._put(s, msg_id, op if op is None or op.day >= min_day else None)
+        finally:
+            s.loading = None
+
+    def _applied(self, added: dict, removed: dict):
+        for cb in self._after_apply:
+            cb(added, removed)
+
+
+@write_op
+async def undo_tx(conn, chat_id: int, sender_id: int, msg_ids: list[int], batch: int, undone: int,
+                  keep_from: int) -> list[Row]:
+    """Удаляет строки сообщений и переносит их в undo_journal. Возвращает снятые строки."""
+    rows: list[Row] = []
+    for msg_id in msg_ids:
+        # RETURNING (SQLite 3.35+): снятые строки без отдельного SELECT
+        async with conn.execute("""
+            DELETE FROM entries WHERE chat_id=? AND msg_id=? AND sender_id=?
+            RETURNING msg_id, ts, day, amount_fen, is_discount
+        """, (chat_id, msg_id, sender_id)) as cur:
+            rows.extend(tuple(r) for r in await cur.fetchall())
+    await conn.executemany("""
+        INSERT INTO undo_journal(chat_id, sender_id, batch, msg_id, ts, day, amount_fen, is_discount, undone)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [(chat_id, sender_id, batch, *r, undone) for r in rows])
+    if keep_from:
+        await conn.execute("DELETE FROM undo_journal WHERE chat_id=? AND sender_id=? AND batch < ?",
+                           (chat_id, sender_id, keep_from))
+    return rows
+
+
+@write_op
+async def redo_tx(conn, chat_id: int, sender_id: int, batch: int, rows: list[Row]) -> list[Row]:
+    """Возвращает строки отмены batch в entries. Возвращает то, что вернулось."""
+    restored = []
+    for msg_id in sorted({r[0] for r in rows}):
+        # сообщение с тех пор правили (у него снова есть строки) — новое содержимое главнее
+        async with conn.execute("SELECT 1 FROM entries WHERE chat_id=? AND msg_id=? LIMIT 1",
+                                (chat_id, msg_id)) as cur:
+            if await cur.fetchone() is None:
+                restored.extend(r for r in rows if r[0] == msg_id)
+    await conn.executemany("""
+        INSERT INTO entries(ts, day, amount_fen, is_discount, chat_id, msg_id, sender_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, [(ts, day, fen, is_disc, chat_id, msg_id, sender_id) for msg_id, ts, day, fen, is_disc in restored])
+    await conn.execute("DELETE FROM undo_journal WHERE chat_id=? AND sender_id=? AND batch=?",
+                       (chat_id, sender_id, batch))
+    return restored
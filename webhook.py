@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import secrets
+from dataclasses import dataclass
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+from pydantic import ValidationError
+
+log = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+@dataclass
+class WebhookStats:
+    received: int = 0
+    handled: int = 0
+    rejected: int = 0     # неверный секрет или битое тело
+    refused: int = 0      # пришло во время остановки (Telegram повторит позже)
+    errors: int = 0
+    max_in_flight: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(self.__dict__)
+
+
+class WebhookServer:
+    """
+    Приём апдейтов через webhook на aiohttp. Запрос проверяется по секретному заголовку
+    (без секрета сервер не создаётся: иначе апдейт мог бы прислать кто угодно),
+    Telegram сразу получает 200, а апдейт обрабатывается в фоне — несколько апдейтов
+    идут параллельно, как при polling. При остановке новые апдейты получают 503,
+    а уже принятые дорабатываются (не дольше drain_timeout).
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, path: str = "/webhook", secret: str | None = None,
+                 drain_timeout: float = 10.0, **data):
+        if not secret:
+            raise ValueError("webhook без секрета принимал бы апдейты от кого угодно")
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.drain_timeout = drain_timeout
+        self.data = data
+        self.stats = WebhookStats()
+        self._tasks: set[asyncio.Task] = set()
+        self._draining = False
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self._handle)
+        app.router.add_get("/health", self._health)
+        return app
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        log.info("Webhook слушает %s:%s%s", host, port, self.path)
+
+    async def stop(self):
+        await self.drain()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def drain(self, timeout: float | None = None):
+        """Перестаёт принимать апдейты и дожидается уже принятых."""
+        self._draining = True
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout or self.drain_timeout)
+        if pending:
+            log.warning("Webhook: не дождались %s апдейтов при остановке", len(pending))
+            for task in pending:
+                task.cancel()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        self.stats.received += 1
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            self.stats.rejected += 1
+            return web.Response(status=401, text="Unauthorized")
+        if self._draining:
+            self.stats.refused += 1
+            return web.Response(status=503, text="Shutting down")
+        try:
+            update = Update.model_validate(await request.json(loads=self.bot.session.json_loads),
+                                           context={"bot": self.bot})
+        except (json.JSONDecodeError, ValidationError):
+            self.stats.rejected += 1
+            return web.Response(status=400, text="Bad update")
+        task = asyncio.create_task(self._feed(update), name=f"update-{update.update_id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.stats.max_in_flight = max(self.stats.max_in_flight, len(self._tasks))
+        return web.json_response({})
+
+    async def _feed(self, update: Update):
+        try:
+            result = await self.dp.feed_update(self.bot, update, **self.data)
+            if isinstance(result, TelegramMethod):
+                await self.dp.silent_call_request(self.bot, result)
+            self.stats.handled += 1
+        except Exception:
+            self.stats.errors += 1
+            log.exception("Ошибка обработки апдейта %s", update.update_id)
+
+    async def _health(self, request: web.Request) -> web.Response:
+        status = 503 if self._draining else 200
+        return web.json_response({"status": "draining" if self._draining else "ok",
+                                  "in_flight": self.in_flight, **self.stats.as_dict()}, status=status)
@@ -0,0 +1,285 @@
+"""
+Курсы по дням и пересчёт истории «что, если».
+
+Курсы, введённые в диалоге расчёта, сохраняются в day_rates (один набор на группу и день)
+вместе со ставками и надбавками группы на тот момент. По ним recompute() за любой период
+заново считает проверочные суммы в ₽ (сумма × (курс её диапазона + надбавка), как в диалоге)
+и выплаты — и по сохранённым курсам, и по альтернативным (другие курсы, границы диапазонов,
+ставки PAY_* или надбавки CHECK_ADD_*).
+
+Строки entries читаются порциями по трём колонкам (day, is_discount, amount_fen) — покрывающий
+индекс idx_entries_chat_day, сначала закрытые месяцы из архивов, — и каждая порция считается
+целиком массивами numpy. Без numpy тот же проход идёт на чистом Python.
+"""
+import math
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+from typing import Sequence
+
+import aiosqlite
+
+from archive import attached
+from dbconn import write_op
+from rates import TierTable
+
+try:  # numpy не обязателен: без него пересчёт идёт построчно
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+RECOMPUTE_CHUNK = 50_000
+
+# ключ в /whatif -> поле RateSet
+OVERRIDES = {
+    "rates": "rates",
+    "bounds": "bounds",
+    "pay_no": "pay_no",
+    "pay_disc": "pay_disc",
+    "add_no": "check_add_no",
+    "add_disc": "check_add_disc",
+}
+
+
+def _floats(text: str) -> tuple[float, ...]:
+    return tuple(float(x) for x in text.replace(" ", "").split(",") if x)
+
+
+def _join(values: Sequence[float]) -> str:
+    return ",".join(repr(float(v)) for v in values)
+
+
+@dataclass(frozen=True, slots=True)
+class RateSet:
+    """Всё, от чего зависят проверочные суммы и выплаты дня. rates пуст — курсы не известны."""
+    bounds: tuple[float, ...]     # нижние границы диапазонов по возрастанию, ¥
+    rates: tuple[float, ...]      # курс ₽/¥ для каждого диапазона
+    pay_no: float
+    pay_disc: float
+    check_add_no: float
+    check_add_disc: float
+
+    @classmethod
+    def from_dialog(cls, table: TierTable, rates: dict, cfg) -> "RateSet":
+        """Курсы из FSM диалога (ключ диапазона -> курс) и ставки группы cfg."""
+        return cls(tuple(table.bounds), tuple(float(rates[k]) for k in table.keys),
+                   cfg.pay_no, cfg.pay_disc, cfg.check_add_no, cfg.check_add_disc)
+
+    @classmethod
+    def defaults(cls, cfg) -> "RateSet":
+        """День без сохранённых курсов: только текущие ставки группы."""
+        return cls((), (), cfg.pay_no, cfg.pay_disc, cfg.check_add_no, cfg.check_add_disc)
+
+    @property
+    def has_rates(self) -> bool:
+        return bool(self.rates)
+
+    def with_overrides(self, overrides: dict, default_bounds: Sequence[float]) -> "RateSet":
+        """Набор с подменёнными полями (см. parse_overrides); курсы без границ — на границы дня."""
+        out = replace(self, **overrides)
+        if out.rates and not out.bounds:
+            out = replace(out, bounds=tuple(default_bounds))
+        if out.rates and len(out.rates) != len(out.bounds):
+            raise ValueError(f"курсов {len(out.rates)}, а диапазонов {len(out.bounds)}")
+        return out
+
+
+def parse_overrides(words: Sequence[str]) -> dict:
+    """['rates=11.7,11.8', 'pay_no=0.2'] -> {'rates': (11.7, 11.8), 'pay_no': 0.2}; ValueError — плохой ввод."""
+    out = {}
+    for word in words:
+        key, sep, value = word.partition("=")
+        if not sep or key.lower() not in OVERRIDES:
+            raise ValueError(f"не понял «{word}»; можно: {', '.join(OVERRIDES)}")
+        name = OVERRIDES[key.lower()]
+        if name in ("rates", "bounds"):
+            values = _floats(value.replace(";", ","))
+            if not values or any(v < 0 for v in values):
+                raise ValueError(f"{key}: нужен список чисел через запятую")
+            if name == "bounds":
+                TierTable.from_bounds(list(values))  # те же проверки, что у RATE_TIER_BOUNDS
+                values = tuple(sorted(values))
+            out[name] = values
+        else:
+            out[name] = float(value.replace(",", "."))
+    if "bounds" in out and "rates" not in out:
+        raise ValueError("с новыми границами (bounds=) нужны и курсы (rates=)")
+    return out
+
+
+@write_op
+async def save_rate_set(conn: aiosqlite.Connection, chat_id: int, day: int, rs: RateSet,
+                        set_by: int | None, updated: int):
+    await conn.execute("""
+        INSERT INTO day_rates(chat_id, day, bounds, rates, pay_no, pay_disc, check_add_no, check_add_disc,
+                              set_by, updated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(chat_id, day) DO UPDATE SET
+            bounds=excluded.bounds, rates=excluded.rates, pay_no=excluded.pay_no, pay_disc=excluded.pay_disc,
+            check_add_no=excluded.check_add_no, check_add_disc=excluded.check_add_disc,
+            set_by=excluded.set_by, updated=excluded.updated
+    """, (chat_id, day, _join(rs.bounds), _join(rs.rates), rs.pay_no, rs.pay_disc,
+          rs.check_add_no, rs.check_add_disc, set_by, updated))
+
+
+async def load_rate_sets(conn: aiosqlite.Connection, chat_id: int,
+                         start_day: int, end_day: int) -> dict[int, RateSet]:
+    async with conn.execute("""
+        SELECT day, bounds, rates, pay_no, pay_disc, check_add_no, check_add_disc
+        FROM day_rates WHERE chat_id=? AND day BETWEEN ? AND ?
+    """, (chat_id, start_day, end_day)) as cur:
+        return {d: RateSet(_floats(b), _floats(r), pn, pd, an, ad)
+                for d, b, r, pn, pd, an, ad in await cur.fetchall()}
+
+
+@dataclass
+class Figures:
+    check_no: float | None = None    # Σ сумма × (курс + надбавка), ₽; None — курсов за день нет
+    check_disc: float | None = None
+    payout_no: float = 0.0
+    payout_disc: float = 0.0
+
+    @property
+    def check_total(self) -> float | None:
+        return None if self.check_no is None else self.check_no + self.check_disc
+
+    @property
+    def payout_total(self) -> float:
+        return self.payout_no + self.payout_disc
+
+
+@dataclass
+class DayRecalc:
+    day: int
+    count: int
+    sum_no: int                      # фэни
+    sum_disc: int
+    figures: list[Figures] = field(default_factory=list)  # по сценариям, в порядке аргумента recompute
+
+
+class _Scenario:
+    """Наборы по дням периода в виде массивов: индекс дня -> набор, набор -> границы и курсы."""
+
+    def __init__(self, sets: Sequence[RateSet]):
+        self.sets = list(sets)
+        uniq: dict[RateSet, int] = {}
+        self.set_of_day = [uniq.setdefault(rs, len(uniq)) for rs in self.sets]
+        self.unique = list(uniq)
+        if np is None:
+            self.tables = [TierTable.from_bounds(list(rs.bounds)) if rs.has_rates else None for rs in self.unique]
+            return
+        self.add_no = np.array([rs.check_add_no for rs in self.sets])
+        self.add_disc = np.array([rs.check_add_disc for rs in self.sets])
+        # наборы с одинаковыми границами считаются одним searchsorted; строка матрицы — курсы набора
+        self.groups: list[tuple[np.ndarray, np.ndarray]] = []
+        self.group_of_day = np.full(len(self.sets), -1)
+        self.row_of_day = np.zeros(len(self.sets), dtype=np.int64)
+        by_bounds: dict[tuple[float, ...], list[RateSet]] = {}
+        for rs in self.unique:
+            if rs.has_rates:
+                by_bounds.setdefault(rs.bounds, []).append(rs)
+        for g, (bounds, members) in enumerate(by_bounds.items()):
+            self.groups.append((np.asarray(bounds), np.asarray([rs.rates for rs in members])))
+            rows = {rs: i for i, rs in enumerate(members)}
+            for d, rs in enumerate(self.sets):
+                if rs in rows:
+                    self.group_of_day[d] = g
+                    self.row_of_day[d] = rows[rs]
+
+    def check_sums(self, day_i, is_disc, amount, n_days: int):
+        """Σ сумма × (курс + надбавка) по дням для порции строк: (без скидки, со скидкой)."""
+        add = np.where(is_disc, self.add_disc[day_i], self.add_no[day_i])
+        rate = np.full(len(amount), np.nan)  # nan доживёт до итога дня: курсов нет — суммы нет
+        group = self.group_of_day[day_i]
+        for g, (bounds, matrix) in enumerate(self.groups):
+            mask = group == g
+            if not mask.any():
+                continue
+            tier = np.searchsorted(bounds, amount[mask], side="right") - 1
+            np.maximum(tier, 0, out=tier)
+            rate[mask] = matrix[self.row_of_day[day_i[mask]], tier]
+        rub = amount * (rate + add)
+        return (np.bincount(day_i, weights=np.where(is_disc, 0.0, rub), minlength=n_days),
+                np.bincount(day_i, weights=np.where(is_disc, rub, 0.0), minlength=n_days))
+
+
+async def recompute(conn: aiosqlite.Connection, chat_id: int, start_day: int, end_day: int,
+                    scenarios: Sequence[Sequence[RateSet]], archives: Sequence[Path] = (),
+                    chunk: int = RECOMPUTE_CHUNK) -> list[DayRecalc]:
+    """
+    Пересчёт группы за [start_day, end_day] по нескольким сценариям за один проход по строкам.
+    Сценарий — набор курсов на каждый день периода (scenario[d - start_day]).
+    Возвращает дни, в которых есть записи, по возрастанию.
+    """
+    n_days = end_day - start_day + 1
+    prepared = [_Scenario(sets) for sets in scenarios]
+    count = [0] * n_days
+    sum_no = [0] * n_days
+    sum_disc = [0] * n_days
+    checks = [([0.0] * n_days, [0.0] * n_days) for _ in prepared]
+    if np is not None:
+        count, sum_no, sum_disc = (np.zeros(n_days, dtype=np.int64) for _ in range(3))
+        checks = [(np.zeros(n_days), np.zeros(n_days)) for _ in prepared]
+
+    def consume(rows: list):
+        if np is not None:
+            arr = np.array(rows, dtype=np.int64)
+            day_i = arr[:, 0] - start_day
+            is_disc = arr[:, 1] != 0
+            fen = arr[:, 2]
+            count[:] += np.bincount(day_i, minlength=n_days)
+            # суммы фэней — целыми: bincount с весами считал бы во float
+            sum_disc[:] += np.bincount(day_i, weights=np.where(is_disc, fen, 0), minlength=n_days).astype(np.int64)
+            sum_no[:] += np.bincount(day_i, weights=np.where(is_disc, 0, fen), minlength=n_days).astype(np.int64)
+            amount = fen / 100
+            for sc, (ch_no, ch_disc) in zip(prepared, checks):
+                add_no, add_disc = sc.check_sums(day_i, is_disc, amount, n_days)
+                ch_no += add_no
+                ch_disc += add_disc
+            return
+        for d, is_disc, fen in rows:
+            i = d - start_day
+            count[i] += 1
+            amount = fen / 100
+            if is_disc:
+                sum_disc[i] += fen
+            else:
+                sum_no[i] += fen
+            for sc, (ch_no, ch_disc) in zip(prepared, checks):
+                table = sc.tables[sc.set_of_day[i]]
+                rs = sc.sets[i]
+                if table is None:
+                    rub = math.nan
+                else:
+                    rate = sc.unique[sc.set_of_day[i]].rates[table.index_for(amount)]
+                    rub = amount * (rate + (rs.check_add_disc if is_disc else rs.check_add_no))
+                if is_disc:
+                    ch_disc[i] += rub
+                else:
+                    ch_no[i] += rub
+
+    async def scan(table: str):
+        async with conn.execute(
+            f"SELECT day, is_discount, amount_fen FROM {table} WHERE chat_id=? AND day BETWEEN ? AND ?",
+            (chat_id, start_day, end_day)
+        ) as cur:
+            while rows := await cur.fetchmany(chunk):
+                consume(rows)
+
+    for path in archives:
+        async with attached(conn, path, read_only=True) as s:
+            await scan(f"{s}.entries")
+    await scan("main.entries")
+
+    out = []
+    for i in range(n_days):
+        if not count[i]:
+            continue
+        day = DayRecalc(start_day + i, int(count[i]), int(sum_no[i]), int(sum_disc[i]))
+        for sc, (ch_no, ch_disc) in zip(prepared, checks):
+            rs = sc.sets[i]
+            no, disc = float(ch_no[i]), float(ch_disc[i])
+            known = not (math.isnan(no) or math.isnan(disc))
+            day.figures.append(Figures(no if known else None, disc if known else None,
+                                       day.sum_no / 100 * rs.pay_no, day.sum_disc / 100 * rs.pay_disc))
+        out.append(day)
+    return out